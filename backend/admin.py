@@ -4,17 +4,27 @@ import datetime
 import os
 
 from flask import (
-    render_template, request, flash, redirect, url_for, Blueprint
+    render_template, request, flash, redirect, url_for, Blueprint, jsonify
 )
 from flask_mail import Message
 
 from backend.app import db
+from backend.banco import monitor_banco
+from backend.cache import anuncios_cache, usuarios_cache
 from backend.config import Config as config
-from backend.models import Usuario, Anuncio, Imagem, Busca
-from backend.utils import send_email
+from backend.models import Usuario, Anuncio, Imagem, Busca, Contato, Faceta
+from backend.buscas import busca_logger
+from backend.counters import view_counter
+from backend.images import remover_variantes
+from backend.notifications import dispatcher
+from backend.profiling import profiler
+from backend.tasks import (
+    recalcular_busca, reconstruir_facetas, atualizar_relatorio_buscas
+)
+from backend.utils import send_email, create_identity
 
 admin_bp = Blueprint('admin', __name__, template_folder='templates/admin')
-data = {}
+ABAS = ['anuncios', 'usuarios', 'buscas', 'contatos']
 
 
 def _deletar_imagens(anuncio):
@@ -26,6 +36,7 @@ def _deletar_imagens(anuncio):
         anuncio (Anuncio): the Anuncio that the images will be deleted
     """
     if anuncio.imagens:
+        remover_variantes([imagem.id for imagem in anuncio.imagens])
         for imagem in anuncio.imagens:
             if os.path.exists('static/' + imagem.img_filename):
                 # Removing images
@@ -38,19 +49,100 @@ def _deletar_imagens(anuncio):
         os.rmdir(path_to_remove)
 
 
+def _ler_data(nome):
+    """
+    Reads a date filter in the YYYY-MM-DD format
+
+    Args:
+        nome (str): name of the request param
+
+    Returns:
+        (datetime.datetime): the date or None if missing or invalid
+    """
+    try:
+        return datetime.datetime.strptime(request.values.get(nome, ''),
+                                          '%Y-%m-%d')
+    except ValueError:
+        return None
+
+
+def _filtrar_periodo(query, coluna, filtros):
+    """
+    Filters the query by the de/ate dates, both inclusive
+    """
+    if filtros['de']:
+        query = query.filter(coluna >= filtros['de'])
+    if filtros['ate']:
+        query = query.filter(coluna < filtros['ate'] + datetime.timedelta(1))
+    return query
+
+
+def _query_anuncios(filtros):
+    query = Anuncio.query_completa()
+    if filtros['situacao'] == 'pendentes':
+        query = query.filter(Anuncio.aprovado.isnot(True))
+    elif filtros['situacao'] == 'aprovados':
+        query = query.filter(Anuncio.aprovado.is_(True))
+    if filtros['estado']:
+        query = query.filter(Anuncio.estado_veiculo == filtros['estado'])
+    query = _filtrar_periodo(query, Anuncio.criado_em, filtros)
+    return query.order_by(Anuncio.criado_em.desc(), Anuncio.id.desc())
+
+
+def _query_usuarios(filtros):
+    # The counts of ads come from the counters kept on the Usuario
+    query = db.session.query(Usuario)
+    if filtros['estado']:
+        query = query.filter(Usuario.estado == filtros['estado'])
+    query = _filtrar_periodo(query, Usuario.cadastrado_em, filtros)
+    return query.order_by(Usuario.id)
+
+
+def _query_buscas(filtros):
+    query = db.session.query(Busca)
+    query = _filtrar_periodo(query, Busca.buscado_em, filtros)
+    return query.order_by(Busca.id.desc())
+
+
+def _query_contatos(filtros):
+    query = db.session.query(Contato)
+    query = _filtrar_periodo(query, Contato.timestamp, filtros)
+    return query.order_by(Contato.id.desc())
+
+
 @admin_bp.route(config.API_VERSION + 'admin')
 def index():
     """
     Main view for the admin area.
+    Shows one page of one tab (anuncios, usuarios, buscas or contatos),
+    filtered by situacao (pendentes/aprovados), estado and the de/ate dates.
+    Each tab costs a fixed number of queries: the count of the pagination,
+    the page itself and, for anuncios, the batch load of images and users.
     """
-    data['usuarios'] = db.session.query(Usuario).order_by('id')
-    for usuario in data['usuarios']:
-        usuario.qtd_anuncios = len(usuario.anuncios)
-    order_by = Anuncio.criado_em.desc()
-    data['anuncios'] = db.session.query(Anuncio).order_by(order_by)
-    data['buscas'] = db.session.query(Busca)
+    aba = request.values.get('aba', 'anuncios')
+    if aba not in ABAS:
+        aba = 'anuncios'
+    filtros = {
+        'situacao': request.values.get('situacao', ''),
+        'estado': request.values.get('estado', ''),
+        'de': _ler_data('de'), 'ate': _ler_data('ate')
+    }
+    pagina = request.values.get('pagina', 1, type=int)
+    queries = {
+        'anuncios': _query_anuncios, 'usuarios': _query_usuarios,
+        'buscas': _query_buscas, 'contatos': _query_contatos
+    }
+    paginacao = queries[aba](filtros).paginate(
+        pagina, config.ADMIN_POR_PAGINA, error_out=False
+    )
+    # Keeps the filters in the links of the pages and tabs
+    params = {
+        'situacao': filtros['situacao'], 'estado': filtros['estado'],
+        'de': request.values.get('de', ''), 'ate': request.values.get('ate', '')
+    }
 
-    return render_template('admin.html', data=data)
+    return render_template('admin.html', aba=aba, abas=ABAS,
+                           paginacao=paginacao, params=params)
 
 
 @admin_bp.route(config.API_VERSION + 'admin/deletar_anuncio')
@@ -62,8 +154,12 @@ def deletar_anuncio():
     anuncio = db.session.query(Anuncio).filter_by(id=anuncio_id).first()
     # Removing images
     _deletar_imagens(anuncio)
+    Faceta.atualizar(anuncio.facetas(), [])
+    Usuario.atualizar_contadores(anuncio.usuario_id, anuncio.contadores(),
+                                 None)
     db.session.delete(anuncio)
     db.session.commit()
+    anuncios_cache.clear()
     flash('Anuncio {} deletado com sucesso'.format(anuncio_id))
 
     return redirect(url_for('admin.index'))
@@ -80,18 +176,23 @@ def aprovar_reprovar_anuncio():
     anuncio_id = request.values.get('anuncio_id')
     anuncio = db.session.query(Anuncio).filter_by(id=anuncio_id).first()
     aprovar_reprovar = request.values.get('aprovar_reprovar')
+    facetas = anuncio.facetas()
+    contadores = anuncio.contadores()
     anuncio.aprovado = True if aprovar_reprovar == 'aprovar' else False
     anuncio.aprovado_em = datetime.datetime.now()
+    Faceta.atualizar(facetas, anuncio.facetas())
+    Usuario.atualizar_contadores(anuncio.usuario_id, contadores,
+                                 anuncio.contadores())
     db.session.add(anuncio)
     db.session.commit()
+    anuncios_cache.clear()
 
+    titulo = 'Anuncio Aprovado' if anuncio.aprovado else 'Anuncio Reprovado'
     # Send the approval/reproval email to the user
     if config.ENVIAR_EMAILS:
         if anuncio.aprovado is True:
-            titulo = 'Anuncio Aprovado'
             html = render_template('anuncio-aprovado.html', anuncio=anuncio)
         else:
-            titulo = 'Anuncio Reprovado'
             html = 'Seu anuncio\nfoi\nreprovado'
         msg = Message(titulo,
                       sender='atendimento@clozer.com.br',
@@ -111,12 +212,18 @@ def editar_anuncio():
     """
     anuncio_id = request.values.get('anuncio_id')
     anuncio = db.session.query(Anuncio).filter_by(id=anuncio_id).first()
+    facetas = anuncio.facetas()
+    contadores = anuncio.contadores()
     for key, val in request.values.items():
         setattr(anuncio, key, val)
     anuncio.troca = True if request.values.get('troca', False) else False
-    anuncio.query_busca = anuncio.criar_query_busca()
+    anuncio.atualizar_busca()
+    Faceta.atualizar(facetas, anuncio.facetas())
+    Usuario.atualizar_contadores(anuncio.usuario_id, contadores,
+                                 anuncio.contadores())
     db.session.add(anuncio)
     db.session.commit()
+    anuncios_cache.clear()
     flash('Anuncio {} editado com sucesso'.format(anuncio_id))
 
     return redirect(url_for('admin.index'))
@@ -130,15 +237,23 @@ def deletar_usuario():
     usuario_id = request.values.get('usuario_id')
     usuario = db.session.query(Usuario).filter_by(id=usuario_id).first()
     anuncios = db.session.query(Anuncio).filter_by(usuario_id=usuario.id)
-    anuncios_id = [anuncio.id for anuncio in anuncios]
+    anuncios_lista = anuncios.all()
+    anuncios_id = [anuncio.id for anuncio in anuncios_lista]
+    facetas = [f for anuncio in anuncios_lista for f in anuncio.facetas()]
+    Faceta.atualizar(facetas, [])
+    # The counters of the Usuario are deleted with it, nothing to update
     _filter = Imagem.anuncio_id.in_(anuncios_id)
     imagens = db.session.query(Imagem).filter(_filter)
+    remover_variantes([imagem_id for imagem_id, in
+                       imagens.with_entities(Imagem.id)])
     # Removing images - bulk dlete
     imagens.delete(synchronize_session=False)
     # Removing anuncios - bulk delete
     anuncios.delete(synchronize_session=False)
     db.session.delete(usuario)
     db.session.commit()
+    anuncios_cache.clear()
+    usuarios_cache.delete(create_identity(usuario))
     flash('Usuario {} deletado com sucesso.'.format(usuario_id))
 
     return redirect(url_for('admin.index'))
@@ -152,10 +267,12 @@ def editar_usuario():
     """
     usuario_id = request.values.get('usuario_id')
     usuario = db.session.query(Usuario).filter_by(id=usuario_id).first()
+    usuarios_cache.delete(create_identity(usuario))
     for key, val in request.values.items():
         setattr(usuario, key, val)
     db.session.add(usuario)
     db.session.commit()
+    anuncios_cache.clear()
     flash('Usuario {} editado com sucesso'.format(usuario_id))
 
     return redirect(url_for('admin.index'))
@@ -164,13 +281,95 @@ def editar_usuario():
 @admin_bp.route(config.API_VERSION + 'admin/atualizar_query_busca')
 def atualizar_query_busca():
     """
-    View that updates the query_busca to facilitate the Anuncio search
+    View that updates the query_busca to facilitate the Anuncio search.
+    It runs for up to ADMIN_SEGUNDOS_TAREFA, a new request resumes it.
     """
-    anuncios = db.session.query(Anuncio).all()
-    for anuncio in anuncios:
-        anuncio.query_busca = anuncio.criar_query_busca()
-        db.session.add(anuncio)
-    db.session.commit()
-    flash('Querys busca atualizadas com sucesso')
+    processados, total, terminou = recalcular_busca(
+        max_segundos=config.ADMIN_SEGUNDOS_TAREFA
+    )
+    if terminou:
+        flash('Querys busca atualizadas com sucesso')
+    else:
+        flash('Querys busca atualizadas em {} de {} anuncios. '
+              'Clique novamente para continuar'.format(processados, total))
+
+    return redirect(url_for('admin.index'))
+
+
+@admin_bp.route(config.API_VERSION + 'admin/atualizar_facetas')
+def atualizar_facetas():
+    """
+    View that rebuilds the facets of the search from the approved Anuncios
+    """
+    total = reconstruir_facetas()
+    flash('Facetas reconstruidas: {} valores'.format(total))
 
     return redirect(url_for('admin.index'))
+
+
+@admin_bp.route(config.API_VERSION + 'admin/relatorio_buscas')
+def relatorio_buscas():
+    """
+    View that shows the report of the Buscas, read from the rollups
+    """
+    relatorio = Busca.relatorio(config.RELATORIO_BUSCAS_HORAS,
+                                config.RELATORIO_BUSCAS_DIAS,
+                                config.RELATORIO_BUSCAS_LIMITE)
+
+    return render_template('relatorio_buscas.html', relatorio=relatorio)
+
+
+@admin_bp.route(config.API_VERSION + 'admin/atualizar_relatorio_buscas')
+def atualizar_relatorio():
+    """
+    View that adds the new Buscas to the report.
+    It runs for up to ADMIN_SEGUNDOS_TAREFA, a new request resumes it.
+    """
+    processadas, terminou = atualizar_relatorio_buscas(
+        max_segundos=config.ADMIN_SEGUNDOS_TAREFA
+    )
+    if terminou:
+        flash('Relatorio atualizado com {} buscas'.format(processadas))
+    else:
+        flash('Relatorio atualizado com {} buscas. '
+              'Clique novamente para continuar'.format(processadas))
+
+    return redirect(url_for('admin.relatorio_buscas'))
+
+
+@admin_bp.route(config.API_VERSION + 'admin/perfis')
+def perfis():
+    """
+    View that lists the profiles of the requests kept by this process
+    """
+    return render_template('perfis.html', perfis=profiler.perfis(),
+                           ativo=profiler.ativo, header=profiler.header)
+
+
+@admin_bp.route(config.API_VERSION + 'admin/perfis/<int:perfil_id>')
+def perfil(perfil_id):
+    """
+    View that shows one profile with its statements and cProfile stats
+    """
+    perfil = profiler.perfil(perfil_id)
+    if perfil is None:
+        erro = 'Perfil {} nao existe'.format(perfil_id)
+        return jsonify({'erro': erro}), 404
+
+    return jsonify(perfil)
+
+
+@admin_bp.route(config.API_VERSION + 'admin/estatisticas')
+def estatisticas():
+    """
+    View that shows the statistics of the caches, background workers and
+    database connections
+    """
+    return jsonify({
+        'cache_anuncios': anuncios_cache.estatisticas(),
+        'cache_usuarios': usuarios_cache.estatisticas(),
+        'views_pendentes': view_counter.pendentes(),
+        'log_buscas': busca_logger.estatisticas(),
+        'notificacoes': dispatcher.estatisticas(),
+        'banco': monitor_banco.estatisticas()
+    })
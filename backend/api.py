@@ -1,14 +1,15 @@
 """ Module that handles all API endpoints """
 
+import json
 import locale
-import os
 import shutil
 
-from io import BytesIO
-from PIL import Image
+from datetime import timezone
 
-from flask import render_template, Blueprint
+from flask import (render_template, Blueprint, send_file, request,
+                   Response, stream_with_context)
 from flask_restful import Resource, abort
+from flask_restful.representations.json import output_json
 from flask_mail import Message
 from flask_jwt_extended import (create_access_token, create_refresh_token,
                                 jwt_required, jwt_refresh_token_required,
@@ -17,11 +18,18 @@ from werkzeug import FileStorage, exceptions
 
 from backend.config import Config as config
 from backend.app import db
-from backend.models import Usuario, Anuncio, Imagem, Contato, Busca
+from backend.buscas import busca_logger
+from backend.cache import anuncios_cache, usuarios_cache
+from backend.counters import view_counter
+from backend.images import (
+    upload_images, caminho_variante, largura_variante, remover_variantes
+)
+from backend.models import Usuario, Anuncio, Imagem, Contato, Busca, Faceta
+from backend.sugestoes import sugestoes
 
 from backend.utils import (
     get_parser, get_current_user, create_identity, send_to_slack, send_email,
-    log
+    log, decode_cursor, get_optional_user_id, gerar_etag
 )
 
 api_bp = Blueprint('api', __name__)
@@ -31,8 +39,21 @@ ANUNCIO_ARGS_LIST = [
     'titulo', 'descricao', 'valor', 'cidade_veiculo', 'estado_veiculo',
     'troca', 'leilao', 'marca', 'modelo', 'cor', 'ano'
 ]
-ANUNCIOS_ARGS_LIST = ['limit', 'order_by']
-BUSCA_ARGS_LIST = ['query', 'limit', 'order_by']
+FILTROS_ANUNCIO = [
+    'valor_min', 'valor_max', 'ano_min', 'ano_max', 'marca', 'modelo',
+    'estado_veiculo', 'cidade_veiculo', 'troca', 'leilao'
+]
+ANUNCIOS_ARGS_LIST = [
+    'limit', 'order_by', 'cursor', 'format'
+] + FILTROS_ANUNCIO
+LISTAGEM_ARGS_LIST = ['format']
+# Values of the format GET param of the streamed listings
+FORMATOS_STREAMING = ['ndjson', 'stream']
+BUSCA_ARGS_LIST = [
+    'query', 'limit', 'order_by', 'cursor', 'facetas'
+] + FILTROS_ANUNCIO
+SUGESTOES_ARGS_LIST = ['query', 'limit']
+RELATORIO_BUSCAS_ARGS_LIST = ['horas', 'dias', 'limit']
 CONTATO_ARGS_LIST = ['nome', 'contato', 'texto']
 USUARIO_ARGS_LIST = [
     'facebook_id', 'nome', 'email', 'tipo', 'cidade', 'estado', 'telefone'
@@ -55,11 +76,18 @@ class ContatosResource(Resource):
     """
     def get(self):
         """
-        List all Contato
+        List all Contato.
+        With format=ndjson or format=stream the Contatos are streamed as
+        they are read, see resposta_streaming.
 
         Returns:
-            (dict): Containing all Contatos as JSON
+            (list): Containing all Contatos as JSON
         """
+        parser = get_parser(LISTAGEM_ARGS_LIST)
+        formato = parser.parse_args()['format']
+        if formato in FORMATOS_STREAMING:
+            contatos = Contato.iterar_json(config.STREAM_LOTE)
+            return resposta_streaming(contatos, formato)
         return Contato.get_all(parsed=True)
 
 
@@ -131,16 +159,54 @@ class AnunciosResource(Resource):
     def get(self):
         """
         Lit all Anuncios.
-        It can receive limit and order_by as GET params
+        It can receive limit, order_by, cursor and the FILTROS_ANUNCIO
+        (valor_min, valor_max, ano_min, ano_max, marca, modelo,
+        estado_veiculo, cidade_veiculo, troca and leilao) as GET params.
+        When limit is supplied the response brings the next_cursor
+        to fetch the following page. It is capped at PAGINA_MAXIMA.
+        The responses are kept in anuncios_cache already serialized, except
+        the random ones, with an ETag computed from the body.
+        With format=ndjson or format=stream all the Anuncios matching the
+        filters are streamed, most recent first, and limit, order_by and
+        cursor are not used. See resposta_streaming.
 
         Returns:
-            (dict): Dict containing all Anuncios as JSON
+            (flask.Response): The Anuncios as JSON and the next_cursor,
+                              or 304 if the client has them
+
+        Raises:
+            (HTTPException): if limit is not positive or cursor is invalid
         """
         parser = get_parser(ANUNCIOS_ARGS_LIST)
         args = parser.parse_args()
-        anuncios = Anuncio.get(args['order_by'], args['limit'])
-
-        return {'anuncios': anuncios}
+        filtros = ler_filtros(args)
+        if args['format'] in FORMATOS_STREAMING:
+            anuncios = Anuncio.iterar_json(config.STREAM_LOTE, filtros)
+            return resposta_streaming(anuncios, args['format'], 'anuncios',
+                                      {'next_cursor': None})
+        limit = ler_positivo(args, 'limit', None, config.PAGINA_MAXIMA)
+        chave = (args['order_by'], limit, args['cursor'],
+                 tuple(sorted(filtros.items())))
+        if args['order_by'] == 'random':
+            anuncios, _ = Anuncio.get(args['order_by'], limit, None, filtros)
+            return {'anuncios': anuncios, 'next_cursor': None}
+
+        cache = anuncios_cache.get(chave)
+        if cache is None:
+            cursor = parse_cursor(args['cursor'])
+            anuncios, next_cursor = Anuncio.get(args['order_by'], limit,
+                                                cursor, filtros)
+            corpo = resposta_json(
+                {'anuncios': anuncios, 'next_cursor': next_cursor}
+            ).get_data()
+            cache = (corpo, gerar_etag(corpo))
+            anuncios_cache.set(chave, cache)
+
+        corpo, etag = cache
+        if nao_modificado(etag):
+            return cabecalhos_cache(Response(status=304), etag)
+        return cabecalhos_cache(Response(corpo, mimetype='application/json'),
+                                etag)
 
 
 class AnuncioResource(Resource):
@@ -149,24 +215,33 @@ class AnuncioResource(Resource):
     """
     def get(self, id):
         """
-        Gets the Anuncio with the supplied id
+        Gets the Anuncio with the supplied id and counts the view.
+        The views are written in background by the view_counter.
+        The ETag comes from Anuncio.versao, so a client with the current
+        version gets a 304 before the Anuncio is loaded.
 
         Args:
             id (int): The id of the Anuncio
 
         Returns:
-            (dict): Containing the Anuncio as JSON
+            (flask.Response): Containing the Anuncio as JSON or 304
 
         Raises:
             (HTTPException): if the Anuncio does not exist
         """
-        anuncio = Anuncio.get_first(id=id)
-        if not anuncio:
+        versao = Anuncio.versao(id)
+        if versao:
+            view_counter.incrementar(Anuncio, id)
+            etag, modificado = versao
+            if nao_modificado(etag, modificado):
+                return cabecalhos_cache(Response(status=304), etag,
+                                        modificado)
+            anuncio = Anuncio.query_completa().filter(Anuncio.id == id).first()
+        if not versao or not anuncio:
             abort(404, erro="Anuncio de id {} nao existe".format(id))
-        anuncio.views = anuncio.views + 1
-        Anuncio.update_or_insert(anuncio)
 
-        return {'anuncio': anuncio.to_json()}
+        return cabecalhos_cache(resposta_json({'anuncio': anuncio.to_json()}),
+                                etag, modificado)
 
     @jwt_required
     def post(self):
@@ -186,9 +261,7 @@ class AnuncioResource(Resource):
                             type=FileStorage, action='append')
         args = parser.parse_args()
         usuario_logado_id = get_current_user()['id']
-        usuario = Usuario.get_first(id=usuario_logado_id)
-        if usuario and len(usuario.anuncios) >= config.LIMITE_ANUNCIOS_FREE:
-            raise CustomException
+        usuario = get_usuario_logado()
         anuncio = Anuncio(usuario_logado_id, '', '', 0)
         for arg_name, arg_value in args.items():
             if arg_name == 'imagens':
@@ -198,6 +271,12 @@ class AnuncioResource(Resource):
                     setattr(anuncio, arg_name, bool(arg_value))
                 else:
                     setattr(anuncio, arg_name, arg_value)
+        anuncio.atualizar_busca()
+        # The quota is checked against the counter while incrementing it
+        if usuario and not Usuario.atualizar_contadores(
+                usuario_logado_id, None, anuncio.contadores(),
+                limite=config.LIMITE_ANUNCIOS_FREE):
+            raise CustomException
         Anuncio.update_or_insert(anuncio)
 
         # Add images
@@ -256,6 +335,8 @@ class AnuncioResource(Resource):
             abort(404, erro='Criador do anuncio nao eh este usuario')
 
         args = parser.parse_args()
+        facetas = anuncio.facetas()
+        contadores = anuncio.contadores()
         for arg_name, arg_value in args.items():
             print(1, arg_name, 2, arg_value)
             if arg_value:
@@ -264,7 +345,13 @@ class AnuncioResource(Resource):
                 else:
                     setattr(anuncio, arg_name, arg_value)
         anuncio.aprovado = False
+        anuncio.atualizar_busca()
+        # Back to pending, it leaves the facets until approved again
+        Faceta.atualizar(facetas, anuncio.facetas())
+        Usuario.atualizar_contadores(anuncio.usuario_id, contadores,
+                                     anuncio.contadores())
         Anuncio.update_or_insert(anuncio)
+        anuncios_cache.clear()
         log('Anuncio PUT', anuncio)
 
         return {anuncio.id: anuncio.to_json()}
@@ -292,13 +379,18 @@ class AnuncioResource(Resource):
         if anuncio.usuario_id != usuario_logado_id:
             abort(404, erro='Criador do anuncio nao eh este usuario')
         # Deleting images
+        remover_variantes([imagem.id for imagem in anuncio.imagens])
         for imagem in anuncio.imagens:
             Imagem.delete(imagem)
         path_usuario = '{}/{}'.format(config.IMAGE_DIR, usuario_logado_id)
         path_anuncio = '{}/{}'.format(path_usuario, anuncio.id)
         shutil.rmtree(path_anuncio)
         log('Anuncio DELETE', anuncio)
+        Faceta.atualizar(anuncio.facetas(), [])
+        Usuario.atualizar_contadores(anuncio.usuario_id,
+                                     anuncio.contadores(), None)
         Anuncio.delete(anuncio)
+        anuncios_cache.clear()
 
         return {}
 
@@ -313,10 +405,17 @@ class UsuariosResource(Resource):
     def get(self):
         """
         Lit all Usuarios.
+        With format=ndjson or format=stream the Usuarios are streamed as
+        they are read, see resposta_streaming.
 
         Returns:
             (dict): Dict containing all usuarios as JSON
         """
+        parser = get_parser(LISTAGEM_ARGS_LIST)
+        formato = parser.parse_args()['format']
+        if formato in FORMATOS_STREAMING:
+            usuarios = Usuario.iterar_json(config.STREAM_LOTE)
+            return resposta_streaming(usuarios, formato, 'usuarios')
         usuarios = Usuario.get_all(parsed=True)
         return {'usuarios': usuarios}
 
@@ -327,25 +426,33 @@ class UsuarioResource(Resource):
     """
     def get(self, id):
         """
-        Gets the Usuario with the supplied id and
-        increments its views
+        Gets the Usuario with the supplied id and counts the view.
+        The views are written in background by the view_counter.
+        The ETag comes from Usuario.versao, so a client with the current
+        version gets a 304 before the Usuario is loaded.
 
         Args:
-            id (int): The id of the Usuario
+            id (int): The id or the facebook_id of the Usuario
 
         Returns:
-            (dict): Containing the Usuario as JSON
+            (flask.Response): Containing the Usuario as JSON or 304
 
         Raises:
             (HTTPException): if the Usuario does not exist
         """
-        usuario = Usuario.get(id)
-        if not usuario:
+        versao = Usuario.versao(id)
+        if versao:
+            usuario_id, etag, modificado = versao
+            view_counter.incrementar(Usuario, usuario_id)
+            if nao_modificado(etag, modificado):
+                return cabecalhos_cache(Response(status=304), etag,
+                                        modificado)
+            usuario = Usuario.get(usuario_id)
+        if not versao or not usuario:
             abort(404, erro="Usuario {} nao existe".format(id))
-        usuario.views = usuario.views + 1
-        Usuario.update_or_insert(usuario)
 
-        return {'usuario': usuario.to_json()}
+        return cabecalhos_cache(resposta_json({'usuario': usuario.to_json()}),
+                                etag, modificado)
 
     def post(self):
         """
@@ -415,8 +522,11 @@ class UsuarioResource(Resource):
                              If the user tries to update another user
         """
         parser = get_parser(USUARIO_ARGS_LIST)
-        usuario = Usuario.get_first(id=id)
         usuario_logado_id = get_current_user()['id']
+        if str(id) == str(usuario_logado_id):
+            usuario = get_usuario_logado()
+        else:
+            usuario = Usuario.get_first(id=id)
         if not usuario:
             abort(404, erro="Usuario de id {} nao existe".format(id))
         if usuario.id != usuario_logado_id:
@@ -427,6 +537,9 @@ class UsuarioResource(Resource):
                 setattr(usuario, arg_name, arg_value)
 
         Usuario.update_or_insert(usuario)
+        usuarios_cache.delete(get_jwt_identity())
+        # The Usuario is embedded in the listed Anuncios
+        anuncios_cache.clear()
         log('Usuario PUT', usuario)
 
         return {usuario.id: usuario.to_json()}
@@ -515,77 +628,360 @@ class ImagemResource(Resource):
         if anuncio.usuario_id != usuario_logado_id:
             abort(404, erro='Criador do anuncio nao eh este usuario')
         imagem = db.session.query(Imagem).filter_by(id=id).first()
+        Anuncio.tocar(anuncio.id)
+        remover_variantes([imagem.id])
         Imagem.delete(imagem)
+        # The Imagens are embedded in the listed Anuncios
+        anuncios_cache.clear()
         log('Imagem DELETE', imagem)
 
         return {}
 
 
+class ImagemVarianteResource(Resource):
+    """
+    Resource that serves the Imagem resized to one of the IMAGE_VARIANTES
+    """
+    def get(self, id, largura):
+        """
+        Sends the variant of the Imagem with the width closest to largura.
+        The variants are created on the first request and kept in a disk
+        cache. The response has an ETag and can be cached by the clients.
+
+        Args:
+            id (int): The id of the Imagem
+            largura (int): The width wanted
+
+        Returns:
+            (flask.Response): The JPEG or 304 if the client has it
+
+        Raises:
+            (HTTPException): if the Imagem does not exist or is not processed
+        """
+        imagem = Imagem.get_first(id=id)
+        if not imagem or imagem.status != Imagem.PRONTA:
+            abort(404, erro="Imagem de id {} nao existe".format(id))
+        caminho = caminho_variante(imagem, largura_variante(largura))
+        if not caminho:
+            abort(404, erro="Imagem de id {} nao existe".format(id))
+        response = send_file(
+            caminho, mimetype='image/jpeg', conditional=True,
+            cache_timeout=config.IMAGE_VARIANTES_MAX_AGE
+        )
+        response.cache_control.public = True
+
+        return response
+
+
 class BuscaResource(Resource):
     """
     Resource that handles our search
     """
     def get(self):
         """
-        Performs a text search on our Anuncios and saves the query searched.
-        It can receive limit and order_by as GET params.
+        Performs a text search on our Anuncios and logs the query searched,
+        with the id of the user if the JWT is sent. The log is saved in
+        background by the busca_logger.
+        It can receive limit, order_by, cursor, facetas and the
+        FILTROS_ANUNCIO as GET params.
+        The results are ranked by relevance unless order_by is supplied.
+        The 'recentes' order is paginated with the returned next_cursor.
+        limit is capped at PAGINA_MAXIMA.
+        With facetas=1 the response also brings the counts per marca,
+        modelo, faixa_ano, estado_veiculo and faixa_valor of the Anuncios
+        found. Without a query, only the facets are returned: those of all
+        approved Anuncios are read from the faceta table.
 
         Returns:
-            (dict): Containing approved Anuncios that matched the search
+            (dict): Containing approved Anuncios that matched the search,
+                    the next_cursor and the facetas if asked
+
+        Raises:
+            (HTTPException): if the query is not informed or limit is not
+                             positive
         """
         parser = get_parser(BUSCA_ARGS_LIST)
         args = parser.parse_args()
-        query_usuario = args['query'].strip().replace(' ', ' & ')
-        limit = ' LIMIT {}'.format(args['limit'])
-        anuncios = Anuncio.buscar(query_usuario, args['order_by'], limit)
-        # TODO: Find a way to get the usuario_logado_id
-        usuario_logado_id = 0
-        # Saving the search
-        busca = Busca(usuario_logado_id, query_usuario)
-        Busca.update_or_insert(busca)
-        log('Busca', busca)
+        filtros = ler_filtros(args)
+        if not args['query'] or not args['query'].strip():
+            if args['facetas'] and filtros:
+                return {'facetas': Faceta.contar(
+                    Anuncio.filtro_busca(None, filtros)
+                )}
+            if args['facetas']:
+                return {'facetas': Faceta.get()}
+            abort(400, erro='Informe o texto da busca')
+        query_usuario = args['query'].strip()
+        limit = ler_positivo(args, 'limit', None, config.PAGINA_MAXIMA)
+        cursor = parse_cursor(args['cursor'])
+        anuncios, next_cursor = Anuncio.buscar(
+            query_usuario, args['order_by'], limit, cursor, filtros
+        )
+        resposta = {'anuncios': anuncios, 'next_cursor': next_cursor}
+        if args['facetas']:
+            filtro = Anuncio.filtro_busca(query_usuario, filtros)
+            resposta['facetas'] = Faceta.contar(filtro)
+        usuario_logado_id = get_optional_user_id()
+        busca_logger.registrar(usuario_logado_id, query_usuario,
+                               len(anuncios))
+        log('Busca', usuario_logado_id, query_usuario)
+
+        return resposta
+
+
+class RelatorioBuscasResource(Resource):
+    """
+    Resource that handles the report of the Buscas
+    """
+    def get(self):
+        """
+        Gets the Buscas per hour and per day, the terms most searched and
+        those without results, from the rollup tables.
+        It can receive horas, dias and limit as GET params.
+
+        Returns:
+            (dict): Containing the report, see Busca.relatorio
+        """
+        parser = get_parser(RELATORIO_BUSCAS_ARGS_LIST)
+        args = parser.parse_args()
+        return Busca.relatorio(
+            ler_positivo(args, 'horas', config.RELATORIO_BUSCAS_HORAS,
+                         config.RELATORIO_BUSCAS_HORAS_MAXIMO),
+            ler_positivo(args, 'dias', config.RELATORIO_BUSCAS_DIAS,
+                         config.RELATORIO_BUSCAS_DIAS_MAXIMO),
+            ler_positivo(args, 'limit', config.RELATORIO_BUSCAS_LIMITE,
+                         config.RELATORIO_BUSCAS_LIMITE_MAXIMO)
+        )
+
+
+class SugestoesResource(Resource):
+    """
+    Resource that handles the search-as-you-type suggestions
+    """
+    def get(self):
+        """
+        Suggests completions for the text typed, from the popular searches
+        and the marca and modelo of the Anuncios.
+        It can receive query and limit as GET params, limit capped at
+        SUGESTOES_LIMITE.
+        The suggestions come from memory, without querying the database.
+
+        Returns:
+            (dict): Containing the suggestions, the most popular first
 
-        return {'anuncios': anuncios}
+        Raises:
+            (HTTPException): if limit is not positive
+        """
+        parser = get_parser(SUGESTOES_ARGS_LIST)
+        args = parser.parse_args()
+        limit = ler_positivo(args, 'limit', None, config.SUGESTOES_LIMITE)
+        return {'sugestoes': sugestoes.sugerir(args['query'], limit)}
 
 
-def upload_images(anuncio, imagens):
+def parse_cursor(cursor):
     """
-    Auxiliary function that creates all necessary directories and
-    uploads images for the Anuncio.
+    Auxiliary function that decodes the cursor GET param
 
     Args:
-        anuncio (Anuncio): the Anuncio object
-        imagens (list): List of images o be inserted
-    """
-    usuario_id = anuncio.usuario_id
-    anuncio_id = anuncio.id
-    size = config.IMAGE_WIDTH, config.IMAGE_HEIGHT
-    path_usuario = '{}/{}'.format(config.IMAGE_DIR, usuario_id)
-    path_anuncio = '{}/{}'.format(path_usuario, anuncio_id)
-    # Creating the user file directory
-    if not os.path.exists(path_usuario):
-        os.makedirs(path_usuario)
-        os.makedirs(path_anuncio)
-    # Creating the anuncio file directory
-    if not os.path.exists(path_anuncio):
-        os.makedirs(path_anuncio)
-
-    for index, file in enumerate(imagens):
-        img = Image.open(BytesIO(file.read()))
-        # Resizing
-        wpercent = (config.IMAGE_WIDTH / float(img.size[0]))
-        height = int((float(img.size[1]) * float(wpercent)))
-        size = config.IMAGE_WIDTH, height
-        img = img.resize(size, Image.ANTIALIAS)
-        full_path = '{}/{}.jpg'.format(path_anuncio, 'imagem' + str(index))
-        quality_val = 90
-        img.convert('RGB').save(full_path, 'JPEG', quality=quality_val)
-        # Saving to database
-        Imagem.add_image({
-            'anuncio_id': anuncio_id,
-            'img_filename': full_path
-        })
-    log('upload_images', anuncio_id, full_path)
+        cursor (str): the cursor received, if any
+
+    Returns:
+        (tuple): The decoded cursor or None
+
+    Raises:
+        (HTTPException): If the cursor is invalid
+    """
+    if not cursor:
+        return None
+    try:
+        return decode_cursor(cursor)
+    except ValueError:
+        abort(400, erro='Cursor {} invalido'.format(cursor))
+
+
+def ler_positivo(args, nome, padrao, maximo):
+    """
+    Auxiliary function that validates a GET param that must be positive
+
+    Args:
+        args (dict): the parsed GET params
+        nome (str): name of the GET param
+        padrao (int): value when it is not supplied
+        maximo (int): larger values are capped to it
+
+    Returns:
+        (int): The value received, capped, or padrao
+
+    Raises:
+        (HTTPException): If the value is not positive
+    """
+    valor = args.get(nome)
+    if valor is None:
+        return padrao
+    if valor <= 0:
+        abort(400, erro='{} deve ser maior que zero'.format(nome))
+    return min(valor, maximo)
+
+
+def ler_filtros(args):
+    """
+    Auxiliary function that picks the FILTROS_ANUNCIO received
+
+    Args:
+        args (dict): the parsed GET params
+
+    Returns:
+        (dict): Containing the filters supplied and their values
+    """
+    return {
+        filtro: args[filtro] for filtro in FILTROS_ANUNCIO
+        if args.get(filtro) is not None and args[filtro] != ''
+    }
+
+
+def resposta_json(dados):
+    """
+    Auxiliary function that serializes the JSON as flask_restful does,
+    for the responses that need the body before being returned
+
+    Args:
+        dados (dict): the JSON of the response
+
+    Returns:
+        (flask.Response): the response with the serialized JSON
+    """
+    response = output_json(dados, 200)
+    response.mimetype = 'application/json'
+    return response
+
+
+def get_usuario_logado():
+    """
+    Auxiliary function that gets the Usuario of the JWT in the jwt_required
+    handlers. The Usuario is kept detached in usuarios_cache, keyed by the
+    identity, for CACHE_USUARIOS_TTL seconds. Each request merges it into
+    its session without querying the database. On a miss it is loaded by
+    a session of its own, so the cached copy is never attached.
+
+    Returns:
+        (Usuario): the logged Usuario or None if it does not exist
+    """
+    identidade = get_jwt_identity()
+    usuario = usuarios_cache.get(identidade)
+    if usuario is None:
+        sessao = db.session.session_factory()
+        try:
+            usuario = sessao.query(Usuario).filter_by(
+                id=get_current_user()['id']
+            ).first()
+        finally:
+            sessao.close()
+        if usuario is None:
+            return None
+        usuarios_cache.set(identidade, usuario)
+
+    return db.session.merge(usuario, load=False)
+
+
+def resposta_streaming(itens, formato, chave=None, extras=None):
+    """
+    Auxiliary function that sends the JSON of the items while they are read
+    from the database, config.STREAM_LOTE per chunk, so neither the list nor
+    the whole body are kept in memory.
+    The ndjson format sends one item per line. The stream format sends the
+    same JSON document of the paginated response, in chunks.
+
+    Args:
+        itens (iterable): the JSON of the items, read lazily
+        formato (str): one of FORMATOS_STREAMING
+        chave (str): key of the items in the JSON document. If None the
+                     document is the list of items
+        extras (dict): other keys of the JSON document
+
+    Returns:
+        (flask.Response): the chunked response
+    """
+    ndjson = formato == 'ndjson'
+
+    def gerar():
+        if not ndjson:
+            yield '{{{}: ['.format(json.dumps(chave)) if chave else '['
+        pedaco, separador = [], ''
+        for item in itens:
+            if ndjson:
+                pedaco.append(json.dumps(item) + '\n')
+            else:
+                pedaco.append(separador + json.dumps(item))
+                separador = ', '
+            if len(pedaco) >= config.STREAM_LOTE:
+                yield ''.join(pedaco)
+                pedaco = []
+        yield ''.join(pedaco)
+        if not ndjson:
+            fim = ''.join(
+                ', {}: {}'.format(json.dumps(nome), json.dumps(valor))
+                for nome, valor in (extras or {}).items()
+            )
+            yield ']{}}}\n'.format(fim) if chave else ']\n'
+
+    mimetype = 'application/x-ndjson' if ndjson else 'application/json'
+    return Response(stream_with_context(gerar()), mimetype=mimetype)
+
+
+def nao_modificado(etag, modificado=None):
+    """
+    Auxiliary function that tells if the copy of the client is current,
+    by the If-None-Match header or, without it, by If-Modified-Since
+
+    Args:
+        etag (str): the current ETag of the response
+        modificado (datetime): its last modification, in local time
+
+    Returns:
+        (bool): True if a 304 can be answered
+    """
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if modificado and request.if_modified_since:
+        return utc(modificado).replace(microsecond=0) <= \
+            request.if_modified_since
+    return False
+
+
+def cabecalhos_cache(response, etag, modificado=None):
+    """
+    Auxiliary function that adds the ETag, Last-Modified and Cache-Control
+    headers, letting the clients and a CDN keep the response for
+    HTTP_CACHE_MAX_AGE seconds and revalidate it afterwards
+
+    Args:
+        response (flask.Response): the response, 200 or 304
+        etag (str): the ETag of the response
+        modificado (datetime): its last modification, in local time
+
+    Returns:
+        (flask.Response): the response
+    """
+    response.set_etag(etag)
+    if modificado:
+        response.last_modified = utc(modificado)
+    response.cache_control.public = True
+    response.cache_control.max_age = config.HTTP_CACHE_MAX_AGE
+    return response
+
+
+def utc(data):
+    """
+    Auxiliary function that converts the local times saved by the models
+    to the naive UTC times used by the HTTP headers
+
+    Args:
+        data (datetime): naive local time
+
+    Returns:
+        (datetime): naive UTC time
+    """
+    return data.astimezone(timezone.utc).replace(tzinfo=None)
 
 
 class TokenRefreshResource(Resource):
@@ -1,3 +1,5 @@
+import os
+
 from flask import Flask
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager
@@ -25,12 +27,43 @@ def create_app(config_class=Config):
     app.config.from_object(config_class)
 
     # Initilization
+    from backend.banco import monitor_banco, opcoes_engine
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS',
+                          opcoes_engine(app.config))
     db.init_app(app)
+    monitor_banco.init_app(app)
+    from backend.profiling import profiler
+    profiler.init_app(app)
     jwt = JWTManager(app)
     mail.init_app(app)
     sentry_sdk.init(config_class.SENTRY_DSN)
     CORS(app)
 
+    # Background workers
+    from backend.buscas import busca_logger
+    from backend.counters import view_counter
+    from backend.images import image_pipeline
+    from backend.notifications import dispatcher
+    from backend.sugestoes import sugestoes
+    view_counter.init_app(app)
+    busca_logger.init_app(app)
+    dispatcher.init_app(app)
+    image_pipeline.init_app(app)
+    sugestoes.init_app(app)
+
+    # Caches
+    from backend.cache import anuncios_cache, usuarios_cache
+    from backend.images import variantes_cache
+    anuncios_cache.configurar(app.config['CACHE_ANUNCIOS_TAMANHO'],
+                              app.config['CACHE_ANUNCIOS_TTL'])
+    usuarios_cache.configurar(app.config['CACHE_USUARIOS_TAMANHO'],
+                              app.config['CACHE_USUARIOS_TTL'])
+    variantes_cache.configurar(
+        os.path.join(app.config['IMAGE_DIR'], 'variantes'),
+        app.config['IMAGE_VARIANTES_MAX_BYTES'],
+        app.config['IMAGE_VARIANTES_RELEITURA']
+    )
+
     # Admin Blueprint
     from backend.admin import admin_bp
     app.register_blueprint(admin_bp)
@@ -54,7 +87,8 @@ def add_api_resources(api):
     from backend.api import (
         ContatoResource, ContatosResource, UsuarioResource, UsuariosResource,
         AnuncioResource, AnunciosResource, LoginResource, TokenRefreshResource,
-        BuscaResource
+        BuscaResource, ImagemVarianteResource, SugestoesResource,
+        RelatorioBuscasResource
     )
     api.add_resource(ContatoResource, '/api/v1/contato',
                                       '/api/v1/contato/<string:id>')
@@ -65,6 +99,10 @@ def add_api_resources(api):
     api.add_resource(AnunciosResource, '/api/v1/anuncios')
     api.add_resource(AnuncioResource, '/api/v1/anuncio',
                                       '/api/v1/anuncio/<int:id>')
+    api.add_resource(ImagemVarianteResource,
+                     '/api/v1/imagem/<int:id>/<int:largura>')
     api.add_resource(BuscaResource, '/api/v1/busca')
+    api.add_resource(SugestoesResource, '/api/v1/sugestoes')
+    api.add_resource(RelatorioBuscasResource, '/api/v1/relatorio_buscas')
     api.add_resource(LoginResource, '/api/v1/login')
     api.add_resource(TokenRefreshResource, '/api/v1/refresh_token')
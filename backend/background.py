@@ -0,0 +1,92 @@
+""" Module for the workers that run in background inside the app process """
+import atexit
+import os
+import threading
+
+from backend.app import db
+
+
+class PeriodicWorker(object):
+    """
+    Base class for the workers that periodically run a task in a daemon
+    thread. The thread is started lazily on first use, so each process of a
+    pre-fork server gets its own, and the task runs one last time when the
+    process exits.
+    Subclasses implement run_once, which runs inside an app context.
+    """
+    def __init__(self):
+        self.app = None
+        self.interval = None
+        self._thread = None
+        self._pid = None
+        self._wakeup = threading.Event()
+        self._start_lock = threading.Lock()
+
+    def init_app(self, app, interval):
+        """
+        Binds the worker to the app
+
+        Args:
+            app (flask.Flask): the app whose context the task runs in
+            interval (int): seconds between runs. If falsy the task only
+                            runs when called or on shutdown
+        """
+        self.app = app
+        self.interval = interval
+        atexit.register(self.stop)
+
+    def ensure_started(self):
+        """
+        Starts the thread of this process if it is not running yet
+        """
+        if not self.interval or self._running():
+            return
+        with self._start_lock:
+            if self._running():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._loop,
+                                            name=type(self).__name__)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def wakeup(self):
+        """
+        Asks the thread to run the task before the interval elapses
+        """
+        self._wakeup.set()
+
+    def run(self):
+        """
+        Runs the task inside the app context, logging any error
+        """
+        with self.app.app_context():
+            try:
+                self.run_once()
+            except Exception as e:
+                self.app.logger.exception('%s: %s', type(self).__name__, e)
+            finally:
+                db.session.remove()
+
+    def stop(self):
+        """
+        Runs the task one last time. Called when the process exits
+        """
+        if self.app is not None:
+            self.run()
+
+    def run_once(self):
+        """
+        The task of the worker
+        """
+        raise NotImplementedError
+
+    def _running(self):
+        return (self._pid == os.getpid() and self._thread is not None and
+                self._thread.is_alive())
+
+    def _loop(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.run()
@@ -0,0 +1,224 @@
+""" Module that configures and instruments the database connections """
+import os
+import threading
+import time
+
+from flask import g, has_request_context, request
+from sqlalchemy import event, exc
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+from backend.app import db
+
+
+def opcoes_engine(config):
+    """
+    Builds the SQLALCHEMY_ENGINE_OPTIONS from the BANCO_* config
+
+    Args:
+        config (dict): the config of the app
+
+    Returns:
+        (dict): the keyword arguments of sqlalchemy.create_engine
+    """
+    opcoes = {
+        'poolclass': PoolInstrumentado,
+        'pool_size': config['BANCO_POOL_TAMANHO'],
+        'max_overflow': config['BANCO_POOL_OVERFLOW'],
+        'pool_timeout': config['BANCO_POOL_TIMEOUT'],
+        'pool_recycle': config['BANCO_POOL_RECICLAR'],
+        'pool_pre_ping': config['BANCO_POOL_PRE_PING'],
+    }
+    if config['BANCO_TIMEOUT_QUERY']:
+        opcoes['connect_args'] = {
+            'options': '-c statement_timeout={}'.format(
+                config['BANCO_TIMEOUT_QUERY']
+            )
+        }
+    return opcoes
+
+
+class PoolInstrumentado(QueuePool):
+    """
+    QueuePool that reports to monitor_banco the time waited by each
+    checkout, the opening of new connections included, and the checkouts
+    that timed out because the pool was exhausted
+    """
+    def _do_get(self):
+        inicio = time.perf_counter()
+        try:
+            conexao = super(PoolInstrumentado, self)._do_get()
+        except exc.TimeoutError:
+            monitor_banco.registrar_checkout(time.perf_counter() - inicio,
+                                             self.checkedout(), esgotado=True)
+            raise
+        monitor_banco.registrar_checkout(time.perf_counter() - inicio,
+                                         self.checkedout())
+        return conexao
+
+
+@event.listens_for(PoolInstrumentado, 'connect')
+def _registrar_pid(conexao_dbapi, registro):
+    registro.info['pid'] = os.getpid()
+
+
+@event.listens_for(PoolInstrumentado, 'checkout')
+def _verificar_pid(conexao_dbapi, registro, proxy):
+    # A connection inherited from the parent of a pre-fork server shares its
+    # socket: it is dropped without being closed and the pool opens another
+    pid = os.getpid()
+    if registro.info['pid'] != pid:
+        registro.connection = proxy.connection = None
+        raise exc.DisconnectionError(
+            'Conexao do processo {} usada pelo processo {}'.format(
+                registro.info['pid'], pid
+            )
+        )
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _antes_query(conn, cursor, statement, parameters, context, many):
+    # Kept in the execution context, not in the connection: a statement
+    # that fails never reaches after_cursor_execute and would leave it behind
+    if context is not None:
+        context.inicio_query = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _depois_query(conn, cursor, statement, parameters, context, many):
+    inicio = getattr(context, 'inicio_query', None)
+    if inicio is not None and has_request_context():
+        monitor_banco.registrar_query(statement, time.perf_counter() - inicio)
+
+
+class MonitorBanco(object):
+    """
+    Statistics of the database use by the process: the checkouts of the
+    pool with their waits, and the number and duration of the queries of
+    each request. The requests whose queries take more than
+    BANCO_REQUEST_LENTA seconds are logged. The queries of the requests
+    are also passed on to the functions registered by ouvir.
+    """
+    def __init__(self):
+        self.app = None
+        self.request_lenta = None
+        self.ouvintes = []
+        self._lock = threading.Lock()
+        self.zerar()
+
+    def init_app(self, app):
+        """
+        Binds the monitor to the requests of the app
+
+        Args:
+            app (flask.Flask): the app
+        """
+        self.app = app
+        self.request_lenta = app.config['BANCO_REQUEST_LENTA']
+        app.before_request(self._iniciar_request)
+        app.after_request(self._finalizar_request)
+
+    def zerar(self):
+        """
+        Resets the statistics
+        """
+        with self._lock:
+            self.checkouts = 0
+            self.esgotados = 0
+            self.espera_total = 0
+            self.espera_maxima = 0
+            self.em_uso_maximo = 0
+            self.requests = 0
+            self.requests_lentas = 0
+            self.queries = 0
+            self.queries_segundos = 0
+            self.queries_maximo_request = 0
+
+    def ouvir(self, funcao):
+        """
+        Registers a function called after each query of a request
+
+        Args:
+            funcao (function): called with (statement, segundos)
+        """
+        if funcao not in self.ouvintes:
+            self.ouvintes.append(funcao)
+
+    def registrar_query(self, statement, segundos):
+        """
+        Counts one query of the current request
+
+        Args:
+            statement (str): the SQL executed
+            segundos (float): its duration
+        """
+        if 'banco_queries' in g:
+            g.banco_queries += 1
+            g.banco_segundos += segundos
+        for ouvinte in self.ouvintes:
+            ouvinte(statement, segundos)
+
+    def registrar_checkout(self, espera, em_uso, esgotado=False):
+        """
+        Counts one checkout of the pool
+
+        Args:
+            espera (float): seconds waited for the connection
+            em_uso (int): connections checked out after it
+            esgotado (bool): if it timed out without a connection
+        """
+        with self._lock:
+            self.checkouts += 1
+            self.esgotados += 1 if esgotado else 0
+            self.espera_total += espera
+            self.espera_maxima = max(self.espera_maxima, espera)
+            self.em_uso_maximo = max(self.em_uso_maximo, em_uso)
+
+    def estatisticas(self):
+        """
+        Returns:
+            (dict): Containing the state of the pool and the counters
+        """
+        pool = db.engine.pool
+        estatisticas = {
+            'checkouts': self.checkouts, 'esgotados': self.esgotados,
+            'espera_media': self.espera_total / max(self.checkouts, 1),
+            'espera_maxima': self.espera_maxima,
+            'em_uso_maximo': self.em_uso_maximo,
+            'requests': self.requests, 'requests_lentas': self.requests_lentas,
+            'queries_por_request': self.queries / max(self.requests, 1),
+            'segundos_queries_por_request': (
+                self.queries_segundos / max(self.requests, 1)
+            ),
+            'queries_maximo_request': self.queries_maximo_request
+        }
+        if isinstance(pool, QueuePool):
+            estatisticas['pool'] = {
+                'tamanho': pool.size(), 'em_uso': pool.checkedout(),
+                'livres': pool.checkedin(), 'overflow': pool.overflow()
+            }
+        return estatisticas
+
+    def _iniciar_request(self):
+        g.banco_queries = 0
+        g.banco_segundos = 0
+
+    def _finalizar_request(self, response):
+        queries = g.pop('banco_queries', 0)
+        segundos = g.pop('banco_segundos', 0)
+        lenta = segundos > self.request_lenta
+        with self._lock:
+            self.requests += 1
+            self.requests_lentas += 1 if lenta else 0
+            self.queries += queries
+            self.queries_segundos += segundos
+            self.queries_maximo_request = max(self.queries_maximo_request,
+                                              queries)
+        if lenta:
+            self.app.logger.warning('%s %s: %d queries em %.3fs',
+                                    request.method, request.path, queries,
+                                    segundos)
+        return response
+
+
+monitor_banco = MonitorBanco()
@@ -0,0 +1,111 @@
+""" Module that logs the searches made in background """
+import threading
+
+from collections import deque
+from datetime import datetime
+
+from backend.app import db
+from backend.background import PeriodicWorker
+from backend.models import Busca
+
+
+class BuscaLogger(PeriodicWorker):
+    """
+    Write-behind log of the Buscas.
+    The searches are buffered in memory by each process and saved with one
+    multi-row INSERT every BUSCAS_INTERVALO_FLUSH seconds, or as soon as
+    BUSCAS_LOTE are buffered. The buffer holds at most BUSCAS_BUFFER_MAXIMO
+    searches: when the database can not keep up the new ones are dropped
+    and counted, so the searches are never slowed down by the log.
+    """
+    def __init__(self):
+        super(BuscaLogger, self).__init__()
+        self.lote = 500
+        self.registradas = 0
+        self.salvas = 0
+        self.descartadas = 0
+        self._buffer = deque()
+        self._maximo = 10000
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """
+        Binds the logger to the app using the BUSCAS_* config
+
+        Args:
+            app (flask.Flask): the app
+        """
+        self.lote = app.config['BUSCAS_LOTE']
+        self._maximo = app.config['BUSCAS_BUFFER_MAXIMO']
+        super(BuscaLogger, self).init_app(
+            app, app.config['BUSCAS_INTERVALO_FLUSH']
+        )
+
+    def registrar(self, usuario_id, busca, resultados=None):
+        """
+        Buffers the search. It never blocks nor touches the database
+
+        Args:
+            usuario_id (int): id of the logged Usuario or 0
+            busca (str): the text searched
+            resultados (int): number of Anuncios found in the first page
+        """
+        with self._lock:
+            if len(self._buffer) >= self._maximo:
+                self.descartadas += 1
+                return
+            self._buffer.append({
+                'usuario': usuario_id, 'busca': busca,
+                'buscado_em': datetime.now(), 'resultados': resultados
+            })
+            self.registradas += 1
+            cheio = len(self._buffer) >= self.lote
+        self.ensure_started()
+        if cheio:
+            self.wakeup()
+
+    def pendentes(self):
+        """
+        Returns:
+            (int): Number of searches not saved yet
+        """
+        return len(self._buffer)
+
+    def estatisticas(self):
+        """
+        Returns:
+            (dict): Containing the buffer size and the counters
+        """
+        return {
+            'pendentes': self.pendentes(), 'maximo': self._maximo,
+            'registradas': self.registradas, 'salvas': self.salvas,
+            'descartadas': self.descartadas
+        }
+
+    def run_once(self):
+        """
+        Saves the buffered searches, BUSCAS_LOTE per INSERT. If it fails
+        they are buffered again, as long as there is room
+        """
+        with self._lock:
+            buscas, self._buffer = self._buffer, deque()
+        if not buscas:
+            return
+
+        buscas = list(buscas)
+        try:
+            for inicio in range(0, len(buscas), self.lote):
+                lote = buscas[inicio:inicio + self.lote]
+                db.session.execute(Busca.__table__.insert().values(lote))
+            db.session.commit()
+            self.salvas += len(buscas)
+        except Exception:
+            db.session.rollback()
+            with self._lock:
+                espaco = self._maximo - len(self._buffer)
+                self._buffer.extendleft(reversed(buscas[:espaco]))
+                self.descartadas += max(len(buscas) - espaco, 0)
+            raise
+
+
+busca_logger = BuscaLogger()
@@ -0,0 +1,109 @@
+""" Module for the in-process caches """
+import threading
+import time
+
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    Thread safe cache bounded by number of entries (least recently used
+    are evicted first) and by age. Each process of the app has its own
+    copy, so the TTL bounds how stale the other processes can get after
+    an invalidation.
+    """
+    def __init__(self, tamanho=128, ttl=60):
+        self.tamanho = tamanho
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._dados = OrderedDict()
+        self._lock = threading.Lock()
+
+    def configurar(self, tamanho, ttl):
+        """
+        Changes the limits of the cache and empties it
+
+        Args:
+            tamanho (int): max number of entries. If falsy nothing is cached
+            ttl (int): seconds an entry is valid
+        """
+        with self._lock:
+            self.tamanho = tamanho
+            self.ttl = ttl
+            self._dados.clear()
+
+    def get(self, chave):
+        """
+        Gets the value cached for the key
+
+        Args:
+            chave (hashable): the key
+
+        Returns:
+            (object): the cached value or None if it is missing or expired
+        """
+        with self._lock:
+            item = self._dados.get(chave)
+            if item is None or item[0] < time.time():
+                if item is not None:
+                    del self._dados[chave]
+                self.misses += 1
+                return None
+            self._dados.move_to_end(chave)
+            self.hits += 1
+            return item[1]
+
+    def set(self, chave, valor):
+        """
+        Caches the value for the key
+
+        Args:
+            chave (hashable): the key
+            valor (object): the value, which must not be changed afterwards
+        """
+        if not self.tamanho:
+            return
+        with self._lock:
+            self._dados[chave] = (time.time() + self.ttl, valor)
+            self._dados.move_to_end(chave)
+            while len(self._dados) > self.tamanho:
+                self._dados.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, chave):
+        """
+        Removes the key from the cache
+
+        Args:
+            chave (hashable): the key
+        """
+        with self._lock:
+            self._dados.pop(chave, None)
+
+    def clear(self):
+        """
+        Removes all entries
+        """
+        with self._lock:
+            self._dados.clear()
+
+    def estatisticas(self):
+        """
+        Returns:
+            (dict): Containing the hits, misses, evictions and entries
+        """
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits, 'misses': self.misses,
+            'hit_rate': float(self.hits) / total if total else 0.0,
+            'evictions': self.evictions, 'entradas': len(self._dados),
+            'tamanho': self.tamanho, 'ttl': self.ttl
+        }
+
+
+# Responses of AnunciosResource keyed by (order_by, limit, cursor)
+anuncios_cache = LRUCache()
+# Detached Usuarios of the jwt_required handlers keyed by the JWT identity
+usuarios_cache = LRUCache()
@@ -10,6 +10,16 @@ class BaseConfig(object):
     IMAGE_DIR = 'static/images'
     IMAGE_WIDTH = 1024
     IMAGE_HEIGHT = 768
+    # Uploads above it are rejected before being decoded
+    IMAGE_MAX_PIXELS = 64000000
+    # Widths served by /imagem/<id>/<largura>, cached on disk up to the size
+    IMAGE_VARIANTES = [160, 320, 640, 1024]
+    IMAGE_VARIANTES_MAX_BYTES = 512 * 1024 * 1024
+    # Seconds between the listings of the variants written by all processes
+    IMAGE_VARIANTES_RELEITURA = 10
+    IMAGE_VARIANTES_MAX_AGE = 30 * 24 * 60 * 60
+    # Processes resizing the uploaded images
+    IMAGENS_PROCESSOS = 2
 
     # Zoho mail configuration
     MAIL_SERVER = 'smtp.zoho.com'
@@ -25,14 +35,107 @@ class BaseConfig(object):
     # Slack information
     SLACK_HOOK = ''
 
+    # Background delivery of the Slack and email notifications
+    NOTIFICACOES_WORKERS = 2
+    NOTIFICACOES_FILA_MAXIMA = 1000
+    NOTIFICACOES_TENTATIVAS = 3
+    NOTIFICACOES_BACKOFF = 1
+    NOTIFICACOES_TIMEOUT_DRENAR = 10
+
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Pool of database connections of each process. Connections older than
+    # BANCO_POOL_RECICLAR seconds are replaced and, with BANCO_POOL_PRE_PING,
+    # tested before use. A checkout fails after waiting BANCO_POOL_TIMEOUT
+    # seconds for a free connection
+    BANCO_POOL_TAMANHO = 10
+    BANCO_POOL_OVERFLOW = 10
+    BANCO_POOL_TIMEOUT = 10
+    BANCO_POOL_RECICLAR = 30 * 60
+    BANCO_POOL_PRE_PING = True
+    # Postgres statement_timeout in milliseconds, 0 for no limit
+    BANCO_TIMEOUT_QUERY = 30000
+    # Requests whose queries take longer, in seconds, are logged
+    BANCO_REQUEST_LENTA = 1
+
+    # Profiling of the requests sent with the PROFILING_HEADER, only if
+    # PROFILING_ATIVO. The last PROFILING_BUFFER profiles are shown in the
+    # admin. Statements repeated more than PROFILING_N_MAIS_UM times in a
+    # request are reported, and a fraction PROFILING_AMOSTRA_CPROFILE of the
+    # profiles also run cProfile, as do those with the header 'cprofile'
+    PROFILING_ATIVO = False
+    PROFILING_HEADER = 'X-Profile'
+    PROFILING_BUFFER = 100
+    PROFILING_N_MAIS_UM = 5
+    PROFILING_AMOSTRA_CPROFILE = 0
+    PROFILING_MAX_STATEMENTS = 200
     API_VERSION = '/api/v1/'
+    # Max page size of the limit GET param of /anuncios and /busca
+    PAGINA_MAXIMA = 200
+
+    # Full text search
+    BUSCA_IDIOMA = 'portuguese'
+    BUSCA_LIMITE = 50
+    # Facets of the search: years per faixa_ano, upper limits of the
+    # faixa_valor and max values returned per facet
+    FACETAS_ANOS_POR_FAIXA = 5
+    FACETAS_FAIXAS_VALOR = [10000, 20000, 30000, 50000, 80000, 120000, 200000]
+    FACETAS_LIMITE = 20
+
+    # Search suggestions, kept in memory and updated with the new Buscas
+    # every SUGESTOES_INTERVALO seconds
+    SUGESTOES_INTERVALO = 30
+    SUGESTOES_INTERVALO_RECONSTRUCAO = 60 * 60
+    SUGESTOES_LIMITE = 10
+    # Prefixes matching more terms have their suggestions precomputed
+    SUGESTOES_MAX_VARREDURA = 200
+    SUGESTOES_MAX_TERMOS = 50000
+    # Times a term must be searched to be suggested after a rebuild
+    SUGESTOES_MIN_BUSCAS = 2
+
+    # Views are accumulated in memory and flushed every VIEWS_INTERVALO_FLUSH
+    # seconds. Set VIEWS_WRITE_BEHIND to False to update them on each view
+    VIEWS_WRITE_BEHIND = True
+    VIEWS_INTERVALO_FLUSH = 10
+
+    # Buscas are buffered in memory and saved every BUSCAS_INTERVALO_FLUSH
+    # seconds or BUSCAS_LOTE at a time. Past BUSCAS_BUFFER_MAXIMO they are
+    # dropped
+    BUSCAS_INTERVALO_FLUSH = 5
+    BUSCAS_LOTE = 500
+    BUSCAS_BUFFER_MAXIMO = 10000
+
+    # Report of the Buscas, read from the rollups. The Buscas are added to
+    # them RELATORIO_BUSCAS_ATRASO seconds after saved
+    RELATORIO_BUSCAS_ATRASO = 60
+    RELATORIO_BUSCAS_HORAS = 48
+    RELATORIO_BUSCAS_DIAS = 30
+    RELATORIO_BUSCAS_LIMITE = 20
+    # Caps of the horas, dias and limit GET params of /relatorio_buscas
+    RELATORIO_BUSCAS_HORAS_MAXIMO = 24 * 31
+    RELATORIO_BUSCAS_DIAS_MAXIMO = 366
+    RELATORIO_BUSCAS_LIMITE_MAXIMO = 200
+
+    # Cache of the /anuncios responses, invalidated on writes
+    CACHE_ANUNCIOS_TAMANHO = 256
+    CACHE_ANUNCIOS_TTL = 30
+    # Cache of the logged Usuarios, invalidated on their updates
+    CACHE_USUARIOS_TAMANHO = 1024
+    CACHE_USUARIOS_TTL = 30
+
+    # Cache-Control max-age of the GETs with ETag, for clients and the CDN
+    HTTP_CACHE_MAX_AGE = 30
+
+    # Rows fetched at a time by the streamed listings (format=ndjson|stream)
+    STREAM_LOTE = 1000
 
 
 class Config(BaseConfig):
     """Production configuration."""
     # App config
     LIMITE_ANUNCIOS_FREE = 500
+    ADMIN_POR_PAGINA = 50
+    # Time a batch job can take in an admin request
+    ADMIN_SEGUNDOS_TAREFA = 20
     ENVIAR_EMAILS = False
     ERROR_404_HELP = False
     DEBUG = False
@@ -51,10 +154,21 @@ class Config(BaseConfig):
     SQLALCHEMY_DATABASE_URI = POSTGRES_URI
 
 
+class ManagerConfig(Config):
+    """Configuration of the migrations and batch jobs."""
+    BANCO_TIMEOUT_QUERY = 0
+
+
 class TestConfig(BaseConfig):
     """Test configuration."""
     TESTING = True
     DEBUG = True
+    # The tests run the background work synchronously
+    VIEWS_INTERVALO_FLUSH = 0
+    BUSCAS_INTERVALO_FLUSH = 0
+    NOTIFICACOES_WORKERS = 0
+    IMAGENS_PROCESSOS = 0
+    SUGESTOES_INTERVALO = 0
 
     # Postgres data
     POSTGRES = {
@@ -0,0 +1,120 @@
+""" Module that handles the views counters of Anuncio and Usuario """
+import threading
+
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy.sql import text
+
+from backend.app import db
+from backend.background import PeriodicWorker
+
+
+class ViewCounter(PeriodicWorker):
+    """
+    Write-behind counter for the views column.
+    The increments are accumulated in memory by each process and flushed
+    periodically as one atomic UPDATE ... SET views = views + delta
+    per table, so the detail GETs do not write to the database.
+    """
+    def __init__(self):
+        super(ViewCounter, self).__init__()
+        self.write_behind = True
+        self._pendentes = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """
+        Binds the counter to the app using VIEWS_WRITE_BEHIND and
+        VIEWS_INTERVALO_FLUSH from its config
+
+        Args:
+            app (flask.Flask): the app
+        """
+        self.write_behind = app.config['VIEWS_WRITE_BEHIND']
+        super(ViewCounter, self).init_app(app,
+                                          app.config['VIEWS_INTERVALO_FLUSH'])
+
+    def incrementar(self, model, id):
+        """
+        Counts one view for the object
+
+        Args:
+            model (class): Anuncio or Usuario
+            id (int): the id of the object
+        """
+        if not self.write_behind:
+            atualizar_views(model.__tablename__, {id: 1})
+            db.session.commit()
+            return
+        with self._lock:
+            self._pendentes[(model.__tablename__, id)] += 1
+        self.ensure_started()
+
+    def pendentes(self):
+        """
+        Returns:
+            (int): Number of objects with views not flushed yet
+        """
+        return len(self._pendentes)
+
+    def run_once(self):
+        """
+        Flushes the accumulated views. If the flush fails they are kept
+        to be flushed on the next run
+        """
+        with self._lock:
+            pendentes, self._pendentes = self._pendentes, defaultdict(int)
+        if not pendentes:
+            return
+
+        por_tabela = defaultdict(dict)
+        for (tabela, id), delta in pendentes.items():
+            por_tabela[tabela][id] = delta
+        try:
+            for tabela, deltas in sorted(por_tabela.items()):
+                atualizar_views(tabela, deltas)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            with self._lock:
+                for chave, delta in pendentes.items():
+                    self._pendentes[chave] += delta
+            raise
+
+
+def atualizar_views(tabela, deltas):
+    """
+    Adds the deltas to the views column with a single UPDATE. The views
+    are part of the JSON, so atualizado_em is bumped too. The views of
+    the Anuncios are also added to the total_views of their Usuarios
+
+    Args:
+        tabela (str): name of the table, anuncio or usuario
+        deltas (dict): ids mapped to the number of views to add
+    """
+    valores, params = [], {'agora': datetime.now()}
+    # Sorted ids keep the row locks in the same order across processes
+    for index, id in enumerate(sorted(deltas)):
+        valores.append('(:id{0}, :delta{0})'.format(index))
+        params['id{}'.format(index)] = id
+        params['delta{}'.format(index)] = deltas[id]
+    query = (
+        'UPDATE {0} SET views = coalesce({0}.views, 0) + v.delta, '
+        'atualizado_em = :agora FROM (VALUES {1}) AS v(id, delta) WHERE {0}.id = v.id'
+    ).format(tabela, ', '.join(valores))
+    db.session.execute(text(query), params)
+    if tabela == 'anuncio':
+        # Usuario.total_views follows the views of the Anuncios
+        query = (
+            'UPDATE usuario SET total_views = usuario.total_views + t.delta '
+            'FROM (SELECT anuncio.usuario_id, sum(v.delta) AS delta '
+            'FROM (VALUES {}) AS v(id, delta) '
+            'JOIN anuncio ON anuncio.id = v.id '
+            'GROUP BY anuncio.usuario_id ORDER BY anuncio.usuario_id) AS t '
+            'WHERE usuario.id = t.usuario_id'
+        ).format(', '.join(valores))
+        db.session.execute(text(query), params)
+
+
+view_counter = ViewCounter()
@@ -0,0 +1,429 @@
+""" Module that handles the processing of the uploaded images """
+import atexit
+import os
+import threading
+import time
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+from backend.app import db
+from backend.cache import anuncios_cache
+from backend.config import Config as config
+from backend.models import Anuncio, Imagem
+from backend.utils import log
+
+
+QUALIDADE_JPEG = 90
+
+
+def processar_imagem(origem, destino, largura, max_pixels):
+    """
+    Resizes the raw upload to the given width and saves it as JPEG.
+    The raw upload is removed afterwards, even if it is not valid.
+    JPEGs are decoded in draft mode, which lets libjpeg scale them by
+    1/2, 1/4 or 1/8 while decoding, so a 48 MP photo is never fully
+    decoded to end up with 1024 pixels of width.
+    It runs in the process pool, so it must only use its arguments.
+
+    Args:
+        origem (str): path of the raw upload
+        destino (str): path of the JPEG to be created
+        largura (int): width of the JPEG
+        max_pixels (int): max number of pixels of the upload
+
+    Returns:
+        (str): the destino path
+
+    Raises:
+        (ValueError): If the upload has more than max_pixels
+    """
+    try:
+        # Image.open only reads the header, the decoding happens on load
+        with Image.open(origem) as img:
+            if img.size[0] * img.size[1] > max_pixels:
+                raise ValueError('Imagem {}x{} excede {} pixels'.format(
+                    img.size[0], img.size[1], max_pixels
+                ))
+            wpercent = (largura / float(img.size[0]))
+            height = int((float(img.size[1]) * float(wpercent)))
+            if img.format == 'JPEG':
+                # Keeps the decoded size at least the target size
+                img.draft('RGB', (largura, height))
+            img = img.resize((largura, height), Image.LANCZOS)
+        img.convert('RGB').save(destino, 'JPEG', quality=QUALIDADE_JPEG)
+    finally:
+        os.unlink(origem)
+
+    return destino
+
+
+def gerar_variante(origem, destino, largura):
+    """
+    Creates a JPEG of the image with the given width, never larger
+    than the original. The file is written to a temporary name and
+    renamed, so concurrent readers never see it half written.
+
+    Args:
+        origem (str): path of the processed image
+        destino (str): path of the variant
+        largura (int): width of the variant
+    """
+    with Image.open(origem) as img:
+        largura = min(largura, img.size[0])
+        height = int(img.size[1] * largura / float(img.size[0]))
+        if img.format == 'JPEG':
+            img.draft('RGB', (largura, height))
+        img = img.resize((largura, height), Image.LANCZOS)
+    # Unique per thread, concurrent requests may create the same variant
+    temporario = '{}.{}.{}.tmp'.format(destino, os.getpid(),
+                                       threading.get_ident())
+    img.convert('RGB').save(temporario, 'JPEG', quality=QUALIDADE_JPEG)
+    os.rename(temporario, destino)
+
+
+def largura_variante(largura):
+    """
+    Snaps the requested width to the smallest IMAGE_VARIANTES bucket that
+    is not narrower, so the cache holds few variants per image
+
+    Args:
+        largura (int): the requested width
+
+    Returns:
+        (int): the width of the bucket
+    """
+    for variante in sorted(config.IMAGE_VARIANTES):
+        if largura <= variante:
+            return variante
+    return max(config.IMAGE_VARIANTES)
+
+
+class DiskLRUCache(object):
+    """
+    Directory of files bounded by total size, evicting the least recently
+    used. The recency is kept in the file atime, so the order survives
+    restarts and is shared, roughly, by the processes of the app. The mtime
+    is left untouched, keeping the ETags stable.
+    The processes write to the same directory, so the files are listed
+    again when the size is exceeded or every releitura seconds. The bound
+    holds across processes, give or take what they write in that interval.
+    """
+    def __init__(self, diretorio, max_bytes, releitura=10):
+        self.diretorio = diretorio
+        self.max_bytes = max_bytes
+        self.releitura = releitura
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._arquivos = None
+        self._total = 0
+        self._listado_em = 0
+        self._lock = threading.Lock()
+
+    def configurar(self, diretorio, max_bytes, releitura=10):
+        """
+        Changes the directory and the size of the cache
+
+        Args:
+            diretorio (str): directory of the cached files
+            max_bytes (int): max size of the files together
+            releitura (int): max seconds between listings of the directory
+        """
+        with self._lock:
+            self.diretorio = os.path.abspath(diretorio)
+            self.max_bytes = max_bytes
+            self.releitura = releitura
+            self._arquivos = None
+            self._total = 0
+
+    def caminho(self, nome):
+        """
+        Returns:
+            (str): the path of the file in the cache directory
+        """
+        return os.path.join(self.diretorio, nome)
+
+    def get(self, nome):
+        """
+        Marks the cached file as recently used
+
+        Args:
+            nome (str): name of the file
+
+        Returns:
+            (str): the path of the file or None if it is not cached
+        """
+        caminho = self.caminho(nome)
+        with self._lock:
+            self._carregar()
+            try:
+                os.utime(caminho, (time.time(), os.path.getmtime(caminho)))
+            except OSError:
+                self._remover(nome)
+                self.misses += 1
+                return None
+            tamanho = self._arquivos.pop(nome, None)
+            if tamanho is None:
+                # Created by another process
+                tamanho = os.path.getsize(caminho)
+                self._total += tamanho
+            self._arquivos[nome] = tamanho
+            self.hits += 1
+            return caminho
+
+    def add(self, nome):
+        """
+        Accounts for a file written to the cache directory and evicts the
+        least recently used files over max_bytes
+
+        Args:
+            nome (str): name of the file
+        """
+        with self._lock:
+            self._carregar()
+            self._remover(nome)
+            tamanho = os.path.getsize(self.caminho(nome))
+            self._arquivos[nome] = tamanho
+            self._total += tamanho
+            if self._total > self.max_bytes or \
+                    time.time() - self._listado_em > self.releitura:
+                # Counts the files written and evicted by other processes
+                self._arquivos = None
+                self._carregar()
+            while self._total > self.max_bytes and len(self._arquivos) > 1:
+                antigo = next(iter(self._arquivos))
+                self._remover(antigo)
+                try:
+                    os.unlink(self.caminho(antigo))
+                except OSError:
+                    pass
+                self.evictions += 1
+
+    def remove(self, nome):
+        """
+        Removes the file from the cache, if it is cached
+
+        Args:
+            nome (str): name of the file
+        """
+        with self._lock:
+            self._carregar()
+            self._remover(nome)
+            try:
+                os.unlink(self.caminho(nome))
+            except OSError:
+                pass
+
+    def estatisticas(self):
+        """
+        Returns:
+            (dict): Containing the hits, misses, evictions and bytes used
+        """
+        return {
+            'hits': self.hits, 'misses': self.misses,
+            'evictions': self.evictions, 'bytes': self._total,
+            'max_bytes': self.max_bytes,
+            'arquivos': len(self._arquivos or [])
+        }
+
+    def _carregar(self):
+        if self._arquivos is not None:
+            return
+        if not os.path.exists(self.diretorio):
+            os.makedirs(self.diretorio)
+        arquivos = []
+        for nome in os.listdir(self.diretorio):
+            if nome.endswith('.tmp'):
+                continue
+            try:
+                stat = os.stat(self.caminho(nome))
+            except OSError:
+                # Evicted by another process meanwhile
+                continue
+            arquivos.append((stat.st_atime, nome, stat.st_size))
+        self._arquivos = OrderedDict(
+            (nome, tamanho) for _, nome, tamanho in sorted(arquivos)
+        )
+        self._total = sum(self._arquivos.values())
+        self._listado_em = time.time()
+
+    def _remover(self, nome):
+        self._total -= self._arquivos.pop(nome, 0)
+
+
+class ImagePipeline(object):
+    """
+    Processes the uploaded images in a process pool, out of the request
+    thread. Each Imagem is saved as pendente and updated to pronta or erro
+    when its processing finishes, clearing the anuncios_cache.
+    With IMAGENS_PROCESSOS = 0 the images are processed synchronously.
+    """
+    def __init__(self):
+        self.app = None
+        self.processos = 0
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """
+        Binds the pipeline to the app using IMAGENS_PROCESSOS
+
+        Args:
+            app (flask.Flask): the app
+        """
+        self.app = app
+        self.processos = app.config['IMAGENS_PROCESSOS']
+        atexit.register(self.shutdown)
+
+    def processar(self, imagem_id, origem, destino):
+        """
+        Schedules the processing of the Imagem
+
+        Args:
+            imagem_id (int): id of the pending Imagem
+            origem (str): path of the raw upload
+            destino (str): path of the JPEG to be created
+        """
+        args = (origem, destino, config.IMAGE_WIDTH, config.IMAGE_MAX_PIXELS)
+        if not self.processos:
+            try:
+                processar_imagem(*args)
+                status = Imagem.PRONTA
+            except Exception as e:
+                log('processar_imagem', imagem_id, e)
+                status = Imagem.ERRO
+            Imagem.atualizar_status(imagem_id, status)
+            anuncios_cache.clear()
+            return
+
+        future = self._get_executor().submit(processar_imagem, *args)
+        future.add_done_callback(
+            lambda future: self._finalizar(imagem_id, future)
+        )
+
+    def shutdown(self):
+        """
+        Waits for the images being processed. Called on shutdown
+        """
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown(wait=True)
+
+    def _get_executor(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                # The pool of the parent is not usable by forked processes
+                if self._pid != os.getpid():
+                    self._executor = ProcessPoolExecutor(self.processos)
+                    self._pid = os.getpid()
+        return self._executor
+
+    def _finalizar(self, imagem_id, future):
+        with self.app.app_context():
+            erro = future.exception()
+            if erro is not None:
+                self.app.logger.error('processar_imagem %s: %s',
+                                      imagem_id, erro)
+            status = Imagem.ERRO if erro is not None else Imagem.PRONTA
+            try:
+                Imagem.atualizar_status(imagem_id, status)
+                anuncios_cache.clear()
+            finally:
+                db.session.remove()
+
+
+def upload_images(anuncio, imagens):
+    """
+    Creates all necessary directories, stores the raw uploads and
+    schedules their processing. The Imagem rows are inserted at once
+    as pendente.
+
+    Args:
+        anuncio (Anuncio): the Anuncio object
+        imagens (list): List of images o be inserted
+    """
+    usuario_id = anuncio.usuario_id
+    anuncio_id = anuncio.id
+    path_usuario = '{}/{}'.format(config.IMAGE_DIR, usuario_id)
+    path_anuncio = '{}/{}'.format(path_usuario, anuncio_id)
+    # Creating the user and anuncio file directories
+    if not os.path.exists(path_anuncio):
+        os.makedirs(path_anuncio)
+
+    uploads = []
+    for index, file in enumerate(imagens):
+        full_path = '{}/{}.jpg'.format(path_anuncio, 'imagem' + str(index))
+        raw_path = '{}.upload'.format(full_path)
+        # FileStorage.save copies the upload in chunks
+        file.save(raw_path)
+        imagem = Imagem(anuncio_id=anuncio_id,
+                        img_filename=full_path.replace('static/', ''),
+                        status=Imagem.PENDENTE)
+        uploads.append((imagem, raw_path, full_path))
+    # Saving to database
+    db.session.add_all([imagem for imagem, _, _ in uploads])
+    Anuncio.tocar(anuncio_id)
+    db.session.commit()
+
+    for imagem, raw_path, full_path in uploads:
+        image_pipeline.processar(imagem.id, raw_path, full_path)
+    log('upload_images', anuncio_id, len(uploads))
+
+
+def caminho_variante(imagem, largura):
+    """
+    Gets the variant of the Imagem from the cache, creating it if needed
+
+    Args:
+        imagem (Imagem): a processed Imagem
+        largura (int): width of one of the IMAGE_VARIANTES
+
+    Returns:
+        (str): the path of the variant or None if the image file is missing
+    """
+    origem = imagem.caminho()
+    try:
+        modificada = os.path.getmtime(origem)
+    except OSError:
+        return None
+    nome = nome_variante(imagem.id, largura)
+    caminho = variantes_cache.get(nome)
+    try:
+        # A variant older than its image belongs to a previous upload
+        if caminho and os.path.getmtime(caminho) >= modificada:
+            return caminho
+    except OSError:
+        # Evicted by another thread or process meanwhile
+        pass
+    gerar_variante(origem, variantes_cache.caminho(nome), largura)
+    variantes_cache.add(nome)
+
+    return variantes_cache.caminho(nome)
+
+
+def remover_variantes(imagem_ids):
+    """
+    Removes the cached variants of the Imagens being deleted
+
+    Args:
+        imagem_ids (list): ids of the Imagens
+    """
+    for imagem_id in imagem_ids:
+        for largura in config.IMAGE_VARIANTES:
+            variantes_cache.remove(nome_variante(imagem_id, largura))
+
+
+def nome_variante(imagem_id, largura):
+    """
+    Returns:
+        (str): the name of the variant in the variantes_cache
+    """
+    return '{}-{}.jpg'.format(imagem_id, largura)
+
+
+image_pipeline = ImagePipeline()
+# Configured by create_app
+variantes_cache = DiskLRUCache(None, 0)
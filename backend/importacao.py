@@ -0,0 +1,290 @@
+""" Module for the bulk import of Usuarios, Anuncios and Imagens """
+import csv
+import io
+import json
+import os
+
+from datetime import datetime
+
+from sqlalchemy import Integer, Sequence, any_, bindparam, select, text
+from sqlalchemy.dialects.postgresql import ARRAY
+
+from backend.app import db
+from backend.models import Anuncio, Imagem, Usuario, PESOS_BUSCA
+from backend.tasks import reconstruir_facetas, reconciliar_contadores
+
+ENTIDADES = {'usuarios': Usuario, 'anuncios': Anuncio, 'imagens': Imagem}
+# Columns computed by the app, they are not read from the files
+CALCULADAS = ['query_busca', 'vetor_busca'] + Usuario.CONTADORES
+# Natural keys accepted instead of a foreign key: the column of the file
+# mapped to the foreign key and the column of the referenced table
+REFERENCIAS = {
+    'anuncio': {'usuario_facebook_id': ('usuario_id', 'facebook_id')}
+}
+FORMATOS = {'.csv': 'csv', '.ndjson': 'ndjson', '.jsonl': 'ndjson'}
+TABELA_TEMPORARIA = 'importacao'
+
+
+def importar(entidade, caminho, formato=None, lote=10000, progresso=None):
+    """
+    Imports the rows of a CSV file with a header, or of a NDJSON file with
+    one object per line. The file is loaded by COPY into a temporary table,
+    then inserted in batches of lote rows, one transaction each, with the
+    foreign keys resolved by a join per batch. Rows whose reference does
+    not exist or that conflict with an existing row are skipped. Missing
+    and empty values get the default of the model.
+    After the import the id sequence is moved past the imported ids. The
+    Anuncios get their query_busca and vetor_busca with each batch, then
+    the facets and the counters of the Usuarios are recomputed. The
+    Anuncios receiving Imagens have atualizado_em bumped with each batch,
+    changing their ETags.
+
+    Args:
+        entidade (str): usuarios, anuncios or imagens
+        caminho (str): path of the file
+        formato (str): csv or ndjson, by default from the file extension
+        lote (int): rows per transaction
+        progresso (function): called with (processadas, total) per batch
+
+    Returns:
+        (tuple): Containing the number of rows imported and read
+
+    Raises:
+        (ValueError): If the format is unknown or the file has columns
+                      that can not be imported
+    """
+    modelo = ENTIDADES[entidade]
+    formato = formato or FORMATOS.get(os.path.splitext(caminho)[1].lower())
+    if formato not in FORMATOS.values():
+        raise ValueError('Formato desconhecido: {}'.format(caminho))
+
+    conexao = db.engine.connect()
+    try:
+        colunas = _colunas(modelo)
+        with conexao.begin():
+            conexao.execute('CREATE TEMP TABLE {} ({})'.format(
+                TABELA_TEMPORARIA, ', '.join(['linha bigserial'] + [
+                    '{} text'.format(coluna) for coluna in colunas
+                ])
+            ))
+            with open(caminho, newline='', encoding='utf-8') as arquivo:
+                if formato == 'csv':
+                    presentes = _copiar_csv(conexao, arquivo, colunas)
+                else:
+                    presentes = _copiar_ndjson(conexao, arquivo, colunas,
+                                               lote)
+        conexao.execute('ANALYZE {}'.format(TABELA_TEMPORARIA))
+        total = conexao.execute('SELECT count(*) FROM {}'.format(
+            TABELA_TEMPORARIA
+        )).scalar()
+
+        insert, padroes = _insert(conexao, modelo, presentes)
+        importadas = 0
+        for inicio in range(0, total, lote):
+            with conexao.begin():
+                ids = [id for id, in conexao.execute(
+                    insert, inicio=inicio, fim=inicio + lote, **padroes
+                )]
+                if modelo is Anuncio and ids:
+                    _atualizar_busca(conexao, ids)
+                if modelo is Imagem and ids:
+                    _tocar_anuncios(conexao, ids)
+            importadas += len(ids)
+            if progresso:
+                progresso(min(inicio + lote, total), total)
+
+        # The ids given by the file are not taken from the sequence
+        conexao.execute(text(
+            'SELECT setval({}, (SELECT coalesce(max(id), 0) + 1 FROM {}), '
+            'false)'.format(_sequencia(modelo.__table__),
+                            modelo.__tablename__)
+        ).execution_options(autocommit=True))
+    finally:
+        conexao.execute('DROP TABLE IF EXISTS {}'.format(TABELA_TEMPORARIA))
+        conexao.close()
+
+    if modelo is Anuncio:
+        reconstruir_facetas()
+        reconciliar_contadores()
+
+    return importadas, total
+
+
+def _colunas(modelo):
+    """
+    Returns:
+        (list): the columns that can be read from the files of the model
+    """
+    colunas = [coluna.name for coluna in modelo.__table__.columns
+               if coluna.name not in CALCULADAS]
+    return colunas + sorted(REFERENCIAS.get(modelo.__tablename__, {}))
+
+
+def _copiar_csv(conexao, arquivo, colunas):
+    """
+    Sends the CSV file to the temporary table as it is, with a single COPY
+
+    Returns:
+        (set): the columns present in the file
+    """
+    cabecalho = next(csv.reader([arquivo.readline()]))
+    _validar(cabecalho, colunas)
+    cursor = conexao.connection.cursor()
+    cursor.copy_expert('COPY {} ({}) FROM STDIN WITH (FORMAT csv)'.format(
+        TABELA_TEMPORARIA, ', '.join(cabecalho)
+    ), arquivo)
+    return set(cabecalho)
+
+
+def _copiar_ndjson(conexao, arquivo, colunas, lote):
+    """
+    Converts the NDJSON objects to CSV, sent to the temporary table with
+    one COPY every lote lines
+
+    Returns:
+        (set): the columns present in any of the objects
+    """
+    presentes = set()
+    cursor = conexao.connection.cursor()
+    copy = 'COPY {} ({}) FROM STDIN WITH (FORMAT csv)'.format(
+        TABELA_TEMPORARIA, ', '.join(colunas)
+    )
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    linhas = 0
+    for linha in arquivo:
+        if not linha.strip():
+            continue
+        objeto = json.loads(linha)
+        if not presentes.issuperset(objeto):
+            _validar(objeto, colunas)
+            presentes.update(objeto)
+        escritor.writerow([_texto(objeto.get(coluna)) for coluna in colunas])
+        linhas += 1
+        if linhas % lote == 0:
+            buffer.seek(0)
+            cursor.copy_expert(copy, buffer)
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        buffer.seek(0)
+        cursor.copy_expert(copy, buffer)
+    return presentes
+
+
+def _texto(valor):
+    if valor is None:
+        return ''
+    if isinstance(valor, bool):
+        return 'true' if valor else 'false'
+    return valor
+
+
+def _validar(nomes, colunas):
+    desconhecidas = sorted(set(nomes) - set(colunas))
+    if desconhecidas:
+        raise ValueError('Colunas desconhecidas: {}'.format(
+            ', '.join(desconhecidas)
+        ))
+
+
+def _insert(conexao, modelo, presentes):
+    """
+    Builds the INSERT ... SELECT of one batch of the temporary table.
+    Each foreign key is resolved by a join with the referenced table, on
+    its id or on the natural key given instead.
+
+    Returns:
+        (tuple): Containing the statement and the values of the defaults
+    """
+    tabela = modelo.__table__
+    referencias = REFERENCIAS.get(tabela.name, {})
+    chaves = {}
+    for chave in tabela.foreign_keys:
+        chaves[chave.parent.name] = (chave.column.table.name,
+                                     chave.column.name, chave.parent.name)
+    for origem, (coluna, natural) in referencias.items():
+        if origem in presentes:
+            chaves[coluna] = (chaves[coluna][0], natural, origem)
+
+    nomes, valores, joins, padroes = [], [], [], {}
+    for coluna in tabela.columns:
+        nome = coluna.name
+        if nome in chaves:
+            referenciada, chave, origem = chaves[nome]
+            apelido = 'ref_{}'.format(nome)
+            valor = 's.{}'.format(origem)
+            if chave == 'id':
+                valor = "nullif({}, '')::integer".format(valor)
+            joins.append('JOIN {0} {1} ON {1}.{2} = {3}'.format(
+                referenciada, apelido, chave, valor
+            ))
+            nomes.append(nome)
+            valores.append('{}.id'.format(apelido))
+            continue
+        if nome in CALCULADAS:
+            continue
+        valor = None
+        if nome in presentes:
+            valor = "nullif(s.{}, '')::{}".format(
+                nome, coluna.type.compile(dialect=conexao.dialect)
+            )
+        if nome == 'id':
+            proximo = 'nextval({})'.format(_sequencia(tabela))
+            valor = proximo if valor is None else \
+                'coalesce({}, {})'.format(valor, proximo)
+        elif coluna.default is not None:
+            padrao = coluna.default.arg
+            padroes['padrao_' + nome] = padrao(None) if callable(padrao) \
+                else padrao
+            valor = ':padrao_{}'.format(nome) if valor is None else \
+                'coalesce({}, :padrao_{})'.format(valor, nome)
+        if valor is not None:
+            nomes.append(nome)
+            valores.append(valor)
+
+    return text(
+        'INSERT INTO {} ({}) SELECT {} FROM {} s {} '
+        'WHERE s.linha > :inicio AND s.linha <= :fim ORDER BY s.linha '
+        'ON CONFLICT DO NOTHING RETURNING {}.id'.format(
+            tabela.name, ', '.join(nomes), ', '.join(valores),
+            TABELA_TEMPORARIA, ' '.join(joins), tabela.name
+        )
+    ), padroes
+
+
+def _sequencia(tabela):
+    """
+    Returns:
+        (str): the SQL expression of the name of the id sequence
+    """
+    if isinstance(tabela.c.id.default, Sequence):
+        return "'{}'".format(tabela.c.id.default.name)
+    return "pg_get_serial_sequence('{}', 'id')".format(tabela.name)
+
+
+def _atualizar_busca(conexao, ids):
+    """
+    Computes query_busca and vetor_busca of the Anuncios imported
+    """
+    campos = {campo: getattr(Anuncio, campo) for campo, _ in PESOS_BUSCA}
+    conexao.execute(Anuncio.__table__.update().where(
+        Anuncio.__table__.c.id == any_(bindparam('ids', type_=ARRAY(Integer)))
+    ).values(
+        query_busca=Anuncio.criar_query_busca_sql(),
+        vetor_busca=Anuncio.criar_vetor_busca(campos)
+    ), ids=ids)
+
+
+def _tocar_anuncios(conexao, ids):
+    """
+    Bumps atualizado_em of the Anuncios of the Imagens imported, as
+    Anuncio.tocar does
+    """
+    imagens = Imagem.__table__
+    anuncios = Anuncio.__table__
+    conexao.execute(anuncios.update().where(
+        anuncios.c.id.in_(select([imagens.c.anuncio_id]).where(
+            imagens.c.id == any_(bindparam('ids', type_=ARRAY(Integer)))
+        ))
+    ).values(atualizado_em=datetime.now()), ids=ids)
@@ -1,14 +1,94 @@
-""" Module to handle our migrations """
+""" Module to handle our migrations and batch jobs """
 
-from flask_script import Manager
+from flask_script import Command, Manager
 from flask_migrate import Migrate, MigrateCommand
 
-from backend.app import app, db
+from backend.app import create_app, db
+from backend.config import ManagerConfig
+from backend import importacao, tasks
 
 
+app = create_app(ManagerConfig)
 migrate = Migrate(app, db)
 manager = Manager(app)
 manager.add_command('db', MigrateCommand)
 
+
+def _mostrar_progresso(processados, total):
+    print('{}/{}'.format(processados, total))
+
+
+def comando(func):
+    """
+    Decorator registering a function without options as a command, as
+    manager.option does. manager.command is not used: it calls
+    inspect.getargspec, removed in Python 3.11.
+    """
+    command = Command()
+    command.run = func
+    command.__doc__ = func.__doc__
+    manager.add_command(func.__name__, command)
+
+    return func
+
+
+@manager.option('-l', '--lote', dest='lote', type=int, default=1000,
+                help='Anuncios per transaction')
+@manager.option('-r', '--reiniciar', dest='reiniciar', action='store_true',
+                help='Ignores the progress of an interrupted run')
+def recalcular_busca(lote, reiniciar):
+    """
+    Recomputes query_busca and vetor_busca of all Anuncios
+    """
+    processados, total, _ = tasks.recalcular_busca(
+        lote, reiniciar, progresso=_mostrar_progresso
+    )
+    print('Querys busca atualizadas: {}/{}'.format(processados, total))
+
+
+@manager.option('-l', '--lote', dest='lote', type=int, default=10000,
+                help='Buscas per transaction')
+def atualizar_relatorio_buscas(lote):
+    """
+    Adds the Buscas saved since the last run to the report rollups
+    """
+    processadas, _ = tasks.atualizar_relatorio_buscas(lote)
+    print('Buscas adicionadas ao relatorio: {}'.format(processadas))
+
+
+@manager.option('arquivo', help='CSV file with a header or NDJSON file')
+@manager.option('entidade', choices=sorted(importacao.ENTIDADES),
+                help='What the file contains')
+@manager.option('-f', '--formato', dest='formato', choices=['csv', 'ndjson'],
+                help='Format of the file, by default from its extension')
+@manager.option('-l', '--lote', dest='lote', type=int, default=10000,
+                help='Rows per transaction')
+def importar(entidade, arquivo, formato, lote):
+    """
+    Bulk imports Usuarios, Anuncios or Imagens with COPY
+    """
+    importadas, total = importacao.importar(entidade, arquivo, formato, lote,
+                                            progresso=_mostrar_progresso)
+    print('Importados: {}/{} {}'.format(importadas, total, entidade))
+
+
+@comando
+def reconstruir_facetas():
+    """
+    Rebuilds the faceta table from the approved Anuncios
+    """
+    total = tasks.reconstruir_facetas()
+    print('Facetas reconstruidas: {} valores'.format(total))
+
+
+@comando
+def reconciliar_contadores():
+    """
+    Recounts the counters of Anuncios of the Usuarios
+    """
+    corrigidos = tasks.reconciliar_contadores()
+    print('Contadores corrigidos: {} usuarios'.format(corrigidos))
+
+
 if __name__ == '__main__':
     manager.run()
@@ -0,0 +1,38 @@
+"""anuncio.vetor_busca weighted tsvector with GIN index
+
+Revision ID: 3c9e1f7a2b6d
+Revises: a0f4de25011d
+Create Date: 2026-10-17 09:12:40.118203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '3c9e1f7a2b6d'
+down_revision = 'a0f4de25011d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('anuncio', sa.Column('vetor_busca', postgresql.TSVECTOR(), nullable=True))
+    # Same weights as backend.models.PESOS_BUSCA
+    op.execute("""
+        UPDATE anuncio SET vetor_busca =
+            setweight(to_tsvector('portuguese', coalesce(marca, '')), 'A') ||
+            setweight(to_tsvector('portuguese', coalesce(modelo, '')), 'A') ||
+            setweight(to_tsvector('portuguese', coalesce(titulo, '')), 'B') ||
+            setweight(to_tsvector('portuguese', coalesce(ano::varchar, '')), 'C') ||
+            setweight(to_tsvector('portuguese', coalesce(cor, '')), 'C') ||
+            setweight(to_tsvector('portuguese', coalesce(descricao, '')), 'D')
+    """)
+    op.create_index('ix_anuncio_vetor_busca', 'anuncio', ['vetor_busca'],
+                    unique=False, postgresql_using='gin')
+
+
+def downgrade():
+    op.drop_index('ix_anuncio_vetor_busca', table_name='anuncio')
+    op.drop_column('anuncio', 'vetor_busca')
@@ -0,0 +1,25 @@
+"""ix_imagem_anuncio_id for the imagens aggregated by the listings
+
+Revision ID: 4b7e9f1a3c85
+Revises: d83f2a6c4e17
+Create Date: 2026-10-17 19:41:07.552913
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4b7e9f1a3c85'
+down_revision = 'd83f2a6c4e17'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_imagem_anuncio_id', 'imagem', ['anuncio_id'],
+                    unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_imagem_anuncio_id', table_name='imagem')
@@ -0,0 +1,56 @@
+"""faceta table with the counts of the search facets
+
+Revision ID: 5f3b9d2e7a14
+Revises: e4a8d1b0c5f6
+Create Date: 2026-10-17 15:02:41.118230
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from backend.config import Config
+
+
+# revision identifiers, used by Alembic.
+revision = '5f3b9d2e7a14'
+down_revision = 'e4a8d1b0c5f6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('faceta',
+    sa.Column('dimensao', sa.String(), nullable=False),
+    sa.Column('valor', sa.String(), nullable=False),
+    sa.Column('quantidade', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('dimensao', 'valor')
+    )
+    # Same values as backend.models.Faceta.expressoes
+    anos = Config.FACETAS_ANOS_POR_FAIXA
+    faixas_valor, inicio = [], 0
+    for limite in Config.FACETAS_FAIXAS_VALOR:
+        faixas_valor.append("WHEN a.valor < {} THEN '{}-{}'".format(
+            limite, inicio, limite - 1
+        ))
+        inicio = limite
+    op.execute("""
+        INSERT INTO faceta (dimensao, valor, quantidade)
+        SELECT f.dimensao, f.valor, count(*) FROM anuncio a,
+        LATERAL (VALUES
+            ('marca', nullif(a.marca, '')),
+            ('modelo', nullif(a.modelo, '')),
+            ('faixa_ano', CASE WHEN a.ano > 0 THEN
+                (a.ano / {anos} * {anos})::varchar || '-' ||
+                (a.ano / {anos} * {anos} + {anos} - 1)::varchar END),
+            ('estado_veiculo', nullif(a.estado_veiculo, '')),
+            ('faixa_valor', CASE WHEN a.valor <= 0 THEN NULL
+                {faixas_valor} WHEN a.valor > 0 THEN '{inicio}+' END)
+        ) AS f (dimensao, valor)
+        WHERE a.aprovado AND f.valor IS NOT NULL
+        GROUP BY f.dimensao, f.valor
+    """.format(anos=anos, faixas_valor=' '.join(faixas_valor),
+               inicio=inicio))
+
+
+def downgrade():
+    op.drop_table('faceta')
@@ -0,0 +1,26 @@
+"""keyset pagination index on anuncio
+
+Revision ID: 7d2a4c8e1f03
+Revises: 3c9e1f7a2b6d
+Create Date: 2026-10-17 10:03:27.540916
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d2a4c8e1f03'
+down_revision = '3c9e1f7a2b6d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_anuncio_aprovado_criado_em_id', 'anuncio',
+                    ['aprovado', sa.text('criado_em DESC'), sa.text('id DESC')],
+                    unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_anuncio_aprovado_criado_em_id', table_name='anuncio')
@@ -0,0 +1,38 @@
+"""partial indexes of the structured filters on anuncio
+
+Revision ID: 9c1e6a4f2d58
+Revises: 5f3b9d2e7a14
+Create Date: 2026-10-17 16:21:09.403117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9c1e6a4f2d58'
+down_revision = '5f3b9d2e7a14'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_anuncio_filtro_marca_modelo', 'anuncio',
+                    [sa.text('lower(marca)'), sa.text('lower(modelo)'),
+                     'ano', 'valor'],
+                    unique=False, postgresql_where=sa.text('aprovado'))
+    op.create_index('ix_anuncio_filtro_valor', 'anuncio', ['valor', 'ano'],
+                    unique=False, postgresql_where=sa.text('aprovado'))
+    op.create_index('ix_anuncio_filtro_ano', 'anuncio', ['ano', 'valor'],
+                    unique=False, postgresql_where=sa.text('aprovado'))
+    op.create_index('ix_anuncio_filtro_local', 'anuncio',
+                    [sa.text('upper(estado_veiculo)'),
+                     sa.text('lower(cidade_veiculo)')],
+                    unique=False, postgresql_where=sa.text('aprovado'))
+
+
+def downgrade():
+    op.drop_index('ix_anuncio_filtro_local', table_name='anuncio')
+    op.drop_index('ix_anuncio_filtro_ano', table_name='anuncio')
+    op.drop_index('ix_anuncio_filtro_valor', table_name='anuncio')
+    op.drop_index('ix_anuncio_filtro_marca_modelo', table_name='anuncio')
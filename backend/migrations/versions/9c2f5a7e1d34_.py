@@ -0,0 +1,42 @@
+"""Counters of the Anuncios on the usuario table
+
+Revision ID: 9c2f5a7e1d34
+Revises: 4b7e9f1a3c85
+Create Date: 2026-10-17 20:12:45.318026
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9c2f5a7e1d34'
+down_revision = '4b7e9f1a3c85'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('usuario', sa.Column('qtd_anuncios', sa.Integer(),
+                                       server_default='0', nullable=False))
+    op.add_column('usuario', sa.Column('qtd_anuncios_aprovados',
+                                       sa.Integer(), server_default='0',
+                                       nullable=False))
+    op.add_column('usuario', sa.Column('total_views', sa.Integer(),
+                                       server_default='0', nullable=False))
+    op.execute(
+        'UPDATE usuario SET qtd_anuncios = c.qtd_anuncios, '
+        'qtd_anuncios_aprovados = c.qtd_anuncios_aprovados, '
+        'total_views = c.total_views '
+        'FROM (SELECT usuario_id, count(id) AS qtd_anuncios, '
+        'count(id) FILTER (WHERE aprovado) AS qtd_anuncios_aprovados, '
+        'coalesce(sum(views), 0) AS total_views '
+        'FROM anuncio GROUP BY usuario_id) AS c '
+        'WHERE usuario.id = c.usuario_id'
+    )
+
+
+def downgrade():
+    op.drop_column('usuario', 'total_views')
+    op.drop_column('usuario', 'qtd_anuncios_aprovados')
+    op.drop_column('usuario', 'qtd_anuncios')
@@ -0,0 +1,24 @@
+"""imagem processing status
+
+Revision ID: b51e07c93a2f
+Revises: 7d2a4c8e1f03
+Create Date: 2026-10-17 11:26:51.307448
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b51e07c93a2f'
+down_revision = '7d2a4c8e1f03'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('imagem', sa.Column('status', sa.String(), server_default='pronta', nullable=True))
+
+
+def downgrade():
+    op.drop_column('imagem', 'status')
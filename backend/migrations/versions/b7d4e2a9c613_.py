@@ -0,0 +1,29 @@
+"""busca.salvo_em, the time of the INSERT set by the database
+
+Revision ID: b7d4e2a9c613
+Revises: 9c2f5a7e1d34
+Create Date: 2026-10-17 23:05:12.440918
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d4e2a9c613'
+down_revision = '9c2f5a7e1d34'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Added without default, so the existing rows are not rewritten. They
+    # are left NULL, already committed
+    op.add_column('busca', sa.Column('salvo_em', sa.DateTime(),
+                                     nullable=True))
+    op.alter_column('busca', 'salvo_em',
+                    server_default=sa.text('clock_timestamp()'))
+
+
+def downgrade():
+    op.drop_column('busca', 'salvo_em')
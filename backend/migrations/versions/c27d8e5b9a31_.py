@@ -0,0 +1,54 @@
+"""busca.resultados and the rollups of the report of the Buscas
+
+Revision ID: c27d8e5b9a31
+Revises: 9c1e6a4f2d58
+Create Date: 2026-10-17 18:12:55.620731
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c27d8e5b9a31'
+down_revision = '9c1e6a4f2d58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('busca', sa.Column('resultados', sa.Integer(),
+                                     nullable=True))
+    op.create_table('busca_hora',
+    sa.Column('hora', sa.DateTime(), nullable=False),
+    sa.Column('quantidade', sa.Integer(), nullable=False),
+    sa.Column('sem_resultado', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('hora')
+    )
+    op.create_table('busca_dia',
+    sa.Column('dia', sa.Date(), nullable=False),
+    sa.Column('quantidade', sa.Integer(), nullable=False),
+    sa.Column('sem_resultado', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('dia')
+    )
+    op.create_table('busca_termo',
+    sa.Column('termo', sa.String(), nullable=False),
+    sa.Column('quantidade', sa.Integer(), nullable=False),
+    sa.Column('sem_resultado', sa.Integer(), nullable=False),
+    sa.Column('ultima_busca_em', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('termo')
+    )
+    op.create_index('ix_busca_termo_quantidade', 'busca_termo',
+                    [sa.text('quantidade DESC'), 'termo'], unique=False)
+    op.create_index('ix_busca_termo_sem_resultado', 'busca_termo',
+                    [sa.text('sem_resultado DESC'), 'termo'], unique=False,
+                    postgresql_where=sa.text('sem_resultado > 0'))
+
+
+def downgrade():
+    op.drop_index('ix_busca_termo_sem_resultado', table_name='busca_termo')
+    op.drop_index('ix_busca_termo_quantidade', table_name='busca_termo')
+    op.drop_table('busca_termo')
+    op.drop_table('busca_dia')
+    op.drop_table('busca_hora')
+    op.drop_column('busca', 'resultados')
@@ -0,0 +1,34 @@
+"""atualizado_em of anuncio and usuario, versions of the ETags
+
+Revision ID: d83f2a6c4e17
+Revises: c27d8e5b9a31
+Create Date: 2026-10-17 19:04:21.318406
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd83f2a6c4e17'
+down_revision = 'c27d8e5b9a31'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('anuncio', sa.Column('atualizado_em', sa.DateTime(),
+                                       nullable=True))
+    op.add_column('usuario', sa.Column('atualizado_em', sa.DateTime(),
+                                       nullable=True))
+    # Any value works as the first version
+    op.execute('UPDATE anuncio SET atualizado_em = LOCALTIMESTAMP')
+    op.execute('UPDATE usuario SET atualizado_em = LOCALTIMESTAMP')
+    op.create_index('ix_anuncio_usuario_id', 'anuncio', ['usuario_id'],
+                    unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_anuncio_usuario_id', table_name='anuncio')
+    op.drop_column('usuario', 'atualizado_em')
+    op.drop_column('anuncio', 'atualizado_em')
@@ -0,0 +1,29 @@
+"""marcador table for resumable batch jobs
+
+Revision ID: e4a8d1b0c5f6
+Revises: b51e07c93a2f
+Create Date: 2026-10-17 13:40:08.772015
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4a8d1b0c5f6'
+down_revision = 'b51e07c93a2f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('marcador',
+    sa.Column('nome', sa.String(), nullable=False),
+    sa.Column('valor', sa.Integer(), nullable=True),
+    sa.Column('atualizado_em', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('nome')
+    )
+
+
+def downgrade():
+    op.drop_table('marcador')
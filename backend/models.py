@@ -1,10 +1,26 @@
-from datetime import datetime
+import os
 
-from sqlalchemy import func
-from sqlalchemy.orm import relationship
-from sqlalchemy.sql import text
+from collections import Counter
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, cast, tuple_, case, literal, null, literal_column
+from sqlalchemy.dialects.postgresql import (
+    TSVECTOR, insert, aggregate_order_by
+)
+from sqlalchemy.orm import relationship, selectinload
 
 from backend.app import db
+from backend.config import Config as config
+from backend.utils import encode_cursor, gerar_etag
+
+
+# Fields that compose Anuncio.vetor_busca and their tsvector weights
+PESOS_BUSCA = [
+    ('marca', 'A'), ('modelo', 'A'), ('titulo', 'B'),
+    ('ano', 'C'), ('cor', 'C'), ('descricao', 'D')
+]
+# to_char version of the '%d/%m/%Y %H:%M:%S' format of the to_json methods
+FORMATO_DATA_SQL = 'DD/MM/YYYY HH24:MI:SS'
 
 
 class DAO(object):
@@ -31,6 +47,24 @@ class DAO(object):
 
         return data
 
+    @classmethod
+    def iterar_json(cls, lote):
+        """
+        Reads all results through a server-side cursor, lote rows per
+        fetch, so the memory used does not depend on the size of the table
+
+        Args:
+            cls (class): the class object
+            lote (int): rows fetched at a time
+
+        Yields:
+            (dict): the JSON of each result, in the order of the primary key
+        """
+        data = db.session.query(cls).order_by(*cls.__table__.primary_key)
+        data = data.execution_options(stream_results=True).yield_per(lote)
+        for d in data:
+            yield d.to_json()
+
     @classmethod
     def get_first(cls, **kwargs):
         """
@@ -100,11 +134,17 @@ class Contato(db.Model, DAO):
 
 class Imagem(db.Model, DAO):
     __tablename__ = 'imagem'
+    # Processing status
+    PENDENTE = 'pendente'
+    PRONTA = 'pronta'
+    ERRO = 'erro'
 
     id = db.Column(db.Integer, primary_key=True)
-    anuncio_id = db.Column(db.Integer, db.ForeignKey('anuncio.id'))
+    anuncio_id = db.Column(db.Integer, db.ForeignKey('anuncio.id'),
+                           index=True)
     titulo = db.Column(db.String())
     img_filename = db.Column(db.String())
+    status = db.Column(db.String(), default=PRONTA, server_default=PRONTA)
 
     def __repr__(self):
         return '<image id={},titulo={}>'.format(self.id, self.titulo)
@@ -112,9 +152,37 @@ class Imagem(db.Model, DAO):
     def to_json(self):
         return {
             'id': self.id, 'anuncio_id': self.anuncio_id,
-            'imagem': self.img_filename
+            'imagem': self.img_filename, 'status': self.status
         }
 
+    def caminho(self):
+        """
+        Returns:
+            (str): the path of the image file
+        """
+        # The static/ prefix is removed when the image is saved
+        if os.path.isabs(self.img_filename):
+            return self.img_filename
+        return os.path.join('static', self.img_filename)
+
+    @staticmethod
+    def atualizar_status(imagem_id, status):
+        """
+        Updates the processing status of the image and the version of
+        its Anuncio
+
+        Args:
+            imagem_id (int): id of the Imagem
+            status (str): PRONTA or ERRO
+        """
+        query = db.session.query(Imagem).filter_by(id=imagem_id)
+        query.update({'status': status}, synchronize_session=False)
+        anuncio_id = db.session.query(Imagem.anuncio_id).filter_by(
+            id=imagem_id
+        ).as_scalar()
+        Anuncio.tocar(anuncio_id)
+        db.session.commit()
+
     @staticmethod
     def add_image(image_dict):
         """
@@ -127,13 +195,21 @@ class Imagem(db.Model, DAO):
         new_image = Imagem(anuncio_id=image_dict['anuncio_id'],
                            img_filename=img_filename)
         db.session.add(new_image)
+        Anuncio.tocar(image_dict['anuncio_id'])
         db.session.commit()
 
 
 class Anuncio(db.Model, DAO):
     __tablename__ = 'anuncio'
+    # Keys of to_json(include_usuario=False), in order. See colunas_json
+    CAMPOS_JSON = [
+        'id', 'titulo', 'descricao', 'valor', 'marca', 'modelo', 'ano',
+        'cor', 'aprovado', 'views', 'imagens', 'troca', 'leilao',
+        'cidade_veiculo', 'estado_veiculo', 'criado_em'
+    ]
     id = db.Column(db.Integer, primary_key=True)
-    usuario_id = db.Column(db.Integer, db.ForeignKey('usuario.id'))
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuario.id'),
+                           index=True)
     usuario = relationship('Usuario', back_populates='anuncios')
     imagens = relationship(Imagem, order_by='Imagem.id')
     titulo = db.Column(db.String)
@@ -145,15 +221,37 @@ class Anuncio(db.Model, DAO):
     cor = db.Column(db.String)
     # Field to enable faster search
     query_busca = db.Column(db.String)
+    # Weighted tsvector of PESOS_BUSCA, kept in sync by atualizar_busca
+    vetor_busca = db.Column(TSVECTOR)
     aprovado = db.Column(db.Boolean, default=False)
     views = db.Column(db.Integer, default=0)
     troca = db.Column(db.Boolean, default=False)
     leilao = db.Column(db.Boolean, default=False)
     aprovado_em = db.Column(db.DateTime())
     criado_em = db.Column(db.DateTime(), default=datetime.now)
+    # Version of the JSON, bumped by every write. See versao
+    atualizado_em = db.Column(db.DateTime(), default=datetime.now,
+                              onupdate=datetime.now)
     cidade_veiculo = db.Column(db.String, default='')
     estado_veiculo = db.Column(db.String, default='')
 
+    __table_args__ = (
+        db.Index('ix_anuncio_vetor_busca', 'vetor_busca',
+                 postgresql_using='gin'),
+        # Keyset pagination of the approved Anuncios
+        db.Index('ix_anuncio_aprovado_criado_em_id',
+                 aprovado, criado_em.desc(), id.desc()),
+        # Structured filters, see condicoes_filtros
+        db.Index('ix_anuncio_filtro_marca_modelo', func.lower(marca),
+                 func.lower(modelo), ano, valor, postgresql_where=aprovado),
+        db.Index('ix_anuncio_filtro_valor', valor, ano,
+                 postgresql_where=aprovado),
+        db.Index('ix_anuncio_filtro_ano', ano, valor,
+                 postgresql_where=aprovado),
+        db.Index('ix_anuncio_filtro_local', func.upper(estado_veiculo),
+                 func.lower(cidade_veiculo), postgresql_where=aprovado),
+    )
+
     def __init__(self, usuario_id, titulo, descricao, valor):
         self.usuario_id = usuario_id
         self.titulo = titulo
@@ -187,40 +285,378 @@ class Anuncio(db.Model, DAO):
         return r
 
     def criar_query_busca(self):
-        return '{} {} {} {}'.format(self.marca, self.modelo, self.ano, self.cor)
+        campos = [self.marca, self.modelo, self.ano, self.cor]
+        return ' '.join(str(c) for c in campos if c is not None and c != '')
+
+    def facetas(self):
+        """
+        The Faceta values the Anuncio is counted in
+
+        Returns:
+            (list): Containing (dimensao, valor) tuples, empty if the Anuncio
+                    is not approved
+        """
+        if self.aprovado is not True:
+            return []
+        valores = [
+            ('marca', self.marca), ('modelo', self.modelo),
+            ('faixa_ano', Faceta.faixa_ano(self.ano)),
+            ('estado_veiculo', self.estado_veiculo),
+            ('faixa_valor', Faceta.faixa_valor(self.valor))
+        ]
+        return [(dimensao, valor) for dimensao, valor in valores if valor]
+
+    def contadores(self):
+        """
+        What the Anuncio adds to the counters of its Usuario
+
+        Returns:
+            (dict): Containing one value per Usuario.CONTADORES
+        """
+        return {
+            'qtd_anuncios': 1,
+            'qtd_anuncios_aprovados': 1 if self.aprovado is True else 0,
+            'total_views': self.views or 0
+        }
 
     @staticmethod
-    def get(order_by, limit):
-        order_by = Anuncio.criado_em.desc()
+    def tocar(anuncio_id):
+        """
+        Bumps atualizado_em of the Anuncio, for the writes that change its
+        JSON without changing its row, like those of the imagens.
+        It is committed by the caller.
+
+        Args:
+            anuncio_id (int): id of the Anuncio or a scalar subquery
+        """
+        db.session.query(Anuncio).filter(Anuncio.id == anuncio_id).update(
+            {'atualizado_em': datetime.now()}, synchronize_session=False
+        )
+
+    @staticmethod
+    def versao(id):
+        """
+        Versions the JSON of the Anuncio, which embeds its Usuario,
+        with a single indexed query
+
+        Args:
+            id (int): The id of the Anuncio
+
+        Returns:
+            (tuple): Containing the ETag and the last modification,
+                     or None if the Anuncio does not exist
+        """
+        versao = db.session.query(
+            Anuncio.atualizado_em, Usuario.atualizado_em
+        ).outerjoin(Usuario, Anuncio.usuario_id == Usuario.id).filter(
+            Anuncio.id == id
+        ).first()
+        if versao is None:
+            return None
+        modificado = max(data for data in versao if data is not None)
+        return gerar_etag('anuncio', id, *versao), modificado
+
+    @staticmethod
+    def criar_query_busca_sql():
+        """
+        The SQL version of criar_query_busca, for set-based updates
+
+        Returns:
+            (sqlalchemy.sql.ClauseElement): the query_busca expression
+        """
+        return func.concat_ws(
+            ' ', func.nullif(Anuncio.marca, ''),
+            func.nullif(Anuncio.modelo, ''), Anuncio.ano,
+            func.nullif(Anuncio.cor, '')
+        )
+
+    @staticmethod
+    def criar_vetor_busca(campos):
+        """
+        Builds the weighted tsvector SQL expression for the search
+
+        Args:
+            campos (dict): PESOS_BUSCA field names mapped to values or columns
+
+        Returns:
+            (sqlalchemy.sql.ClauseElement): the tsvector expression
+        """
+        vetor = None
+        for campo, peso in PESOS_BUSCA:
+            texto = func.coalesce(cast(campos[campo], db.String), '')
+            parte = func.setweight(
+                func.to_tsvector(config.BUSCA_IDIOMA, texto), peso
+            )
+            vetor = parte if vetor is None else vetor.op('||')(parte)
+        return vetor
+
+    def atualizar_busca(self):
+        """
+        Updates query_busca and vetor_busca with the current field values.
+        vetor_busca is computed by the database on the next flush.
+        """
+        self.query_busca = self.criar_query_busca()
+        campos = {campo: getattr(self, campo) for campo, _ in PESOS_BUSCA}
+        self.vetor_busca = Anuncio.criar_vetor_busca(campos)
+
+    @staticmethod
+    def query_completa():
+        """
+        Query of Anuncios that batch loads the imagens and the usuario
+        used by to_json, avoiding one lazy load per row
+
+        Returns:
+            (sqlalchemy.orm.Query): the query of Anuncios
+        """
+        return db.session.query(Anuncio).options(
+            selectinload(Anuncio.imagens), selectinload(Anuncio.usuario)
+        )
+
+    @staticmethod
+    def colunas_json():
+        """
+        The SQL version of to_json(include_usuario=False), one column per
+        key of CAMPOS_JSON. The imagens are aggregated by json_agg, using
+        ix_imagem_anuncio_id, and criado_em is formatted by to_char
+
+        Returns:
+            (list): the column expressions
+        """
+        imagem = func.json_build_object(
+            'id', Imagem.id, 'anuncio_id', Imagem.anuncio_id,
+            'imagem', Imagem.img_filename, 'status', Imagem.status
+        )
+        imagens = db.session.query(func.coalesce(
+            func.json_agg(aggregate_order_by(imagem, Imagem.id)),
+            literal_column("'[]'::json")
+        )).filter(Imagem.anuncio_id == Anuncio.id).correlate(Anuncio)
+
+        return [
+            Anuncio.id, Anuncio.titulo, Anuncio.descricao, Anuncio.valor,
+            Anuncio.marca, Anuncio.modelo, Anuncio.ano, Anuncio.cor,
+            Anuncio.aprovado, Anuncio.views, imagens.as_scalar(),
+            Anuncio.troca, Anuncio.leilao, Anuncio.cidade_veiculo,
+            Anuncio.estado_veiculo,
+            func.to_char(Anuncio.criado_em, FORMATO_DATA_SQL)
+        ]
+
+    @staticmethod
+    def query_projecao():
+        """
+        Query of the columns of to_json, with the usuario joined, read as
+        plain tuples instead of ORM objects. The rows also bring criado_em
+        and id for paginar and are turned into JSON by projetar.
+
+        Returns:
+            (sqlalchemy.orm.Query): the query of rows
+        """
+        usuario = [
+            coluna.label('usuario_{}'.format(campo)) for campo, coluna
+            in zip(Usuario.CAMPOS_JSON, Usuario.colunas_json())
+        ]
+        colunas = Anuncio.colunas_json() + usuario + [Anuncio.criado_em]
+        return db.session.query(*colunas).outerjoin(
+            Usuario, Anuncio.usuario_id == Usuario.id
+        )
+
+    @staticmethod
+    def projetar(linhas):
+        """
+        Builds the JSON of the rows of query_projecao, equal to to_json
+
+        Args:
+            linhas (iterable): rows of query_projecao
+
+        Yields:
+            (dict): the JSON of each Anuncio
+        """
+        inicio = len(Anuncio.CAMPOS_JSON)
+        fim = inicio + len(Usuario.CAMPOS_JSON)
+        for linha in linhas:
+            yield dict(
+                zip(Anuncio.CAMPOS_JSON, linha),
+                usuario=dict(zip(Usuario.CAMPOS_JSON, linha[inicio:fim]))
+            )
+
+    @staticmethod
+    def paginar(anuncios, limit, cursor):
+        """
+        Applies the keyset pagination on (criado_em, id) to the query
+
+        Args:
+            anuncios (sqlalchemy.orm.Query): query of Anuncios or of rows
+                                            with their criado_em and id
+            limit (int): page size. All the rows are returned if None
+            cursor (tuple): (criado_em, id) of the last Anuncio already seen
+
+        Returns:
+            (tuple): Containing the Anuncios of the page and the next cursor
+        """
+        anuncios = anuncios.order_by(Anuncio.criado_em.desc(),
+                                     Anuncio.id.desc())
+        if cursor:
+            chave = tuple_(Anuncio.criado_em, Anuncio.id)
+            anuncios = anuncios.filter(chave < tuple_(*cursor))
+        if not limit:
+            return anuncios.all(), None
+
+        # Fetching one extra row tells if there is a next page
+        anuncios = anuncios.limit(limit + 1).all()
+        next_cursor = None
+        if len(anuncios) > limit:
+            anuncios = anuncios[:limit]
+            ultimo = anuncios[-1]
+            next_cursor = encode_cursor(ultimo.criado_em, ultimo.id)
+
+        return anuncios, next_cursor
+
+    @staticmethod
+    def condicoes_filtros(filtros):
+        """
+        Conditions of the structured filters of the listing and the search.
+        Text is compared case insensitively, matching the expression
+        indexes. The values are sent as bound parameters.
+
+        Args:
+            filtros (dict): Containing the FILTROS_ANUNCIO received
+
+        Returns:
+            (list): the SQL conditions
+        """
+        condicoes = []
+        if filtros.get('valor_min') is not None:
+            condicoes.append(Anuncio.valor >= filtros['valor_min'])
+        if filtros.get('valor_max') is not None:
+            condicoes.append(Anuncio.valor <= filtros['valor_max'])
+        if filtros.get('ano_min') is not None:
+            condicoes.append(Anuncio.ano >= filtros['ano_min'])
+        if filtros.get('ano_max') is not None:
+            condicoes.append(Anuncio.ano <= filtros['ano_max'])
+        for campo in ['marca', 'modelo', 'cidade_veiculo']:
+            if filtros.get(campo):
+                coluna = getattr(Anuncio, campo)
+                condicoes.append(func.lower(coluna) == filtros[campo].lower())
+        if filtros.get('estado_veiculo'):
+            estado = filtros['estado_veiculo'].upper()
+            condicoes.append(func.upper(Anuncio.estado_veiculo) == estado)
+        for campo in ['troca', 'leilao']:
+            if filtros.get(campo) is not None:
+                condicoes.append(getattr(Anuncio, campo).is_(filtros[campo]))
+
+        return condicoes
+
+    @staticmethod
+    def get(order_by, limit, cursor=None, filtros=None):
+        """
+        Lists the approved Anuncios, most recent first
+
+        Args:
+            order_by (str): 'random' or None for the most recent
+            limit (int): page size
+            cursor (tuple): decoded cursor of the previous page
+            filtros (dict): structured filters, see condicoes_filtros
+
+        Returns:
+            (tuple): Containing the Anuncios as JSON and the next cursor
+        """
+        # The bare column matches the WHERE aprovado of the partial indexes
+        anuncios = Anuncio.query_projecao().filter(
+            Anuncio.aprovado, *Anuncio.condicoes_filtros(filtros or {})
+        )
         if order_by == 'random':
-            order_by = func.random()
-        anuncios = db.session.query(Anuncio).filter_by(aprovado=True)
-        if limit:
-            anuncios = anuncios.order_by(order_by).limit(limit).all()
+            anuncios = anuncios.order_by(func.random()).limit(limit).all()
+            next_cursor = None
         else:
-            anuncios = anuncios.order_by(order_by).all()
-
-        return [anuncio.to_json() for anuncio in anuncios]
-
-    @staticmethod
-    def buscar(query_usuario, order_by, limit):
-        if limit == ' LIMIT None':
-            limit = ''
-        order_by = ' ORDER BY {}'.format(order_by)
-        if order_by == ' ORDER BY None':
-            order_by = ''
-        query = 'SELECT * FROM anuncio WHERE aprovado=true'
-        query += ' AND to_tsvector(query_busca) @@ to_tsquery(\'{}\'){}{};'
-        query = query.format(query_usuario, order_by, limit)
-        anuncios = [
-            a.to_json()
-            for a in db.session.query(Anuncio).from_statement(text(query)).all()
-        ]
-        return anuncios
+            anuncios, next_cursor = Anuncio.paginar(anuncios, limit, cursor)
+
+        return list(Anuncio.projetar(anuncios)), next_cursor
+
+    @classmethod
+    def iterar_json(cls, lote, filtros=None):
+        """
+        Reads all the approved Anuncios, most recent first, through a
+        server-side cursor. The order of ix_anuncio_aprovado_criado_em_id
+        lets the first rows arrive before the others are read.
+
+        Args:
+            lote (int): rows fetched at a time
+            filtros (dict): structured filters, see condicoes_filtros
+
+        Yields:
+            (dict): the JSON of each Anuncio
+        """
+        anuncios = Anuncio.query_projecao().filter(
+            Anuncio.aprovado, *Anuncio.condicoes_filtros(filtros or {})
+        ).order_by(Anuncio.criado_em.desc(), Anuncio.id.desc())
+        anuncios = anuncios.execution_options(stream_results=True)
+        return Anuncio.projetar(anuncios.yield_per(lote))
+
+    @staticmethod
+    def filtro_busca(query_usuario, filtros=None):
+        """
+        Conditions of the approved Anuncios matching query_usuario
+
+        Args:
+            query_usuario (str): text typed by the user. If empty only the
+                                 structured filters are applied
+            filtros (dict): structured filters, see condicoes_filtros
+
+        Returns:
+            (list): the SQL conditions
+        """
+        condicoes = [Anuncio.aprovado]
+        if query_usuario:
+            tsquery = func.plainto_tsquery(config.BUSCA_IDIOMA, query_usuario)
+            condicoes.append(Anuncio.vetor_busca.op('@@')(tsquery))
+
+        return condicoes + Anuncio.condicoes_filtros(filtros or {})
+
+    @staticmethod
+    def buscar(query_usuario, order_by, limit, cursor=None, filtros=None):
+        """
+        Searches the approved Anuncios matching query_usuario using the
+        vetor_busca GIN index. By default the results are ranked by relevance
+        and only the top limit are returned. The 'recentes' order, implied
+        when a cursor is supplied, is paginated on (criado_em, id).
+
+        Args:
+            query_usuario (str): text typed by the user
+            order_by (str): 'random', 'recentes' or None for relevance
+            limit (int): max number of results, defaults to BUSCA_LIMITE
+            cursor (tuple): decoded cursor of the previous page
+            filtros (dict): structured filters, see condicoes_filtros
+
+        Returns:
+            (tuple): Containing the Anuncios found as JSON and the next cursor
+        """
+        limit = limit or config.BUSCA_LIMITE
+        tsquery = func.plainto_tsquery(config.BUSCA_IDIOMA, query_usuario)
+        anuncios = Anuncio.query_projecao().filter(
+            *Anuncio.filtro_busca(query_usuario, filtros)
+        )
+        next_cursor = None
+        if cursor or order_by == 'recentes':
+            anuncios, next_cursor = Anuncio.paginar(anuncios, limit, cursor)
+        elif order_by == 'random':
+            anuncios = anuncios.order_by(func.random()).limit(limit)
+        else:
+            rank = func.ts_rank_cd(Anuncio.vetor_busca, tsquery)
+            anuncios = anuncios.order_by(rank.desc(), Anuncio.id.desc())
+            anuncios = anuncios.limit(limit)
+
+        return list(Anuncio.projetar(anuncios)), next_cursor
 
 
 class Usuario(db.Model, DAO):
     __tablename__ = 'usuario'
+    # Counters kept by atualizar_contadores, fixed by
+    # tasks.reconciliar_contadores if they drift
+    CONTADORES = ['qtd_anuncios', 'qtd_anuncios_aprovados', 'total_views']
+    # Keys of to_json(include_anuncios=False), in order. See colunas_json
+    CAMPOS_JSON = [
+        'id', 'facebook_id', 'nome', 'tipo', 'cidade', 'estado', 'telefone',
+        'email', 'views', 'cadastrado_em'
+    ]
     id = db.Column(db.Integer,
                    db.Sequence('seq_usuario_id', start=1, increment=1),
                    primary_key=True, autoincrement=True)
@@ -235,6 +671,16 @@ class Usuario(db.Model, DAO):
     email = db.Column(db.String, default='')
     views = db.Column(db.Integer, default=0)
     cadastrado_em = db.Column(db.DateTime(), default=datetime.now)
+    # Version of the JSON, bumped by every write. See versao
+    atualizado_em = db.Column(db.DateTime(), default=datetime.now,
+                              onupdate=datetime.now)
+    # Counters of the Anuncios, see atualizar_contadores
+    qtd_anuncios = db.Column(db.Integer, default=0, server_default='0',
+                             nullable=False)
+    qtd_anuncios_aprovados = db.Column(db.Integer, default=0,
+                                       server_default='0', nullable=False)
+    total_views = db.Column(db.Integer, default=0, server_default='0',
+                            nullable=False)
 
     def __init__(self, facebook_id, nome, email, tipo, cidade, estado, telefone):
         self.facebook_id = facebook_id
@@ -278,7 +724,10 @@ class Usuario(db.Model, DAO):
 
     @staticmethod
     def get(id):
-        usuario = db.session.query(Usuario)
+        carregar_anuncios = selectinload(Usuario.anuncios)
+        usuario = db.session.query(Usuario).options(
+            carregar_anuncios.selectinload(Anuncio.imagens)
+        )
         if len(str(id)) < 6:
             usuario = usuario.filter_by(id=id).first()
         else:
@@ -286,13 +735,99 @@ class Usuario(db.Model, DAO):
 
         return usuario
 
+    @staticmethod
+    def versao(id):
+        """
+        Versions the JSON of the Usuario, which embeds all its Anuncios,
+        with a single query using ix_anuncio_usuario_id. The count of
+        Anuncios catches the deletions.
+
+        Args:
+            id (int): The id or the facebook_id of the Usuario, as in get
+
+        Returns:
+            (tuple): Containing the id of the Usuario, the ETag and the last
+                     modification, or None if the Usuario does not exist
+        """
+        versao = db.session.query(
+            Usuario.id, Usuario.atualizado_em,
+            func.max(Anuncio.atualizado_em), func.count(Anuncio.id)
+        ).outerjoin(Anuncio, Anuncio.usuario_id == Usuario.id).group_by(
+            Usuario.id
+        )
+        if len(str(id)) < 6:
+            versao = versao.filter(Usuario.id == id).first()
+        else:
+            versao = versao.filter(Usuario.facebook_id == str(id)).first()
+        if versao is None:
+            return None
+        modificado = max(data for data in versao[1:3] if data is not None)
+        return versao[0], gerar_etag('usuario', *versao), modificado
+
+    @staticmethod
+    def atualizar_contadores(usuario_id, antes, depois, limite=None):
+        """
+        Applies the change of one Anuncio to the counters of its Usuario
+        with an atomic UPDATE ... SET counter = counter + delta.
+        It is committed by the caller, with the change of the Anuncio.
+
+        Args:
+            usuario_id (int): id of the Usuario
+            antes (dict): Anuncio.contadores before the change, None if the
+                          Anuncio is new
+            depois (dict): Anuncio.contadores after the change, None if the
+                           Anuncio is deleted
+            limite (int): if given, the counters are only updated while
+                          qtd_anuncios is below it
+
+        Returns:
+            (bool): False if the limite was reached and nothing was updated
+        """
+        valores = {}
+        for campo in Usuario.CONTADORES:
+            delta = (depois or {}).get(campo, 0) - (antes or {}).get(campo, 0)
+            if delta:
+                coluna = getattr(Usuario, campo)
+                valores[coluna] = coluna + delta
+        if not valores:
+            return True
+        query = db.session.query(Usuario).filter(Usuario.id == usuario_id)
+        if limite is not None:
+            # Checked by the UPDATE itself, so concurrent requests can not
+            # go past the limite
+            query = query.filter(Usuario.qtd_anuncios < limite)
+        return query.update(valores, synchronize_session=False) > 0
+
+    @staticmethod
+    def colunas_json():
+        """
+        The SQL version of to_json(include_anuncios=False), one column per
+        key of CAMPOS_JSON
+
+        Returns:
+            (list): the column expressions
+        """
+        return [
+            Usuario.id, Usuario.facebook_id, Usuario.nome, Usuario.tipo,
+            Usuario.cidade, Usuario.estado, Usuario.telefone, Usuario.email,
+            Usuario.views,
+            func.to_char(Usuario.cadastrado_em, FORMATO_DATA_SQL)
+        ]
+
     @classmethod
     def get_all(cls, parsed=False):
-        data = db.session.query(cls).all()
-        if parsed:
-            data = [d.to_json(False) for d in data]
+        if not parsed:
+            return db.session.query(cls).all()
+        # Plain rows, as in Anuncio.query_projecao
+        linhas = db.session.query(*Usuario.colunas_json())
+        return [dict(zip(Usuario.CAMPOS_JSON, linha)) for linha in linhas]
 
-        return data
+    @classmethod
+    def iterar_json(cls, lote):
+        linhas = db.session.query(*Usuario.colunas_json()).order_by(Usuario.id)
+        linhas = linhas.execution_options(stream_results=True).yield_per(lote)
+        for linha in linhas:
+            yield dict(zip(Usuario.CAMPOS_JSON, linha))
 
 
 class Busca(db.Model, DAO):
@@ -301,10 +836,378 @@ class Busca(db.Model, DAO):
     usuario = db.Column(db.Integer)
     busca = db.Column(db.String)
     buscado_em = db.Column(db.DateTime(), default=datetime.now)
+    # Anuncios in the first page of the results, None in the old Buscas
+    resultados = db.Column(db.Integer)
+    # Time of the INSERT, set by the database. None in the old Buscas
+    salvo_em = db.Column(db.DateTime(),
+                         server_default=db.text('clock_timestamp()'))
 
-    def __init__(self, usuario, busca):
+    def __init__(self, usuario, busca, resultados=None):
         self.usuario = usuario
         self.busca = busca
+        self.resultados = resultados
 
     def __repr__(self):
         return '{}: {}'.format(self.buscado_em, self.busca)
+
+    @staticmethod
+    def relatorio(horas, dias, limite):
+        """
+        Reads the report of the Buscas from the rollup tables, whose
+        indexes keep its cost independent of the size of the busca table.
+        The Buscas saved after the last tasks.atualizar_relatorio_buscas
+        are not counted.
+
+        Args:
+            horas (int): number of hours in por_hora
+            dias (int): number of days in por_dia
+            limite (int): number of terms in mais_buscadas and sem_resultado
+
+        Returns:
+            (dict): Containing the Buscas por_hora, por_dia, the terms
+                    mais_buscados and those without results
+        """
+        agora = datetime.now()
+        por_hora = BuscaHora.query.filter(
+            BuscaHora.hora >= agora - timedelta(hours=horas)
+        ).order_by(BuscaHora.hora)
+        por_dia = BuscaDia.query.filter(
+            BuscaDia.dia >= (agora - timedelta(days=dias)).date()
+        ).order_by(BuscaDia.dia)
+        mais_buscados = BuscaTermo.query.order_by(
+            BuscaTermo.quantidade.desc(), BuscaTermo.termo
+        ).limit(limite)
+        # Matches the partial index ix_busca_termo_sem_resultado
+        sem_resultado = BuscaTermo.query.filter(
+            BuscaTermo.sem_resultado > 0
+        ).order_by(
+            BuscaTermo.sem_resultado.desc(), BuscaTermo.termo
+        ).limit(limite)
+
+        return {
+            'por_hora': [b.to_json() for b in por_hora],
+            'por_dia': [b.to_json() for b in por_dia],
+            'mais_buscados': [b.to_json() for b in mais_buscados],
+            'sem_resultado': [b.to_json() for b in sem_resultado]
+        }
+
+
+class BuscaHora(db.Model, DAO):
+    """
+    Number of Buscas per hour, filled by tasks.atualizar_relatorio_buscas
+    """
+    __tablename__ = 'busca_hora'
+    hora = db.Column(db.DateTime(), primary_key=True)
+    quantidade = db.Column(db.Integer, default=0, nullable=False)
+    sem_resultado = db.Column(db.Integer, default=0, nullable=False)
+
+    def to_json(self):
+        return {
+            'hora': datetime.strftime(self.hora, '%d/%m/%Y %H:%M:%S'),
+            'quantidade': self.quantidade,
+            'sem_resultado': self.sem_resultado
+        }
+
+
+class BuscaDia(db.Model, DAO):
+    """
+    Number of Buscas per day, filled by tasks.atualizar_relatorio_buscas
+    """
+    __tablename__ = 'busca_dia'
+    dia = db.Column(db.Date(), primary_key=True)
+    quantidade = db.Column(db.Integer, default=0, nullable=False)
+    sem_resultado = db.Column(db.Integer, default=0, nullable=False)
+
+    def to_json(self):
+        return {
+            'dia': self.dia.strftime('%d/%m/%Y'),
+            'quantidade': self.quantidade,
+            'sem_resultado': self.sem_resultado
+        }
+
+
+class BuscaTermo(db.Model, DAO):
+    """
+    Number of Buscas per term searched, in lower case, filled by
+    tasks.atualizar_relatorio_buscas
+    """
+    __tablename__ = 'busca_termo'
+    termo = db.Column(db.String, primary_key=True)
+    quantidade = db.Column(db.Integer, default=0, nullable=False)
+    sem_resultado = db.Column(db.Integer, default=0, nullable=False)
+    ultima_busca_em = db.Column(db.DateTime())
+
+    __table_args__ = (
+        db.Index('ix_busca_termo_quantidade', quantidade.desc(), termo),
+        db.Index('ix_busca_termo_sem_resultado', sem_resultado.desc(), termo,
+                 postgresql_where=sem_resultado > 0),
+    )
+
+    def to_json(self):
+        return {
+            'termo': self.termo, 'quantidade': self.quantidade,
+            'sem_resultado': self.sem_resultado,
+            'ultima_busca_em': datetime.strftime(self.ultima_busca_em,
+                                                 '%d/%m/%Y %H:%M:%S')
+        }
+
+
+class Faceta(db.Model, DAO):
+    """
+    Number of approved Anuncios per value of each facet of the search.
+    It is kept up to date by Faceta.atualizar, called in the transaction
+    that approves, edits or deletes the Anuncio, and can be rebuilt from
+    scratch by tasks.reconstruir_facetas.
+    """
+    __tablename__ = 'faceta'
+    DIMENSOES = [
+        'marca', 'modelo', 'faixa_ano', 'estado_veiculo', 'faixa_valor'
+    ]
+
+    dimensao = db.Column(db.String, primary_key=True)
+    valor = db.Column(db.String, primary_key=True)
+    quantidade = db.Column(db.Integer, default=0, nullable=False)
+
+    def __repr__(self):
+        return '<faceta {}={}: {}>'.format(self.dimensao, self.valor,
+                                           self.quantidade)
+
+    @staticmethod
+    def faixas_valor():
+        """
+        Returns:
+            (list): Containing the (upper limit, label) of the price ranges
+        """
+        faixas = []
+        inicio = 0
+        for limite in config.FACETAS_FAIXAS_VALOR:
+            faixas.append((limite, '{}-{}'.format(inicio, limite - 1)))
+            inicio = limite
+        faixas.append((None, '{}+'.format(inicio)))
+
+        return faixas
+
+    @staticmethod
+    def faixa_valor(valor):
+        """
+        Args:
+            valor (int): price of the Anuncio
+
+        Returns:
+            (str): the label of its price range or None if it has no price
+        """
+        try:
+            valor = int(valor)
+        except (TypeError, ValueError):
+            return None
+        if valor <= 0:
+            return None
+        for limite, rotulo in Faceta.faixas_valor():
+            if limite is None or valor < limite:
+                return rotulo
+
+    @staticmethod
+    def faixa_ano(ano):
+        """
+        Args:
+            ano (int): year of the vehicle
+
+        Returns:
+            (str): the label of its range of years or None if it has no year
+        """
+        try:
+            ano = int(ano)
+        except (TypeError, ValueError):
+            return None
+        if ano <= 0:
+            return None
+        inicio = ano // config.FACETAS_ANOS_POR_FAIXA
+        inicio *= config.FACETAS_ANOS_POR_FAIXA
+
+        return '{}-{}'.format(inicio, inicio + config.FACETAS_ANOS_POR_FAIXA - 1)
+
+    @staticmethod
+    def expressoes():
+        """
+        The SQL versions of Anuncio.facetas, for the set-based counts
+
+        Returns:
+            (list): Containing the SQL expression of each of the DIMENSOES
+        """
+        anos = config.FACETAS_ANOS_POR_FAIXA
+        # Integer division, as in faixa_ano
+        inicio = Anuncio.ano / anos * anos
+        faixa_ano = case([(
+            Anuncio.ano > 0,
+            cast(inicio, db.String) + '-' + cast(inicio + anos - 1, db.String)
+        )], else_=null())
+        faixas_valor = [(Anuncio.valor <= 0, null())]
+        for limite, rotulo in Faceta.faixas_valor():
+            faixas_valor.append((
+                Anuncio.valor < limite if limite else Anuncio.valor > 0,
+                literal(rotulo, db.String)
+            ))
+
+        return [
+            func.nullif(Anuncio.marca, ''), func.nullif(Anuncio.modelo, ''),
+            faixa_ano, func.nullif(Anuncio.estado_veiculo, ''),
+            case(faixas_valor, else_=null())
+        ]
+
+    @staticmethod
+    def query_contagem(filtro):
+        """
+        Builds the query counting the Anuncios matching the filter per value
+        of each dimension. The matching Anuncios are read once into a CTE
+        and grouped once per dimension.
+
+        Args:
+            filtro (list): SQL conditions on Anuncio
+
+        Returns:
+            (sqlalchemy.orm.Query): query of (dimensao, valor, quantidade)
+        """
+        colunas = [
+            expressao.label(dimensao) for dimensao, expressao
+            in zip(Faceta.DIMENSOES, Faceta.expressoes())
+        ]
+        anuncios = db.session.query(*colunas).filter(*filtro)
+        anuncios = anuncios.cte('anuncios_facetas')
+        contagens = []
+        for dimensao in Faceta.DIMENSOES:
+            coluna = anuncios.c[dimensao]
+            contagens.append(
+                db.session.query(literal(dimensao, db.String), coluna,
+                                 func.count()).filter(coluna.isnot(None))
+                                              .group_by(coluna)
+            )
+
+        return contagens[0].union_all(*contagens[1:])
+
+    @staticmethod
+    def agrupar(linhas):
+        """
+        Groups the counts by dimension, keeping the FACETAS_LIMITE values
+        with more Anuncios of each one
+
+        Args:
+            linhas (iterable): Containing (dimensao, valor, quantidade)
+
+        Returns:
+            (dict): Containing a list of {valor, quantidade} per dimension
+        """
+        facetas = {dimensao: [] for dimensao in Faceta.DIMENSOES}
+        linhas = sorted(linhas, key=lambda linha: (-linha[2], linha[1]))
+        for dimensao, valor, quantidade in linhas:
+            valores = facetas.get(dimensao)
+            if (valores is None or quantidade <= 0 or
+                    len(valores) >= config.FACETAS_LIMITE):
+                continue
+            valores.append({'valor': valor, 'quantidade': quantidade})
+
+        return facetas
+
+    @staticmethod
+    def get():
+        """
+        Gets the facets of all the approved Anuncios from the faceta table
+
+        Returns:
+            (dict): Containing a list of {valor, quantidade} per dimension
+        """
+        linhas = db.session.query(Faceta.dimensao, Faceta.valor,
+                                  Faceta.quantidade)
+        return Faceta.agrupar(linhas.filter(Faceta.quantidade > 0))
+
+    @staticmethod
+    def contar(filtro):
+        """
+        Counts the facets of the Anuncios matching the filter
+
+        Args:
+            filtro (list): SQL conditions on Anuncio
+
+        Returns:
+            (dict): Containing a list of {valor, quantidade} per dimension
+        """
+        return Faceta.agrupar(Faceta.query_contagem(filtro).all())
+
+    @staticmethod
+    def atualizar(antes, depois):
+        """
+        Applies the difference between the facets of Anuncios before and
+        after a change, in the current transaction, with a single upsert
+
+        Args:
+            antes (list): Anuncio.facetas before the change, [] if created
+            depois (list): Anuncio.facetas after the change, [] if deleted
+        """
+        deltas = Counter(depois)
+        deltas.subtract(Counter(antes))
+        # Sorted, so concurrent updates lock the rows in the same order
+        valores = [
+            {'dimensao': dimensao, 'valor': valor, 'quantidade': delta}
+            for (dimensao, valor), delta in sorted(deltas.items()) if delta
+        ]
+        if not valores:
+            return
+        upsert = insert(Faceta.__table__).values(valores)
+        upsert = upsert.on_conflict_do_update(
+            index_elements=['dimensao', 'valor'],
+            set_={'quantidade': Faceta.quantidade + upsert.excluded.quantidade}
+        )
+        db.session.execute(upsert)
+
+
+class Marcador(db.Model, DAO):
+    """
+    Progress of the batch jobs, so they can be resumed
+    """
+    __tablename__ = 'marcador'
+    nome = db.Column(db.String, primary_key=True)
+    valor = db.Column(db.Integer, default=0)
+    atualizado_em = db.Column(db.DateTime(), default=datetime.now,
+                              onupdate=datetime.now)
+
+    def __repr__(self):
+        return '<marcador {}={}>'.format(self.nome, self.valor)
+
+    @staticmethod
+    def get_valor(nome):
+        """
+        Returns:
+            (int): the value saved for the job or 0
+        """
+        marcador = Marcador.get_first(nome=nome)
+        return marcador.valor if marcador else 0
+
+    @staticmethod
+    def bloquear(nome):
+        """
+        Locks the marcador of the job until the end of the transaction, so
+        concurrent runs of the job wait for each other
+
+        Args:
+            nome (str): name of the job
+
+        Returns:
+            (int): the value saved for the job or 0
+        """
+        db.session.execute(insert(Marcador.__table__).values(
+            nome=nome, valor=0
+        ).on_conflict_do_nothing(index_elements=['nome']))
+        marcador = db.session.query(Marcador).filter_by(nome=nome)
+        return marcador.with_for_update().populate_existing().one().valor
+
+    @staticmethod
+    def salvar(nome, valor):
+        """
+        Saves the value of the job in the current transaction
+
+        Args:
+            nome (str): name of the job
+            valor (int): the value
+        """
+        marcador = Marcador.get_first(nome=nome) or Marcador(nome=nome)
+        marcador.valor = valor
+        db.session.add(marcador)
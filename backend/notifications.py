@@ -0,0 +1,194 @@
+""" Module that delivers the Slack and email notifications in background """
+import atexit
+import os
+import queue
+import threading
+import time
+
+from contextlib import nullcontext
+
+from flask import has_app_context
+from requests import Session
+from requests.adapters import HTTPAdapter
+
+from backend.app import mail
+
+
+class NotificationDispatcher(object):
+    """
+    Bounded in-process queue of notifications consumed by worker threads.
+    Enqueuing never blocks the request: when the queue is full the
+    notification is dropped and counted. The workers share a pooled HTTP
+    session for Slack and keep their SMTP connection open while there are
+    emails to send. Failed deliveries are retried with exponential backoff.
+    With NOTIFICACOES_WORKERS = 0 the notifications are sent synchronously.
+    """
+    def __init__(self):
+        self.app = None
+        self.workers = 0
+        self.tentativas = 1
+        self.backoff = 1
+        self.enviados = 0
+        self.falhas = 0
+        self.descartados = 0
+        self.retentativas = 0
+        self._fila = queue.Queue()
+        self._threads = []
+        self._pid = None
+        self._session = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """
+        Binds the dispatcher to the app using the NOTIFICACOES_* config
+
+        Args:
+            app (flask.Flask): the app
+        """
+        self.app = app
+        self.workers = app.config['NOTIFICACOES_WORKERS']
+        self.tentativas = app.config['NOTIFICACOES_TENTATIVAS']
+        self.backoff = app.config['NOTIFICACOES_BACKOFF']
+        self._fila = queue.Queue(app.config['NOTIFICACOES_FILA_MAXIMA'])
+        self._session = Session()
+        adapter = HTTPAdapter(pool_connections=1,
+                              pool_maxsize=max(self.workers, 1))
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        atexit.register(self.drenar)
+
+    def enviar(self, tipo, conteudo):
+        """
+        Queues a notification
+
+        Args:
+            tipo (str): 'slack' or 'email'
+            conteudo (object): the Slack text or the flask_mail.Message
+        """
+        if not self.workers:
+            self._fechar(self._entregar(tipo, conteudo))
+            return
+        self._iniciar()
+        try:
+            self._fila.put_nowait((tipo, conteudo))
+        except queue.Full:
+            self.descartados += 1
+            self.app.logger.warning('Fila de notificacoes cheia: %s', tipo)
+
+    def drenar(self, timeout=None):
+        """
+        Delivers the notifications still queued. Called on shutdown
+
+        Args:
+            timeout (int): max seconds to wait, NOTIFICACOES_TIMEOUT_DRENAR
+                           if not supplied
+        """
+        if self.app is None:
+            return
+        if timeout is None:
+            timeout = self.app.config['NOTIFICACOES_TIMEOUT_DRENAR']
+        limite = time.time() + timeout
+        conexao = None
+        while time.time() < limite:
+            try:
+                tipo, conteudo = self._fila.get_nowait()
+            except queue.Empty:
+                break
+            conexao = self._entregar(tipo, conteudo, conexao)
+            self._fila.task_done()
+        self._fechar(conexao)
+
+    def estatisticas(self):
+        """
+        Returns:
+            (dict): Containing the queue depth and the delivery counters
+        """
+        return {
+            'fila': self._fila.qsize(), 'fila_maxima': self._fila.maxsize,
+            'workers': self.workers, 'enviados': self.enviados,
+            'falhas': self.falhas, 'descartados': self.descartados,
+            'retentativas': self.retentativas
+        }
+
+    def _iniciar(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # Threads and queued items are not inherited by forked processes
+            self._fila = queue.Queue(self._fila.maxsize)
+            self._threads = []
+            for index in range(self.workers):
+                thread = threading.Thread(
+                    target=self._loop, name='notificacoes-{}'.format(index)
+                )
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+            self._pid = os.getpid()
+
+    def _loop(self):
+        conexao = None
+        while True:
+            try:
+                # Waiting with timeout lets an idle worker close its SMTP
+                tipo, conteudo = self._fila.get(timeout=5)
+            except queue.Empty:
+                conexao = self._fechar(conexao)
+                continue
+            conexao = self._entregar(tipo, conteudo, conexao)
+            self._fila.task_done()
+
+    def _entregar(self, tipo, conteudo, conexao=None):
+        """
+        Delivers the notification, retrying on failure
+
+        Returns:
+            (flask_mail.Connection): the SMTP connection to be reused
+        """
+        # Popping a new context inside a request would remove its session
+        contexto = nullcontext() if has_app_context() else \
+            self.app.app_context()
+        with contexto:
+            for tentativa in range(self.tentativas):
+                try:
+                    if tipo == 'email':
+                        if conexao is None:
+                            conexao = mail.connect()
+                            conexao.__enter__()
+                        conexao.send(conteudo)
+                        self.app.logger.info(
+                            str((conteudo.subject, conteudo.recipients))
+                        )
+                    else:
+                        self._enviar_slack(conteudo)
+                    self.enviados += 1
+                    return conexao
+                except Exception as e:
+                    conexao = self._fechar(conexao)
+                    self.app.logger.warning('Notificacao %s falhou: %s',
+                                            tipo, e)
+                    if tentativa + 1 < self.tentativas:
+                        self.retentativas += 1
+                        time.sleep(self.backoff * 2 ** tentativa)
+            self.falhas += 1
+            return conexao
+
+    def _enviar_slack(self, texto):
+        url = self.app.config['SLACK_HOOK']
+        if not url:
+            return
+        response = self._session.post(url, json={'text': texto}, timeout=10)
+        response.raise_for_status()
+
+    def _fechar(self, conexao):
+        if conexao is not None:
+            try:
+                conexao.__exit__(None, None, None)
+            except Exception:
+                pass
+        return None
+
+
+dispatcher = NotificationDispatcher()
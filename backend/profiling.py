@@ -0,0 +1,164 @@
+""" Module for the opt-in profiling of the requests """
+import cProfile
+import io
+import itertools
+import pstats
+import random
+import threading
+import time
+
+from collections import deque, defaultdict
+from datetime import datetime
+
+from flask import g, request
+
+from backend.banco import monitor_banco
+
+
+class Profiler(object):
+    """
+    Opt-in profiling of the requests. With PROFILING_ATIVO, the requests
+    sent with the PROFILING_HEADER have their wall time and SQL statements
+    recorded, and the statements repeated more than PROFILING_N_MAIS_UM
+    times are reported as N+1 patterns. The PROFILING_AMOSTRA_CPROFILE
+    fraction of them, and those with the header set to 'cprofile', also
+    run under cProfile. The last PROFILING_BUFFER profiles are kept in
+    memory by each process and shown in the admin.
+    The statements are timed by backend.banco. Only the first
+    PROFILING_MAX_STATEMENTS of each request are kept, the others are
+    just counted.
+    """
+    def __init__(self):
+        self.ativo = False
+        self.header = 'X-Profile'
+        self.n_mais_um = 5
+        self.amostra_cprofile = 0
+        self.max_statements = 200
+        self._perfis = deque(maxlen=100)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """
+        Binds the profiler to the requests of the app using the
+        PROFILING_* config
+
+        Args:
+            app (flask.Flask): the app
+        """
+        self.ativo = app.config['PROFILING_ATIVO']
+        self.header = app.config['PROFILING_HEADER']
+        self.n_mais_um = app.config['PROFILING_N_MAIS_UM']
+        self.amostra_cprofile = app.config['PROFILING_AMOSTRA_CPROFILE']
+        self.max_statements = app.config['PROFILING_MAX_STATEMENTS']
+        with self._lock:
+            self._perfis = deque(maxlen=app.config['PROFILING_BUFFER'])
+        app.before_request(self._iniciar)
+        app.after_request(self._identificar)
+        app.teardown_request(self._finalizar)
+        monitor_banco.ouvir(self._registrar_statement)
+
+    def perfis(self):
+        """
+        Returns:
+            (list): the summary of the profiles kept, the newest first
+        """
+        with self._lock:
+            perfis = list(self._perfis)
+        return [{
+            chave: valor for chave, valor in perfil.items()
+            if chave not in ['statements', 'cprofile']
+        } for perfil in reversed(perfis)]
+
+    def perfil(self, perfil_id):
+        """
+        Gets one profile with its statements and cProfile stats
+
+        Args:
+            perfil_id (int): id of the profile
+
+        Returns:
+            (dict): the profile or None if it is not kept anymore
+        """
+        with self._lock:
+            for perfil in self._perfis:
+                if perfil['id'] == perfil_id:
+                    return perfil
+        return None
+
+    def limpar(self):
+        """
+        Drops the profiles kept
+        """
+        with self._lock:
+            self._perfis.clear()
+
+    def _iniciar(self):
+        valor = request.headers.get(self.header)
+        if not self.ativo or not valor:
+            return
+        g.perfil = {'id': next(self._ids), 'inicio': time.perf_counter(),
+                    'statements': [], 'queries': 0, 'queries_segundos': 0,
+                    'repeticoes': defaultdict(lambda: [0, 0]),
+                    'cprofile': None}
+        if valor == 'cprofile' or random.random() < self.amostra_cprofile:
+            g.perfil['cprofile'] = cProfile.Profile()
+            g.perfil['cprofile'].enable()
+
+    def _registrar_statement(self, statement, segundos):
+        if 'perfil' not in g:
+            return
+        g.perfil['queries'] += 1
+        g.perfil['queries_segundos'] += segundos
+        repeticoes = g.perfil['repeticoes'][statement]
+        repeticoes[0] += 1
+        repeticoes[1] += segundos
+        if len(g.perfil['statements']) < self.max_statements:
+            g.perfil['statements'].append((statement, segundos))
+
+    def _identificar(self, response):
+        if 'perfil' in g:
+            g.perfil['status'] = response.status_code
+            response.headers[self.header + '-Id'] = str(g.perfil['id'])
+        return response
+
+    def _finalizar(self, erro=None):
+        dados = g.pop('perfil', None)
+        if dados is None:
+            return
+        segundos = time.perf_counter() - dados['inicio']
+        cprofile = None
+        if dados['cprofile'] is not None:
+            dados['cprofile'].disable()
+            saida = io.StringIO()
+            pstats.Stats(dados['cprofile'], stream=saida).sort_stats(
+                'cumulative'
+            ).print_stats(30)
+            cprofile = saida.getvalue()
+
+        repetidas = sorted((
+            {'statement': statement, 'vezes': vezes, 'segundos': duracao}
+            for statement, (vezes, duracao) in dados['repeticoes'].items()
+            if vezes > self.n_mais_um
+        ), key=lambda repetida: -repetida['vezes'])
+
+        perfil = {
+            'id': dados['id'], 'metodo': request.method,
+            'caminho': request.full_path.rstrip('?'),
+            'status': dados.get('status', 500),
+            'data': datetime.now().isoformat(), 'segundos': segundos,
+            'erro': repr(erro) if erro else None,
+            'queries': dados['queries'],
+            'queries_segundos': dados['queries_segundos'],
+            'repetidas': repetidas,
+            'statements': [
+                {'statement': statement, 'segundos': duracao}
+                for statement, duracao in dados['statements']
+            ],
+            'cprofile': cprofile
+        }
+        with self._lock:
+            self._perfis.append(perfil)
+
+
+profiler = Profiler()
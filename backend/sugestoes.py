@@ -0,0 +1,276 @@
+""" Module for the search suggestions, served from memory """
+import bisect
+import heapq
+import re
+import threading
+import time
+import unicodedata
+
+from collections import defaultdict
+
+from sqlalchemy import func
+
+from backend.app import db
+from backend.background import PeriodicWorker
+from backend.models import Busca, Faceta
+
+
+def normalizar(texto):
+    """
+    Normalizes the text for the suggestions: without accents, in lower case
+    and with single spaces
+
+    Args:
+        texto (str): text typed or searched by the user
+
+    Returns:
+        (str): the normalized text
+    """
+    texto = unicodedata.normalize('NFKD', texto or '')
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return re.sub(r'\s+', ' ', texto).strip().lower()
+
+
+class IndiceSugestoes(object):
+    """
+    Prefix index of the suggestions weighted by popularity.
+    The terms are kept in a sorted list, so the terms starting with a
+    prefix are a contiguous slice found by bisect. Small slices are scanned
+    on lookup; the prefixes with more than max_varredura terms have their
+    top terms precomputed and updated on each insertion, like the nodes of
+    a trie. The weights only grow, which keeps the tops correct.
+    """
+    def __init__(self, limite=10, max_varredura=200, max_termos=50000):
+        self.limite = limite
+        self.max_varredura = max_varredura
+        self.max_termos = max_termos
+        self._termos = []
+        self._pesos = {}
+        self._topos = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._termos)
+
+    def carregar(self, pesos):
+        """
+        Replaces the content of the index, keeping the max_termos heaviest
+
+        Args:
+            pesos (dict): the normalized terms mapped to their weights
+        """
+        termos = heapq.nsmallest(self.max_termos,
+                                 (termo for termo in pesos if termo),
+                                 key=lambda termo: (-pesos[termo], termo))
+        termos.sort()
+        pesos = {termo: pesos[termo] for termo in termos}
+        topos = {}
+        self._indexar(termos, pesos, topos, 0, 0, len(termos))
+        with self._lock:
+            self._termos = termos
+            self._pesos = pesos
+            self._topos = topos
+
+    def adicionar(self, termo, peso=1):
+        """
+        Adds the weight to the term, inserting it if it is new.
+        New terms are ignored once the index has max_termos.
+
+        Args:
+            termo (str): a normalized term
+            peso (int): weight to be added
+        """
+        if not termo:
+            return
+        with self._lock:
+            if termo not in self._pesos:
+                if len(self._termos) >= self.max_termos:
+                    return
+                bisect.insort(self._termos, termo)
+                self._pesos[termo] = 0
+            self._pesos[termo] += peso
+            for tamanho in range(1, len(termo) + 1):
+                topo = self._topos.get(termo[:tamanho])
+                if topo is not None:
+                    self._atualizar_topo(topo, termo)
+
+    def sugerir(self, prefixo, limite=None):
+        """
+        Gets the terms with more weight starting with the prefix
+
+        Args:
+            prefixo (str): a normalized prefix
+            limite (int): max number of terms, at most the limite of the index
+
+        Returns:
+            (list): the terms, the heaviest first
+        """
+        limite = min(limite or self.limite, self.limite)
+        if not prefixo:
+            return []
+        with self._lock:
+            topo = self._topos.get(prefixo)
+            if topo is None:
+                inicio = bisect.bisect_left(self._termos, prefixo)
+                fim = bisect.bisect_left(self._termos, prefixo + '\uffff',
+                                         inicio)
+                topo = self._topo(self._termos, self._pesos, inicio, fim)
+                # The slice grew with the insertions since the last load
+                if fim - inicio > self.max_varredura:
+                    self._topos[prefixo] = topo
+            return [termo for _, termo in topo[:limite]]
+
+    def _topo(self, termos, pesos, inicio, fim):
+        return heapq.nsmallest(self.limite, (
+            (-pesos[termo], termo) for termo in termos[inicio:fim]
+        ))
+
+    def _indexar(self, termos, pesos, topos, tamanho, inicio, fim):
+        """
+        Precomputes the tops of the prefixes longer than tamanho, given the
+        slice of terms sharing the same tamanho first characters
+        """
+        if fim - inicio <= self.max_varredura:
+            return
+        if tamanho:
+            prefixo = termos[inicio][:tamanho]
+            topos[prefixo] = self._topo(termos, pesos, inicio, fim)
+        while inicio < fim:
+            if len(termos[inicio]) <= tamanho:
+                # The term equal to the prefix comes first
+                inicio += 1
+                continue
+            prefixo = termos[inicio][:tamanho + 1]
+            proximo = bisect.bisect_left(termos, prefixo + '\uffff',
+                                         inicio, fim)
+            self._indexar(termos, pesos, topos, tamanho + 1, inicio, proximo)
+            inicio = proximo
+
+    def _atualizar_topo(self, topo, termo):
+        topo[:] = [item for item in topo if item[1] != termo]
+        topo.append((-self._pesos[termo], termo))
+        topo.sort()
+        del topo[self.limite:]
+
+
+class SugestoesWorker(PeriodicWorker):
+    """
+    Keeps the IndiceSugestoes of the process up to date. Each run reads
+    only the Busca rows newer than the last one indexed. The index is
+    rebuilt from scratch every SUGESTOES_INTERVALO_RECONSTRUCAO seconds,
+    dropping the terms that stopped being searched and refreshing the
+    marca and modelo values of the catalogue. The lookups never touch
+    the database.
+    """
+    def __init__(self):
+        super(SugestoesWorker, self).__init__()
+        self.indice = None
+        self.ultima_busca_id = 0
+        self.reconstruido_em = 0
+        self.config = {}
+
+    def init_app(self, app):
+        """
+        Binds the worker to the app using the SUGESTOES_* config
+
+        Args:
+            app (flask.Flask): the app
+        """
+        self.config = {
+            chave: valor for chave, valor in app.config.items()
+            if chave.startswith('SUGESTOES_')
+        }
+        super(SugestoesWorker, self).init_app(
+            app, app.config['SUGESTOES_INTERVALO']
+        )
+
+    def sugerir(self, texto, limite=None):
+        """
+        Gets the suggestions for the text typed
+
+        Args:
+            texto (str): text typed by the user
+            limite (int): max number of suggestions
+
+        Returns:
+            (list): the suggestions, the most popular first
+        """
+        if not self.interval:
+            # Synchronous mode, used by the tests
+            self.run_once()
+        self.ensure_started()
+        if self.indice is None:
+            # Built by the thread, the first requests get no suggestions
+            self.wakeup()
+            return []
+        return self.indice.sugerir(normalizar(texto), limite)
+
+    def run_once(self):
+        """
+        Indexes the new Buscas, or rebuilds the index when it is due
+        """
+        idade = time.time() - self.reconstruido_em
+        if (self.indice is None or
+                idade > self.config['SUGESTOES_INTERVALO_RECONSTRUCAO']):
+            self.reconstruir()
+        else:
+            self.atualizar()
+
+    def stop(self):
+        """
+        Nothing to be saved on shutdown
+        """
+
+    def reconstruir(self):
+        """
+        Builds a new index from the most searched terms and the marca
+        and modelo of the approved Anuncios, then swaps it with the
+        current one
+        """
+        pesos = defaultdict(int)
+        ultima_busca_id = db.session.query(func.max(Busca.id)).scalar() or 0
+        termo = func.lower(func.trim(Busca.busca))
+        buscas = db.session.query(termo, func.count()).filter(
+            Busca.id <= ultima_busca_id
+        ).group_by(termo).having(
+            func.count() >= self.config['SUGESTOES_MIN_BUSCAS']
+        ).order_by(func.count().desc()).limit(
+            self.config['SUGESTOES_MAX_TERMOS']
+        )
+        for busca, quantidade in buscas:
+            pesos[normalizar(busca)] += quantidade
+
+        catalogo = db.session.query(Faceta.valor, Faceta.quantidade).filter(
+            Faceta.dimensao.in_(['marca', 'modelo']), Faceta.quantidade > 0
+        )
+        for valor, quantidade in catalogo:
+            pesos[normalizar(valor)] += quantidade
+
+        indice = IndiceSugestoes(self.config['SUGESTOES_LIMITE'],
+                                 self.config['SUGESTOES_MAX_VARREDURA'],
+                                 self.config['SUGESTOES_MAX_TERMOS'])
+        indice.carregar(pesos)
+        self.indice = indice
+        self.ultima_busca_id = ultima_busca_id
+        self.reconstruido_em = time.time()
+
+    def atualizar(self, lote=5000):
+        """
+        Adds the Buscas made since the last run to the index
+
+        Args:
+            lote (int): Buscas read per query
+        """
+        while True:
+            buscas = db.session.query(Busca.id, Busca.busca).filter(
+                Busca.id > self.ultima_busca_id
+            ).order_by(Busca.id).limit(lote).all()
+            for _, busca in buscas:
+                self.indice.adicionar(normalizar(busca))
+            if buscas:
+                self.ultima_busca_id = buscas[-1][0]
+            if len(buscas) < lote:
+                return
+
+
+sugestoes = SugestoesWorker()
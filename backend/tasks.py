@@ -0,0 +1,205 @@
+""" Module for the batch jobs run by the admin area and manager.py """
+import time
+
+from datetime import timedelta
+
+from sqlalchemy import func, case, or_, Date, DateTime, cast
+from sqlalchemy.dialects.postgresql import insert
+
+from backend.app import db
+from backend.config import Config as config
+from backend.models import (
+    Anuncio, Busca, BuscaDia, BuscaHora, BuscaTermo, Faceta, Marcador,
+    PESOS_BUSCA
+)
+
+
+def recalcular_busca(lote=1000, reiniciar=False, max_segundos=None,
+                     progresso=None):
+    """
+    Recomputes query_busca and vetor_busca of all Anuncios in the database,
+    one batch of ids per transaction. The last id updated is saved in the
+    marcador table with the batch, so an interrupted run resumes from it.
+
+    Args:
+        lote (int): number of Anuncios per batch
+        reiniciar (bool): ignores the saved progress
+        max_segundos (int): stops after this time, leaving the progress saved
+        progresso (function): called with (processados, total) per batch
+
+    Returns:
+        (tuple): Containing the Anuncios processed, the total and whether
+                 it finished
+    """
+    nome = 'recalcular_busca'
+    ultimo_id = 0 if reiniciar else Marcador.get_valor(nome)
+    total = db.session.query(func.count(Anuncio.id)).scalar()
+    processados = db.session.query(func.count(Anuncio.id)).filter(
+        Anuncio.id <= ultimo_id
+    ).scalar()
+    inicio = time.time()
+    campos = {campo: getattr(Anuncio, campo) for campo, _ in PESOS_BUSCA}
+    valores = {
+        'query_busca': Anuncio.criar_query_busca_sql(),
+        'vetor_busca': Anuncio.criar_vetor_busca(campos)
+    }
+
+    while True:
+        ids = db.session.query(Anuncio.id).filter(Anuncio.id > ultimo_id)
+        ids = ids.order_by(Anuncio.id).limit(lote).subquery()
+        limite = db.session.query(func.max(ids.c.id)).scalar()
+        if limite is None:
+            # Finished, the next run starts over
+            Marcador.salvar(nome, 0)
+            db.session.commit()
+            return processados, total, True
+
+        atualizados = db.session.query(Anuncio).filter(
+            Anuncio.id > ultimo_id, Anuncio.id <= limite
+        ).update(valores, synchronize_session=False)
+        Marcador.salvar(nome, limite)
+        db.session.commit()
+        ultimo_id = limite
+        processados += atualizados
+        if progresso:
+            progresso(processados, total)
+        if max_segundos and time.time() - inicio > max_segundos:
+            return processados, total, False
+
+
+def reconstruir_facetas():
+    """
+    Rebuilds the faceta table from the approved Anuncios in a single
+    transaction. The table is locked meanwhile, so the updates made by
+    Faceta.atualizar wait for the rebuild instead of being lost.
+
+    Returns:
+        (int): the number of values in the faceta table
+    """
+    db.session.execute('LOCK TABLE faceta IN EXCLUSIVE MODE')
+    db.session.query(Faceta).delete(synchronize_session=False)
+    contagem = Faceta.query_contagem([Anuncio.aprovado])
+    db.session.execute(Faceta.__table__.insert().from_select(
+        ['dimensao', 'valor', 'quantidade'], contagem.statement
+    ))
+    total = db.session.query(func.count()).select_from(Faceta).scalar()
+    db.session.commit()
+
+    return total
+
+
+def reconciliar_contadores():
+    """
+    Recounts the Usuario.CONTADORES from the anuncio table, fixing the
+    drift of the counters kept by Usuario.atualizar_contadores. The anuncio
+    table is locked against writes meanwhile, so no change is missed.
+
+    Returns:
+        (int): the number of Usuarios whose counters were fixed
+    """
+    db.session.execute('LOCK TABLE anuncio IN SHARE MODE')
+    resultado = db.session.execute(
+        'UPDATE usuario SET qtd_anuncios = c.qtd_anuncios, '
+        'qtd_anuncios_aprovados = c.qtd_anuncios_aprovados, '
+        'total_views = c.total_views '
+        'FROM (SELECT usuario.id, count(anuncio.id) AS qtd_anuncios, '
+        'count(anuncio.id) FILTER (WHERE anuncio.aprovado) '
+        'AS qtd_anuncios_aprovados, '
+        'coalesce(sum(anuncio.views), 0) AS total_views '
+        'FROM usuario LEFT JOIN anuncio ON anuncio.usuario_id = usuario.id '
+        'GROUP BY usuario.id) AS c '
+        'WHERE usuario.id = c.id AND (usuario.qtd_anuncios, '
+        'usuario.qtd_anuncios_aprovados, usuario.total_views) '
+        'IS DISTINCT FROM (c.qtd_anuncios, c.qtd_anuncios_aprovados, '
+        'c.total_views)'
+    )
+    db.session.commit()
+
+    return resultado.rowcount
+
+
+def atualizar_relatorio_buscas(lote=10000, max_segundos=None):
+    """
+    Adds the Buscas saved since the last run to the busca_hora, busca_dia
+    and busca_termo rollups, one batch of ids per transaction. The last id
+    added is saved in the marcador table in the same transaction, so each
+    Busca is counted once. The Buscas inserted in the last
+    RELATORIO_BUSCAS_ATRASO seconds, by the clock of the database, wait for
+    the next run, giving the transactions inserting ids lower than them
+    the time to commit. buscado_em can not be used for it: it is set when
+    the Busca is buffered and kept when a failed flush is retried.
+
+    Args:
+        lote (int): number of Buscas per batch
+        max_segundos (int): stops after this time, leaving the rest to the
+                            next run
+
+    Returns:
+        (tuple): Containing the Buscas added and whether it finished
+    """
+    nome = 'relatorio_buscas'
+    limite_salvo_em = db.session.query(
+        cast(func.clock_timestamp(), DateTime)
+    ).scalar() - timedelta(seconds=config.RELATORIO_BUSCAS_ATRASO)
+    inicio = time.time()
+    processadas = 0
+
+    while True:
+        ultimo_id = Marcador.bloquear(nome)
+        ids = db.session.query(Busca.id).filter(
+            Busca.id > ultimo_id,
+            or_(Busca.salvo_em < limite_salvo_em, Busca.salvo_em.is_(None))
+        ).order_by(Busca.id).limit(lote).subquery()
+        limite = db.session.query(func.max(ids.c.id)).scalar()
+        if limite is None:
+            db.session.commit()
+            return processadas, True
+
+        faixa = [Busca.id > ultimo_id, Busca.id <= limite]
+        quantidade = db.session.query(func.count(Busca.id)).filter(
+            *faixa
+        ).scalar()
+        hora = func.date_trunc('hour', Busca.buscado_em)
+        _somar_rollup(BuscaHora, hora, faixa)
+        _somar_rollup(BuscaDia, cast(Busca.buscado_em, Date), faixa)
+        termo = func.lower(func.trim(Busca.busca))
+        _somar_rollup(BuscaTermo, termo, faixa + [termo != ''])
+        Marcador.salvar(nome, limite)
+        db.session.commit()
+        processadas += quantidade
+        if max_segundos and time.time() - inicio > max_segundos:
+            return processadas, False
+
+
+def _somar_rollup(modelo, chave, faixa):
+    """
+    Adds the Buscas in the faixa, grouped by chave, to the rollup with a
+    single INSERT ... SELECT ... ON CONFLICT DO UPDATE
+
+    Args:
+        modelo (class): BuscaHora, BuscaDia or BuscaTermo
+        chave (sqlalchemy.sql.ClauseElement): value of the primary key
+        faixa (list): SQL conditions selecting the Buscas
+    """
+    colunas = [modelo.__table__.primary_key.columns.values()[0].name,
+               'quantidade', 'sem_resultado']
+    valores = [
+        chave, func.count(),
+        func.sum(case([(Busca.resultados == 0, 1)], else_=0))
+    ]
+    if modelo is BuscaTermo:
+        colunas.append('ultima_busca_em')
+        valores.append(func.max(Busca.buscado_em))
+    select = db.session.query(*valores).filter(*faixa).group_by(chave)
+    upsert = insert(modelo.__table__).from_select(colunas, select.statement)
+    somas = {
+        'quantidade': modelo.quantidade + upsert.excluded.quantidade,
+        'sem_resultado': modelo.sem_resultado + upsert.excluded.sem_resultado
+    }
+    if modelo is BuscaTermo:
+        somas['ultima_busca_em'] = func.greatest(
+            modelo.ultima_busca_em, upsert.excluded.ultima_busca_em
+        )
+    db.session.execute(upsert.on_conflict_do_update(
+        index_elements=colunas[:1], set_=somas
+    ))
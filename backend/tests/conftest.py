@@ -1,9 +1,19 @@
 """ Module that defines fixtures to all tests."""
+from contextlib import contextmanager
+
 import pytest
 
+from flask import _app_ctx_stack
 from flask_mail import Message
+from sqlalchemy import event
 
-from backend.models import Usuario
+from backend.app import create_app, db as _db
+from backend.buscas import busca_logger
+from backend.cache import anuncios_cache, usuarios_cache
+from backend.config import TestConfig
+from backend.counters import view_counter
+from backend.models import Usuario, Anuncio, Imagem
+from backend.sugestoes import sugestoes
 
 
 @pytest.fixture
@@ -21,3 +31,104 @@ def valid_msg():
     return Message('Subject', sender='sender@clozer.com.br',
                    recipients=['test@clozer.com.br'], body='Body')
 
+
+@pytest.fixture(scope='session')
+def app():
+    """ Returns the app configured with TestConfig """
+    _app = create_app(TestConfig)
+    with _app.app_context():
+        yield _app
+
+
+@pytest.fixture
+def db(app):
+    """ Returns the database bound to the test app with clean tables """
+    _db.drop_all()
+    _db.create_all()
+    yield _db
+    # Views counted and responses cached by the test must not leak
+    view_counter.run_once()
+    busca_logger.run_once()
+    anuncios_cache.clear()
+    usuarios_cache.clear()
+    sugestoes.indice = None
+    _db.session.remove()
+    _db.drop_all()
+
+
+@pytest.fixture
+def client(app, db):
+    """ Returns a test client for the app """
+    yield app.test_client()
+    # flask_jwt_extended keeps the JWT in the app context, shared by the
+    # requests of the tests
+    for atributo in ['jwt', 'jwt_user', 'jwt_header']:
+        _app_ctx_stack.top.__dict__.pop(atributo, None)
+
+
+@pytest.fixture
+def usuario_salvo(db):
+    """ Returns a Usuario saved in the database """
+    usuario = Usuario('123456789', 'Joao', 'joao@clozer.com.br',
+                      'Garagem', 'Sao Paulo', 'SP', '11999999999')
+    Usuario.update_or_insert(usuario)
+
+    return usuario
+
+
+@pytest.fixture
+def criar_anuncio(db, usuario_salvo):
+    """ Returns a function that saves an approved Anuncio """
+    # The Usuario may be detached by assert_num_queries
+    usuario_id = usuario_salvo.id
+
+    def _criar_anuncio(titulo, marca='', modelo='', ano=2015, valor=30000,
+                       aprovado=True, **kwargs):
+        anuncio = Anuncio(usuario_id, titulo, '', valor)
+        anuncio.marca = marca
+        anuncio.modelo = modelo
+        anuncio.ano = ano
+        anuncio.aprovado = aprovado
+        for campo, valor_campo in kwargs.items():
+            setattr(anuncio, campo, valor_campo)
+        anuncio.atualizar_busca()
+        Usuario.atualizar_contadores(usuario_id, None, anuncio.contadores())
+        Anuncio.update_or_insert(anuncio)
+        return anuncio
+
+    return _criar_anuncio
+
+
+@pytest.fixture
+def criar_imagem(db):
+    """ Returns a function that saves an Imagem for the Anuncio """
+    def _criar_imagem(anuncio, img_filename='images/imagem0.jpg'):
+        Imagem.add_image({'anuncio_id': anuncio.id,
+                          'img_filename': img_filename})
+
+    return _criar_imagem
+
+
+@pytest.fixture
+def assert_num_queries(db):
+    """
+    Returns a context manager that asserts the number of SQL statements
+    executed inside it, so N+1 regressions break the tests
+    """
+    @contextmanager
+    def _assert_num_queries(esperado):
+        # Objects already in the session would hide the lazy loads
+        db.session.expunge_all()
+        queries = []
+
+        def contar(conn, cursor, statement, parameters, context, many):
+            queries.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', contar)
+        try:
+            yield queries
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', contar)
+        assert len(queries) == esperado, '\n'.join(queries)
+
+    return _assert_num_queries
@@ -0,0 +1,57 @@
+""" Module that tests the admin area """
+import pytest
+
+from backend.models import Busca, Contato
+
+
+@pytest.fixture
+def dados_admin(criar_anuncio, criar_imagem):
+    """ Saves Anuncios, Buscas and Contatos to fill the admin tabs """
+    for i in range(6):
+        anuncio = criar_anuncio('Uno {}'.format(i), aprovado=i % 2 == 0,
+                                estado_veiculo='SP' if i < 4 else 'RJ')
+        criar_imagem(anuncio)
+        Busca.update_or_insert(Busca(0, 'uno {}'.format(i)))
+        Contato.update_or_insert(Contato(nome='Maria', contato='m@m.com',
+                                         texto='Oi {}'.format(i)))
+
+
+@pytest.mark.parametrize('aba,queries', [
+    ('anuncios', 4), ('usuarios', 2), ('buscas', 2), ('contatos', 2)
+])
+def test_index_query_budget(client, dados_admin, assert_num_queries,
+                            aba, queries):
+    """Tests if each tab costs a fixed number of queries"""
+    with assert_num_queries(queries):
+        response = client.get('/api/v1/admin?aba={}'.format(aba))
+
+    assert response.status_code == 200
+
+
+def test_index_filters_anuncios(client, dados_admin):
+    """Tests the situacao and estado filters of the anuncios tab"""
+    response = client.get('/api/v1/admin?aba=anuncios'
+                          '&situacao=pendentes&estado=SP')
+    html = response.get_data(as_text=True)
+
+    assert 'value="Uno 1"' in html
+    assert 'value="Uno 3"' in html
+    assert html.count('class="anuncio"') == 2
+
+
+def test_index_counts_anuncios_per_usuario(client, dados_admin):
+    """Tests if the usuarios tab shows the number of anuncios"""
+    html = client.get('/api/v1/admin?aba=usuarios').get_data(as_text=True)
+
+    assert '<td>6</td>' in html
+
+
+def test_index_paginates(client, dados_admin, monkeypatch):
+    """Tests if the tab shows only one page"""
+    monkeypatch.setattr('backend.admin.config.ADMIN_POR_PAGINA', 4)
+    html = client.get('/api/v1/admin?aba=buscas&pagina=2').get_data(
+        as_text=True
+    )
+
+    assert html.count('class="anuncio"') == 2
+    assert 'pagina 2 de 2' in html
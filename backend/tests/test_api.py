@@ -0,0 +1,352 @@
+""" Module that tests the API endpoints """
+import json
+
+import pytest
+
+from flask_jwt_extended import create_access_token
+
+from backend.cache import usuarios_cache
+from backend.config import Config as config
+from backend.counters import view_counter
+from backend.models import Contato, Usuario
+from backend.utils import create_identity
+
+
+@pytest.fixture
+def catalogo(criar_anuncio, criar_imagem):
+    """ Saves approved Anuncios with two images each """
+    anuncios = [criar_anuncio('Uno {}'.format(i), marca='Fiat', modelo='Uno')
+                for i in range(10)]
+    for anuncio in anuncios:
+        criar_imagem(anuncio, 'images/1/{}/imagem0.jpg'.format(anuncio.id))
+        criar_imagem(anuncio, 'images/1/{}/imagem1.jpg'.format(anuncio.id))
+
+    return anuncios
+
+
+def test_anuncios_query_count(client, catalogo, assert_num_queries):
+    """Tests if the listing reads imagens and usuario in the same query"""
+    with assert_num_queries(1):
+        response = client.get('/api/v1/anuncios')
+
+    anuncios = response.get_json()['anuncios']
+    assert len(anuncios) == 10
+    assert all(len(a['imagens']) == 2 for a in anuncios)
+
+
+def test_busca_query_count(client, catalogo, assert_num_queries):
+    """Tests if the search reads imagens and usuario in the same query"""
+    # The Busca is saved in background
+    with assert_num_queries(1) as queries:
+        response = client.get('/api/v1/busca?query=uno')
+
+    assert len(response.get_json()['anuncios']) == 10
+    assert all(q.startswith('SELECT') for q in queries)
+
+
+def test_usuario_query_count(client, usuario_salvo, catalogo,
+                             assert_num_queries):
+    """Tests if the Usuario loads its anuncios and imagens in batches"""
+    usuario_id = usuario_salvo.id
+    # versao + usuario + anuncios + imagens
+    with assert_num_queries(4):
+        response = client.get('/api/v1/usuario/{}'.format(usuario_id))
+
+    anuncios = response.get_json()['usuario']['anuncios']
+    assert len(anuncios) == 10
+    assert all(len(a['imagens']) == 2 for a in anuncios)
+
+
+def test_usuarios_query_count(client, usuario_salvo, catalogo,
+                              assert_num_queries):
+    """Tests if the Usuario listing does not load the anuncios"""
+    with assert_num_queries(1):
+        response = client.get('/api/v1/usuarios')
+
+    assert len(response.get_json()['usuarios']) == 1
+
+
+def test_anuncios_cached_until_approval(client, catalogo, criar_anuncio,
+                                        assert_num_queries):
+    """Tests if the listing is cached and invalidated by the admin"""
+    client.get('/api/v1/anuncios?limit=5')
+    with assert_num_queries(0):
+        response = client.get('/api/v1/anuncios?limit=5')
+    assert len(response.get_json()['anuncios']) == 5
+
+    anuncio_id = criar_anuncio('Novo', aprovado=False).id
+    client.get('/api/v1/admin/aprovar_reprovar_anuncio'
+               '?aprovar_reprovar=aprovar&anuncio_id={}'.format(anuncio_id))
+
+    response = client.get('/api/v1/anuncios?limit=5')
+    assert response.get_json()['anuncios'][0]['id'] == anuncio_id
+
+
+def test_anuncio_conditional_get(client, catalogo, criar_imagem,
+                                 assert_num_queries):
+    """Tests if the Anuncio detail answers 304 until it is changed"""
+    url = '/api/v1/anuncio/{}'.format(catalogo[0].id)
+    response = client.get(url)
+    etag = response.headers['ETag']
+    modificado = response.headers['Last-Modified']
+    assert 'public' in response.headers['Cache-Control']
+    assert 'max-age' in response.headers['Cache-Control']
+
+    # Only the versao, the Anuncio is not loaded
+    with assert_num_queries(1):
+        response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert response.headers['ETag'] == etag
+
+    response = client.get(url, headers={'If-Modified-Since': modificado})
+    assert response.status_code == 304
+
+    criar_imagem(catalogo[0], 'images/1/nova.jpg')
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert len(response.get_json()['anuncio']['imagens']) == 3
+    assert response.headers['ETag'] != etag
+
+
+def test_anuncio_etag_changes_with_views(client, catalogo):
+    """Tests if the flushed views give a new version of the Anuncio"""
+    url = '/api/v1/anuncio/{}'.format(catalogo[0].id)
+    etag = client.get(url).headers['ETag']
+    view_counter.run_once()
+
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.get_json()['anuncio']['views'] == 1
+
+
+def test_usuario_conditional_get(client, usuario_salvo, catalogo,
+                                 criar_anuncio):
+    """Tests if the Usuario detail answers 304 until one Anuncio changes"""
+    url = '/api/v1/usuario/{}'.format(usuario_salvo.id)
+    etag = client.get(url).headers['ETag']
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+
+    criar_anuncio('Novo', aprovado=False)
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert len(response.get_json()['usuario']['anuncios']) == 11
+
+
+def test_anuncios_conditional_get(client, catalogo, criar_anuncio,
+                                  assert_num_queries):
+    """Tests if the listing ETag is kept with the cached response"""
+    response = client.get('/api/v1/anuncios?limit=5')
+    etag = response.headers['ETag']
+    with assert_num_queries(0):
+        response = client.get('/api/v1/anuncios?limit=5',
+                              headers={'If-None-Match': etag})
+    assert response.status_code == 304
+
+    anuncio_id = criar_anuncio('Novo', aprovado=False).id
+    client.get('/api/v1/admin/aprovar_reprovar_anuncio'
+               '?aprovar_reprovar=aprovar&anuncio_id={}'.format(anuncio_id))
+    response = client.get('/api/v1/anuncios?limit=5',
+                          headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+
+@pytest.mark.parametrize('url', [
+    '/api/v1/anuncios', '/api/v1/anuncios?marca=fiat', '/api/v1/usuarios',
+    '/api/v1/contatos'
+])
+def test_stream_equals_listing(app, client, catalogo, url, monkeypatch):
+    """Tests if the streamed listings send the same JSON document"""
+    # Out of debug flask_restful does not indent the JSON
+    monkeypatch.setitem(app.config, 'DEBUG', False)
+    Contato.update_or_insert(Contato(nome='Maria', contato='m@m.com',
+                                     texto='Oi'))
+    Contato.update_or_insert(Contato(nome='Jose', contato='j@j.com',
+                                     texto='Ola'))
+    separador = '&' if '?' in url else '?'
+    response = client.get(url + separador + 'format=stream')
+
+    assert response.is_streamed
+    assert response.mimetype == 'application/json'
+    assert response.data == client.get(url).data
+
+
+def test_stream_ndjson(client, catalogo):
+    """Tests if the ndjson format sends one Anuncio per line"""
+    response = client.get('/api/v1/anuncios?format=ndjson')
+
+    assert response.is_streamed
+    assert response.mimetype == 'application/x-ndjson'
+    linhas = response.data.decode('utf-8').splitlines()
+    anuncios = client.get('/api/v1/anuncios').get_json()['anuncios']
+    assert [json.loads(linha) for linha in linhas] == anuncios
+
+
+def test_stream_reads_in_batches(app, client, catalogo, assert_num_queries,
+                                 monkeypatch):
+    """Tests if the stream reads the rows with a server-side cursor"""
+    monkeypatch.setattr(config, 'STREAM_LOTE', 3)
+    with assert_num_queries(1) as queries:
+        response = client.get('/api/v1/anuncios?format=ndjson')
+        linhas = response.data.decode('utf-8').splitlines()
+
+    assert len(linhas) == 10
+    assert queries[0].startswith('SELECT')
+
+
+def test_usuario_logado_cached(client, usuario_salvo, assert_num_queries):
+    """Tests if the authenticated handlers reuse the cached Usuario"""
+    usuario_id = usuario_salvo.id
+    token = create_access_token(identity=create_identity(usuario_salvo))
+    headers = {'Authorization': 'Bearer ' + token}
+    client.post('/api/v1/anuncio', headers=headers,
+                data={'titulo': 'Uno', 'valor': 1000})
+    hits = usuarios_cache.hits
+
+    # counters + insert + refresh of anuncio, usuario and imagens for to_json
+    with assert_num_queries(5) as queries:
+        response = client.post('/api/v1/anuncio', headers=headers,
+                               data={'titulo': 'Gol', 'valor': 2000})
+    assert response.status_code == 200
+    assert usuarios_cache.hits == hits + 1
+    # The Usuario is only refreshed after the commit of the Anuncio
+    antes_insert = queries[:[q.split()[0] for q in queries].index('INSERT')]
+    assert not [q for q in antes_insert if 'FROM usuario' in q]
+
+    url = '/api/v1/usuario/{}'.format(usuario_id)
+    client.put(url, headers=headers, data={'nome': 'Joao Silva'})
+    response = client.put(url, headers=headers, data={'cidade': 'Santos'})
+    usuario = response.get_json()[str(usuario_id)]
+    assert (usuario['nome'], usuario['cidade']) == ('Joao Silva', 'Santos')
+
+
+def test_post_anuncio_quota(client, usuario_salvo, criar_anuncio,
+                            monkeypatch):
+    """Tests if the quota is enforced with the counter of the Usuario"""
+    monkeypatch.setattr(config, 'LIMITE_ANUNCIOS_FREE', 2)
+    criar_anuncio('Uno')
+    token = create_access_token(identity=create_identity(usuario_salvo))
+    headers = {'Authorization': 'Bearer ' + token}
+
+    response = client.post('/api/v1/anuncio', headers=headers,
+                           data={'titulo': 'Gol', 'valor': 2000})
+    assert response.status_code == 200
+    response = client.post('/api/v1/anuncio', headers=headers,
+                           data={'titulo': 'Palio', 'valor': 3000})
+    assert response.status_code == 402
+
+
+def test_contadores_usuario(client, usuario_salvo, criar_anuncio,
+                            tmp_path, monkeypatch):
+    """Tests if the counters follow the ads created, approved and deleted"""
+    monkeypatch.setattr(config, 'IMAGE_DIR', str(tmp_path))
+    usuario_id = usuario_salvo.id
+    token = create_access_token(identity=create_identity(usuario_salvo))
+    headers = {'Authorization': 'Bearer ' + token}
+    criar_anuncio('Uno', views=5)
+    response = client.post('/api/v1/anuncio', headers=headers,
+                           data={'titulo': 'Gol', 'valor': 2000})
+    anuncio_id = int(list(response.get_json())[0])
+
+    def contadores():
+        usuario = Usuario.get_first(id=usuario_id)
+        return [getattr(usuario, campo) for campo in Usuario.CONTADORES]
+
+    assert contadores() == [2, 1, 5]
+    client.get('/api/v1/admin/aprovar_reprovar_anuncio?anuncio_id={}'
+               '&aprovar_reprovar=aprovar'.format(anuncio_id))
+    assert contadores() == [2, 2, 5]
+    client.put('/api/v1/anuncio/{}'.format(anuncio_id), headers=headers,
+               data={'titulo': 'Gol G5'})
+    assert contadores() == [2, 1, 5]
+    (tmp_path / str(usuario_id) / str(anuncio_id)).mkdir(parents=True)
+    client.delete('/api/v1/anuncio/{}'.format(anuncio_id), headers=headers)
+    assert contadores() == [1, 1, 5]
+
+
+@pytest.fixture
+def estoque(criar_anuncio):
+    """ Saves approved Anuncios of different marcas, years and places """
+    dados = [
+        ('Fiat', 'Uno', 2014, 25000, 'SP', 'Campinas', False),
+        ('Fiat', 'Uno', 2016, 35000, 'SP', 'Sao Paulo', True),
+        ('Fiat', 'Palio', 2018, 39000, 'RJ', 'Niteroi', False),
+        ('VW', 'Gol', 2017, 38000, 'SP', 'Sao Paulo', False),
+        ('Fiat', 'Toro', 2019, 90000, 'SP', 'Sao Paulo', False),
+    ]
+    return {
+        modelo + str(ano): criar_anuncio(
+            modelo, marca=marca, modelo=modelo, ano=ano, valor=valor,
+            estado_veiculo=estado, cidade_veiculo=cidade, troca=troca
+        ).id
+        for marca, modelo, ano, valor, estado, cidade, troca in dados
+    }
+
+
+@pytest.mark.parametrize('params,esperados', [
+    ('marca=fiat&ano_min=2015&ano_max=2018&valor_max=40000&'
+     'estado_veiculo=sp', ['Uno2016']),
+    ('marca=FIAT&modelo=uno', ['Uno2016', 'Uno2014']),
+    ('valor_min=38000&valor_max=39000', ['Palio2018', 'Gol2017']),
+    ('cidade_veiculo=sao%20paulo&troca=0', ['Toro2019', 'Gol2017']),
+    ('troca=1', ['Uno2016']),
+    ('leilao=1', []),
+])
+def test_anuncios_filters(client, estoque, params, esperados):
+    """Tests the structured filters of the listing"""
+    response = client.get('/api/v1/anuncios?' + params)
+
+    ids = [a['id'] for a in response.get_json()['anuncios']]
+    assert sorted(ids) == sorted(estoque[e] for e in esperados)
+
+
+def test_anuncios_filters_in_cache_key(client, estoque):
+    """Tests if a filtered listing is not served from the cache of another"""
+    assert len(client.get('/api/v1/anuncios').get_json()['anuncios']) == 5
+    response = client.get('/api/v1/anuncios?marca=VW')
+
+    assert [a['id'] for a in response.get_json()['anuncios']] == [
+        estoque['Gol2017']
+    ]
+
+
+def test_busca_filters(client, estoque):
+    """Tests if the search and its facets apply the structured filters"""
+    response = client.get('/api/v1/busca?query=fiat&valor_max=40000'
+                          '&facetas=1').get_json()
+
+    assert len(response['anuncios']) == 3
+    modelos = {f['valor']: f['quantidade']
+               for f in response['facetas']['modelo']}
+    assert modelos == {'Uno': 2, 'Palio': 1}
+
+    # Facets of the filtered catalogue, without a text query
+    response = client.get('/api/v1/busca?estado_veiculo=RJ&facetas=1')
+    assert response.get_json()['facetas']['modelo'] == [
+        {'valor': 'Palio', 'quantidade': 1}
+    ]
+
+
+def test_anuncios_filters_are_parameterized(client, estoque):
+    """Tests if the filter values are not interpolated in the SQL"""
+    response = client.get("/api/v1/anuncios?marca=fiat'%20or%20'1'='1")
+
+    assert response.status_code == 200
+    assert response.get_json()['anuncios'] == []
+
+
+@pytest.mark.parametrize('url', [
+    '/api/v1/anuncios?', '/api/v1/busca?query=uno&order_by=recentes&'
+])
+def test_limit_validated(client, catalogo, url, monkeypatch):
+    """Tests if limit must be positive and is capped at PAGINA_MAXIMA"""
+    monkeypatch.setattr(config, 'PAGINA_MAXIMA', 3)
+    assert client.get(url + 'limit=-1').status_code == 400
+    assert client.get(url + 'limit=0').status_code == 400
+
+    response = client.get(url + 'limit=1000')
+
+    assert len(response.get_json()['anuncios']) == 3
+    assert response.get_json()['next_cursor'] is not None
@@ -0,0 +1,60 @@
+""" Module that tests the pool of connections and its instrumentation """
+import pytest
+
+from sqlalchemy import exc
+
+from backend.banco import PoolInstrumentado, monitor_banco
+from backend.config import TestConfig
+
+
+def test_engine_configurada(db):
+    """Tests if the engine is built from the BANCO_* config"""
+    assert isinstance(db.engine.pool, PoolInstrumentado)
+    assert db.engine.pool.size() == TestConfig.BANCO_POOL_TAMANHO
+    timeout = db.session.execute('SHOW statement_timeout').scalar()
+    assert timeout == '{}s'.format(TestConfig.BANCO_TIMEOUT_QUERY // 1000)
+
+
+def test_queries_por_request(client, criar_anuncio, monkeypatch, caplog):
+    """Tests if the queries of each request are counted and logged"""
+    anuncio_id = criar_anuncio('Uno').id
+    monitor_banco.zerar()
+    monkeypatch.setattr(monitor_banco, 'request_lenta', -1)
+
+    client.get('/api/v1/anuncio/{}'.format(anuncio_id))
+
+    estatisticas = monitor_banco.estatisticas()
+    assert estatisticas['requests'] == estatisticas['requests_lentas'] == 1
+    assert estatisticas['queries_maximo_request'] == 4
+    assert estatisticas['pool']['em_uso'] <= TestConfig.BANCO_POOL_TAMANHO
+    assert 'GET /api/v1/anuncio/{}: 4 queries'.format(anuncio_id) in \
+        caplog.text
+
+
+def test_conexao_de_outro_processo(db, monkeypatch):
+    """Tests if the connections opened before a fork are not reused"""
+    db.session.remove()
+    conexao = db.engine.connect()
+    herdada = conexao.connection.connection
+    conexao.close()
+    monkeypatch.setattr('backend.banco.os.getpid', lambda: -1)
+
+    conexao = db.engine.connect()
+
+    assert conexao.connection.connection is not herdada
+    assert conexao.scalar('SELECT 1') == 1
+    # The socket still belongs to the parent process
+    assert not herdada.closed
+    conexao.close()
+
+
+def test_query_com_erro(db):
+    """Tests if a failed statement leaves nothing in the connection"""
+    conexao = db.engine.connect()
+    with pytest.raises(exc.ProgrammingError):
+        conexao.execute('SELECT * FROM tabela_inexistente')
+
+    assert conexao.scalar('SELECT 1') == 1
+    assert not any(isinstance(valor, list)
+                   for valor in conexao.connection.info.values())
+    conexao.close()
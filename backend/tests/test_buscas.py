@@ -0,0 +1,65 @@
+""" Module that tests the background log of the Buscas """
+import pytest
+
+from flask_jwt_extended import create_access_token
+
+from backend.buscas import busca_logger
+from backend.models import Busca
+from backend.utils import create_identity
+
+
+def test_buscas_saved_in_one_insert(client, assert_num_queries):
+    """Tests if the buffered Buscas are saved with a multi-row INSERT"""
+    for query in ['uno', 'gol', 'palio']:
+        client.get('/api/v1/busca?query={}'.format(query))
+    assert Busca.query.count() == 0
+
+    with assert_num_queries(1):
+        busca_logger.run_once()
+
+    assert sorted(b.busca for b in Busca.query.all()) == [
+        'gol', 'palio', 'uno'
+    ]
+    assert busca_logger.pendentes() == 0
+
+
+def test_busca_records_usuario_logado(client, usuario_salvo):
+    """Tests if the id of the user is logged when the JWT is sent"""
+    token = create_access_token(identity=create_identity(usuario_salvo))
+    client.get('/api/v1/busca?query=palio')
+    client.get('/api/v1/busca?query=gol',
+               headers={'Authorization': 'Bearer invalido'})
+    client.get('/api/v1/busca?query=uno',
+               headers={'Authorization': 'Bearer ' + token})
+    busca_logger.run_once()
+
+    usuarios = {b.busca: b.usuario for b in Busca.query.all()}
+    assert usuarios == {'uno': usuario_salvo.id, 'gol': 0, 'palio': 0}
+
+
+def test_busca_logger_drops_when_full(db, monkeypatch):
+    """Tests if the searches are dropped instead of blocking"""
+    monkeypatch.setattr(busca_logger, '_maximo', 2)
+    descartadas = busca_logger.descartadas
+    for busca in ['uno', 'gol', 'palio']:
+        busca_logger.registrar(0, busca)
+
+    assert busca_logger.pendentes() == 2
+    assert busca_logger.descartadas == descartadas + 1
+
+
+def test_busca_logger_keeps_buscas_on_failure(db, monkeypatch):
+    """Tests if the buffered searches survive a failed flush"""
+    busca_logger.registrar(0, 'uno')
+
+    def falhar(*args, **kwargs):
+        raise RuntimeError('banco fora do ar')
+
+    monkeypatch.setattr('backend.buscas.db.session.execute', falhar)
+    with pytest.raises(RuntimeError):
+        busca_logger.run_once()
+    monkeypatch.undo()
+
+    assert busca_logger.pendentes() == 1
+    busca_logger.run_once()
+    assert [b.busca for b in Busca.query.all()] == ['uno']
@@ -0,0 +1,53 @@
+""" Module that tests the in-process caches """
+from mock import patch
+
+from backend.cache import LRUCache
+
+
+def test_get_and_set():
+    """Tests if the cached value is returned and counted as hit"""
+    cache = LRUCache(tamanho=2, ttl=60)
+    assert cache.get('a') is None
+    cache.set('a', 1)
+
+    assert cache.get('a') == 1
+    assert cache.estatisticas()['hits'] == 1
+    assert cache.estatisticas()['misses'] == 1
+
+
+def test_evicts_least_recently_used():
+    """Tests if the least recently used entry is evicted"""
+    cache = LRUCache(tamanho=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert cache.estatisticas()['evictions'] == 1
+
+
+@patch('backend.cache.time')
+def test_expires_after_ttl(time):
+    """Tests if the entries expire after the ttl"""
+    time.time.return_value = 100
+    cache = LRUCache(tamanho=2, ttl=10)
+    cache.set('a', 1)
+    time.time.return_value = 111
+
+    assert cache.get('a') is None
+    assert cache.estatisticas()['entradas'] == 0
+
+
+def test_clear_and_disabled():
+    """Tests clear and a cache configured without size"""
+    cache = LRUCache(tamanho=2, ttl=60)
+    cache.set('a', 1)
+    cache.clear()
+    assert cache.get('a') is None
+
+    cache.configurar(0, 60)
+    cache.set('a', 1)
+    assert cache.get('a') is None
@@ -0,0 +1,35 @@
+""" Module that tests the write-behind views counter """
+from backend.counters import view_counter
+from backend.models import Anuncio, Usuario
+
+
+def test_views_are_flushed_in_batch(client, usuario_salvo, criar_anuncio,
+                                    assert_num_queries):
+    """Tests if the views are only written when the counter is flushed"""
+    anuncio_id = criar_anuncio('Uno').id
+    usuario_id = usuario_salvo.id
+    for _ in range(3):
+        client.get('/api/v1/anuncio/{}'.format(anuncio_id))
+    client.get('/api/v1/usuario/{}'.format(usuario_id))
+
+    assert Anuncio.get_first(id=anuncio_id).views == 0
+
+    # One UPDATE per table, plus the total_views of the Usuarios
+    with assert_num_queries(3):
+        view_counter.run_once()
+
+    assert Anuncio.get_first(id=anuncio_id).views == 3
+    usuario = Usuario.get_first(id=usuario_id)
+    assert (usuario.views, usuario.total_views) == (1, 3)
+    assert view_counter.pendentes() == 0
+
+
+def test_anuncio_get_is_read_only(client, criar_anuncio, assert_num_queries):
+    """Tests if the Anuncio detail does not write to the database"""
+    anuncio_id = criar_anuncio('Uno').id
+
+    # versao + anuncio + imagens + usuario
+    with assert_num_queries(4) as queries:
+        client.get('/api/v1/anuncio/{}'.format(anuncio_id))
+
+    assert all(q.startswith('SELECT') for q in queries)
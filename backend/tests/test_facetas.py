@@ -0,0 +1,100 @@
+""" Module that tests the facets of the search """
+from backend.models import Faceta
+from backend.tasks import reconstruir_facetas
+
+
+def _facetas(client, url='/api/v1/busca?facetas=1'):
+    return client.get(url).get_json()['facetas']
+
+
+def _valores(facetas, dimensao):
+    return {f['valor']: f['quantidade'] for f in facetas[dimensao]}
+
+
+def test_faixas():
+    """Tests the labels of the price and year ranges"""
+    assert Faceta.faixa_valor(9999) == '0-9999'
+    assert Faceta.faixa_valor('30000') == '30000-49999'
+    assert Faceta.faixa_valor(500000) == '200000+'
+    assert Faceta.faixa_valor(0) is None
+    assert Faceta.faixa_ano(2013) == '2010-2014'
+    assert Faceta.faixa_ano('') is None
+
+
+def test_facetas_follow_admin_actions(client, criar_anuncio):
+    """Tests if approving, editing and deleting update the faceta table"""
+    uno = criar_anuncio('Uno', marca='Fiat', modelo='Uno', aprovado=False,
+                        estado_veiculo='SP')
+    gol = criar_anuncio('Gol', marca='VW', modelo='Gol', aprovado=False)
+    for anuncio in [uno, gol]:
+        client.get('/api/v1/admin/aprovar_reprovar_anuncio?'
+                   'aprovar_reprovar=aprovar&anuncio_id={}'.format(anuncio.id))
+
+    facetas = _facetas(client)
+    assert _valores(facetas, 'marca') == {'Fiat': 1, 'VW': 1}
+    assert _valores(facetas, 'estado_veiculo') == {'SP': 1}
+    assert _valores(facetas, 'faixa_valor') == {'30000-49999': 2}
+
+    client.post('/api/v1/admin/editar_anuncio', data={
+        'anuncio_id': uno.id, 'marca': 'Fiat', 'modelo': 'Palio',
+        'ano': '2009', 'valor': '15000'
+    })
+    facetas = _facetas(client)
+    assert _valores(facetas, 'modelo') == {'Palio': 1, 'Gol': 1}
+    assert _valores(facetas, 'faixa_ano') == {'2005-2009': 1, '2015-2019': 1}
+    assert _valores(facetas, 'faixa_valor') == {
+        '10000-19999': 1, '30000-49999': 1
+    }
+
+    client.get('/api/v1/admin/aprovar_reprovar_anuncio?'
+               'aprovar_reprovar=reprovar&anuncio_id={}'.format(gol.id))
+    client.get('/api/v1/admin/deletar_anuncio?anuncio_id={}'.format(uno.id))
+    assert _valores(_facetas(client), 'marca') == {}
+
+
+def test_reconstruir_facetas_matches_incremental(client, criar_anuncio):
+    """Tests if the rebuild gives the same counts as the updates"""
+    anuncios = [
+        criar_anuncio('Carro', marca=marca, modelo=modelo, ano=ano,
+                      valor=valor, aprovado=False, estado_veiculo=estado)
+        for marca, modelo, ano, valor, estado in [
+            ('Fiat', 'Uno', 2012, 12000, 'SP'), ('Fiat', 'Uno', 2014, 0, ''),
+            ('VW', 'Gol', None, 250000, 'RJ'), ('', '', 2020, 45000, 'SP')
+        ]
+    ]
+    for anuncio in anuncios:
+        client.get('/api/v1/admin/aprovar_reprovar_anuncio?'
+                   'aprovar_reprovar=aprovar&anuncio_id={}'.format(anuncio.id))
+    incremental = _facetas(client)
+
+    assert reconstruir_facetas() == 11
+    assert _facetas(client) == incremental
+    assert _valores(incremental, 'marca') == {'Fiat': 2, 'VW': 1}
+    assert _valores(incremental, 'faixa_ano') == {'2010-2014': 2,
+                                                  '2020-2024': 1}
+
+
+def test_busca_facetas_filtered(client, criar_anuncio):
+    """Tests if the facets of a search count only the Anuncios found"""
+    criar_anuncio('Uno', marca='Fiat', modelo='Uno', ano=2012)
+    criar_anuncio('Palio', marca='Fiat', modelo='Palio', ano=2016)
+    criar_anuncio('Gol', marca='VW', modelo='Gol', ano=2016)
+    criar_anuncio('Uno', marca='Fiat', modelo='Uno', aprovado=False)
+
+    resposta = client.get('/api/v1/busca?query=fiat&facetas=1').get_json()
+
+    assert len(resposta['anuncios']) == 2
+    facetas = resposta['facetas']
+    assert _valores(facetas, 'marca') == {'Fiat': 2}
+    assert facetas['modelo'] == [{'valor': 'Palio', 'quantidade': 1},
+                                 {'valor': 'Uno', 'quantidade': 1}]
+    assert _valores(facetas, 'faixa_ano') == {'2010-2014': 1,
+                                              '2015-2019': 1}
+
+
+def test_busca_without_facetas(client, criar_anuncio):
+    """Tests if the facets are only computed when asked"""
+    criar_anuncio('Uno', marca='Fiat')
+
+    assert 'facetas' not in client.get('/api/v1/busca?query=fiat').get_json()
+    assert client.get('/api/v1/busca').status_code == 400
@@ -0,0 +1,227 @@
+""" Module that tests the processing of the uploaded images """
+import os
+import time
+
+from io import BytesIO
+
+import pytest
+from mock import patch
+from PIL import Image, JpegImagePlugin
+from werkzeug.datastructures import FileStorage
+
+from backend import images
+from backend.config import Config
+from backend.models import Anuncio, Imagem
+
+
+def criar_upload(largura=2048, altura=1536, nome='foto.jpg'):
+    """ Returns a FileStorage with a JPEG of the given size """
+    conteudo = BytesIO()
+    Image.new('RGB', (largura, altura), (200, 30, 30)).save(conteudo, 'JPEG')
+    conteudo.seek(0)
+    return FileStorage(stream=conteudo, filename=nome)
+
+
+@pytest.fixture
+def image_dir(tmp_path, monkeypatch):
+    """ Points IMAGE_DIR to a temporary directory """
+    monkeypatch.setattr(Config, 'IMAGE_DIR', str(tmp_path))
+    return tmp_path
+
+
+def test_processar_imagem(tmp_path):
+    """Tests if the raw upload is resized and removed"""
+    origem = str(tmp_path / 'imagem0.jpg.upload')
+    destino = str(tmp_path / 'imagem0.jpg')
+    criar_upload().save(origem)
+
+    images.processar_imagem(origem, destino, 1024, Config.IMAGE_MAX_PIXELS)
+
+    assert Image.open(destino).size == (1024, 768)
+    assert not (tmp_path / 'imagem0.jpg.upload').exists()
+
+
+def test_processar_imagem_decodes_in_draft_mode(tmp_path):
+    """Tests if big JPEGs are scaled down while being decoded"""
+    origem = str(tmp_path / 'imagem0.jpg.upload')
+    destino = str(tmp_path / 'imagem0.jpg')
+    criar_upload(4096, 3072).save(origem)
+    draft = JpegImagePlugin.JpegImageFile.draft
+
+    with patch.object(JpegImagePlugin.JpegImageFile, 'draft', autospec=True,
+                      side_effect=draft) as mock_draft:
+        images.processar_imagem(origem, destino, 1024,
+                                Config.IMAGE_MAX_PIXELS)
+
+    mock_draft.assert_called_once()
+    assert Image.open(destino).size == (1024, 768)
+
+
+def test_processar_imagem_rejects_too_many_pixels(tmp_path):
+    """Tests if uploads above max_pixels are rejected"""
+    origem = str(tmp_path / 'imagem0.jpg.upload')
+    criar_upload(2000, 1000).save(origem)
+
+    with pytest.raises(ValueError):
+        images.processar_imagem(origem, str(tmp_path / 'imagem0.jpg'),
+                                1024, 1999999)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_upload_images_inserts_pending_rows_at_once(
+        image_dir, criar_anuncio):
+    """Tests if the Imagem rows are inserted in one flush as pendente"""
+    anuncio = criar_anuncio('Uno')
+    uploads = [criar_upload(), criar_upload()]
+
+    with patch.object(images.image_pipeline, 'processar') as processar:
+        images.upload_images(anuncio, uploads)
+
+    imagens = Imagem.get_all()
+    assert [i.status for i in imagens] == [Imagem.PENDENTE] * 2
+    assert processar.call_count == 2
+
+
+def test_upload_images_marks_images_as_ready(image_dir, criar_anuncio):
+    """Tests if the processed images are marked as pronta"""
+    anuncio = criar_anuncio('Uno')
+    images.upload_images(anuncio, [criar_upload()])
+
+    imagem = Imagem.get_first(anuncio_id=anuncio.id)
+    caminho = image_dir / str(anuncio.usuario_id) / str(anuncio.id)
+    assert imagem.status == Imagem.PRONTA
+    assert Image.open(str(caminho / 'imagem0.jpg')).size[0] == 1024
+
+
+def test_upload_images_marks_invalid_images(image_dir, criar_anuncio):
+    """Tests if an invalid upload is marked as erro"""
+    anuncio = criar_anuncio('Uno')
+    upload = FileStorage(stream=BytesIO(b'nao eh imagem'), filename='x.jpg')
+    images.upload_images(anuncio, [upload])
+
+    assert Imagem.get_first(anuncio_id=anuncio.id).status == Imagem.ERRO
+    caminho = image_dir / str(anuncio.usuario_id) / str(anuncio.id)
+    assert list(caminho.iterdir()) == []
+
+
+@pytest.fixture
+def imagem_salva(image_dir, criar_anuncio):
+    """ Returns a processed Imagem of 1024x768 """
+    anuncio = criar_anuncio('Uno')
+    images.upload_images(anuncio, [criar_upload()])
+    images.variantes_cache.configurar(str(image_dir / 'variantes'),
+                                      Config.IMAGE_VARIANTES_MAX_BYTES)
+
+    return Imagem.get_first(anuncio_id=anuncio.id)
+
+
+def test_variante_is_resized_and_cached(client, imagem_salva):
+    """Tests if the variant has the bucket width and is created once"""
+    url = '/api/v1/imagem/{}/300'.format(imagem_salva.id)
+    response = client.get(url)
+
+    assert response.status_code == 200
+    assert response.headers['Cache-Control'].startswith('public')
+    assert Image.open(BytesIO(response.data)).size == (320, 240)
+
+    with patch('backend.images.gerar_variante') as gerar_variante:
+        client.get(url).close()
+    gerar_variante.assert_not_called()
+
+
+def test_variante_not_modified(client, imagem_salva):
+    """Tests if the variant answers If-None-Match with 304"""
+    url = '/api/v1/imagem/{}/160'.format(imagem_salva.id)
+    etag = client.get(url).headers['ETag']
+
+    response = client.get(url, headers={'If-None-Match': etag})
+
+    assert response.status_code == 304
+    assert response.data == b''
+
+
+def test_variante_of_pending_image(client, imagem_salva, db):
+    """Tests if pending images have no variants"""
+    Imagem.atualizar_status(imagem_salva.id, Imagem.PENDENTE)
+
+    response = client.get('/api/v1/imagem/{}/160'.format(imagem_salva.id))
+
+    assert response.status_code == 404
+
+
+def test_disk_cache_evicts_least_recently_used(tmp_path):
+    """Tests if the disk cache keeps its size under max_bytes"""
+    cache = images.DiskLRUCache(str(tmp_path), 25)
+    for nome in ['a', 'b', 'c']:
+        (tmp_path / nome).write_bytes(b'0' * 10)
+        cache.add(nome)
+        if nome == 'b':
+            cache.get('a')
+
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['a', 'c']
+    assert cache.estatisticas()['bytes'] == 20
+    assert cache.get('b') is None
+
+
+def test_disk_cache_counts_other_processes(tmp_path):
+    """Tests if the files written by other processes count for the size"""
+    cache = images.DiskLRUCache(str(tmp_path), 25)
+    outro = images.DiskLRUCache(str(tmp_path), 25)
+    (tmp_path / 'a').write_bytes(b'0' * 10)
+    os.utime(str(tmp_path / 'a'), (0, 0))
+    outro.add('a')
+    (tmp_path / 'b').write_bytes(b'0' * 10)
+    cache.add('b')
+    (tmp_path / 'c').write_bytes(b'0' * 10)
+
+    with patch('backend.images.time.time', return_value=time.time() + 60):
+        cache.add('c')
+
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['b', 'c']
+    assert cache.estatisticas()['bytes'] == 20
+
+
+def test_variante_of_missing_file(client, imagem_salva):
+    """Tests if an Imagem whose file is gone has no variants"""
+    os.unlink(imagem_salva.caminho())
+
+    response = client.get('/api/v1/imagem/{}/160'.format(imagem_salva.id))
+
+    assert response.status_code == 404
+
+
+def test_processed_images_clear_listing_cache(client, image_dir,
+                                              criar_anuncio):
+    """Tests if the cached listing shows the images once processed"""
+    anuncio = criar_anuncio('Uno')
+    client.get('/api/v1/anuncios?limit=5')
+
+    images.upload_images(anuncio, [criar_upload()])
+
+    response = client.get('/api/v1/anuncios?limit=5')
+    assert len(response.get_json()['anuncios'][0]['imagens']) == 1
+
+
+def test_variante_evicted_meanwhile(imagem_salva, tmp_path):
+    """Tests if a variant removed after the cache lookup is created again"""
+    (tmp_path / 'variantes').mkdir()
+    with patch.object(images.variantes_cache, 'get',
+                      return_value=str(tmp_path / 'removida.jpg')):
+        caminho = images.caminho_variante(imagem_salva, 160)
+
+    assert Image.open(caminho).size == (160, 120)
+
+
+def test_variantes_removed_with_imagem(client, imagem_salva):
+    """Tests if the variants of the deleted Imagens are removed"""
+    client.get('/api/v1/imagem/{}/160'.format(imagem_salva.id)).close()
+    nome = images.nome_variante(imagem_salva.id, 160)
+    assert images.variantes_cache.get(nome)
+    usuario_id = Anuncio.get_first(id=imagem_salva.anuncio_id).usuario_id
+
+    client.get('/api/v1/admin/deletar_usuario?usuario_id={}'.format(
+        usuario_id
+    ))
+
+    assert images.variantes_cache.get(nome) is None
+    assert images.variantes_cache.estatisticas()['arquivos'] == 0
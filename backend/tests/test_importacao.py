@@ -0,0 +1,90 @@
+""" Module that tests the bulk import """
+import json
+
+import pytest
+
+from backend.importacao import importar
+from backend.models import Anuncio, Faceta, Imagem, Usuario
+
+
+def test_importar_usuarios_csv(tmp_path, usuario_salvo):
+    """Tests if the Usuarios are copied, skipping the existing ones"""
+    arquivo = tmp_path / 'usuarios.csv'
+    arquivo.write_text(
+        'id,facebook_id,nome,tipo\n'
+        '50,111,Maria,Garagem\n'
+        ',222,Jose,\n'
+        ',123456789,Joao de novo,\n'
+    )
+
+    assert importar('usuarios', str(arquivo)) == (2, 3)
+
+    maria = Usuario.get_first(facebook_id='111')
+    assert (maria.id, maria.tipo, maria.views) == (50, 'Garagem', 0)
+    jose = Usuario.get_first(facebook_id='222')
+    assert (jose.tipo, jose.qtd_anuncios) == ('Pessoa Fisica', 0)
+    assert jose.cadastrado_em is not None
+    # The sequence continues after the imported ids
+    novo = Usuario('333', 'Ana', '', '', '', '', '')
+    Usuario.update_or_insert(novo)
+    assert novo.id == 51
+
+
+def test_importar_anuncios_ndjson(tmp_path, usuario_salvo):
+    """Tests if the Anuncios are linked to their Usuarios and indexed"""
+    usuario_id = usuario_salvo.id
+    linhas = [
+        {'usuario_facebook_id': '123456789', 'titulo': 'Uno', 'marca': 'Fiat',
+         'modelo': 'Uno', 'ano': 2010, 'aprovado': True, 'views': 7},
+        {'usuario_facebook_id': '123456789', 'titulo': 'Gol',
+         'marca': 'Volkswagen', 'aprovado': False},
+        {'usuario_facebook_id': '999', 'titulo': 'Sem usuario'},
+    ]
+    arquivo = tmp_path / 'anuncios.ndjson'
+    arquivo.write_text('\n'.join(json.dumps(linha) for linha in linhas))
+    progresso = []
+
+    resultado = importar('anuncios', str(arquivo), lote=2,
+                         progresso=lambda p, t: progresso.append(p))
+
+    assert resultado == (2, 3)
+    assert progresso == [2, 3]
+    anuncio = Anuncio.get_first(titulo='Uno')
+    assert anuncio.usuario_id == usuario_id
+    assert anuncio.query_busca == 'Fiat Uno 2010'
+    assert anuncio.vetor_busca is not None
+    assert (anuncio.troca, anuncio.criado_em is not None) == (False, True)
+    usuario = Usuario.get_first(id=usuario_id)
+    assert [getattr(usuario, campo) for campo in Usuario.CONTADORES] == [
+        2, 1, 7
+    ]
+    assert Faceta.get_first(dimensao='marca', valor='Fiat').quantidade == 1
+
+
+def test_importar_imagens(tmp_path, db, criar_anuncio):
+    """Tests if the Imagens of inexistent Anuncios are skipped"""
+    anuncio = criar_anuncio('Uno')
+    anuncio_id, atualizado_em = anuncio.id, anuncio.atualizado_em
+    arquivo = tmp_path / 'imagens.csv'
+    arquivo.write_text(
+        'anuncio_id,img_filename\n'
+        '{},images/1/1/imagem0.jpg\n'
+        '{},images/1/2/imagem0.jpg\n'.format(anuncio_id, anuncio_id + 1)
+    )
+
+    assert importar('imagens', str(arquivo)) == (1, 2)
+    imagem = Imagem.get_first(anuncio_id=anuncio_id)
+    assert imagem.status == Imagem.PRONTA
+    # The ETag of the Anuncio changes with its new Imagem
+    db.session.expire_all()
+    assert Anuncio.get_first(id=anuncio_id).atualizado_em > atualizado_em
+
+
+def test_importar_colunas_desconhecidas(tmp_path, db):
+    """Tests if columns that are not of the model are refused"""
+    arquivo = tmp_path / 'usuarios.csv'
+    arquivo.write_text('facebook_id,qtd_anuncios\n111,3\n')
+
+    with pytest.raises(ValueError):
+        importar('usuarios', str(arquivo))
+    assert Usuario.get_first(facebook_id='111') is None
@@ -0,0 +1,92 @@
+""" Module that tests the models queries """
+import json
+
+from backend.models import Anuncio, Usuario
+from backend.utils import decode_cursor
+
+
+def test_buscar_ranks_by_relevance(criar_anuncio):
+    """Tests if buscar ranks the marca/modelo matches before the others"""
+    criar_anuncio('Palio com teto de uno', marca='Fiat', modelo='Palio')
+    criar_anuncio('Uno economico', marca='Fiat', modelo='Uno')
+    criar_anuncio('Gol bola', marca='VW', modelo='Gol')
+
+    anuncios, _ = Anuncio.buscar('uno', None, None)
+
+    assert [a['titulo'] for a in anuncios] == [
+        'Uno economico', 'Palio com teto de uno'
+    ]
+
+
+def test_buscar_ignores_not_approved(criar_anuncio):
+    """Tests if buscar returns only approved Anuncios"""
+    criar_anuncio('Uno economico', marca='Fiat', modelo='Uno', aprovado=False)
+
+    assert Anuncio.buscar('uno', None, None) == ([], None)
+
+
+def test_buscar_binds_query(criar_anuncio):
+    """Tests if buscar handles quotes and operators typed by the user"""
+    criar_anuncio('Uno economico', marca='Fiat', modelo='Uno')
+
+    anuncios, _ = Anuncio.buscar("uno'; DROP TABLE anuncio; --", None, None)
+    assert anuncios == []
+    anuncios, _ = Anuncio.buscar('fiat & uno |', None, 1)
+    assert len(anuncios) == 1
+
+
+def test_get_pages_with_cursor(criar_anuncio):
+    """Tests if get walks through all the Anuncios with next_cursor"""
+    criados = [criar_anuncio('Anuncio {}'.format(i)).id for i in range(5)]
+    criar_anuncio('Nao aprovado', aprovado=False)
+
+    vistos = []
+    anuncios, next_cursor = Anuncio.get(None, 2)
+    vistos += [a['id'] for a in anuncios]
+    while next_cursor:
+        anuncios, next_cursor = Anuncio.get(None, 2,
+                                            decode_cursor(next_cursor))
+        vistos += [a['id'] for a in anuncios]
+
+    assert vistos == list(reversed(criados))
+
+
+def test_buscar_pages_recentes(criar_anuncio):
+    """Tests if buscar paginates the 'recentes' order"""
+    criados = [criar_anuncio('Uno {}'.format(i)).id for i in range(3)]
+
+    anuncios, next_cursor = Anuncio.buscar('uno', 'recentes', 2)
+    assert [a['id'] for a in anuncios] == [criados[2], criados[1]]
+    anuncios, next_cursor = Anuncio.buscar('uno', 'recentes', 2,
+                                           decode_cursor(next_cursor))
+    assert [a['id'] for a in anuncios] == [criados[0]]
+    assert next_cursor is None
+
+
+def test_projecao_equals_to_json(db, criar_anuncio, criar_imagem):
+    """Tests if the listings without ORM objects match to_json byte for byte"""
+    usuario = Usuario('1234567', 'José', None, 'Garagem', 'São Paulo',
+                      'SP', '')
+    Usuario.update_or_insert(usuario)
+    criar_anuncio('Uno ação', marca='Fiat', modelo='Uno', cor=None,
+                  descricao='Único dono\n"impecável"', troca=True)
+    sem_imagens = criar_anuncio('Gol', marca='VW', modelo='Gol', ano=None)
+    outro = Anuncio(usuario.id, 'Ka', None, None)
+    outro.aprovado = True
+    Anuncio.update_or_insert(outro)
+    for anuncio in [outro, sem_imagens]:
+        criar_imagem(anuncio, 'images/{}/imagem1.jpg'.format(anuncio.id))
+        criar_imagem(anuncio, 'images/{}/imagem0.jpg'.format(anuncio.id))
+    db.session.expunge_all()
+
+    esperados = [a.to_json() for a in Anuncio.query.order_by(
+        Anuncio.criado_em.desc(), Anuncio.id.desc()
+    )]
+    anuncios, _ = Anuncio.get(None, None)
+    assert json.dumps(anuncios) == json.dumps(esperados)
+    anuncios, _ = Anuncio.buscar('gol', 'recentes', None)
+    assert json.dumps(anuncios) == json.dumps(esperados[1:2])
+
+    esperados = [u.to_json(False) for u in Usuario.query.order_by(Usuario.id)]
+    usuarios = sorted(Usuario.get_all(parsed=True), key=lambda u: u['id'])
+    assert json.dumps(usuarios) == json.dumps(esperados)
@@ -0,0 +1,85 @@
+""" Module that tests the background notifications """
+import os
+
+import pytest
+from flask_jwt_extended import create_access_token
+from mock import patch, Mock
+
+from backend.notifications import NotificationDispatcher
+from backend.utils import create_identity
+
+
+@pytest.fixture
+def dispatcher(app):
+    """ Returns a NotificationDispatcher bound to the test app """
+    _dispatcher = NotificationDispatcher()
+    with patch('backend.notifications.atexit'):
+        _dispatcher.init_app(app)
+    _dispatcher.backoff = 0
+    _dispatcher._session = Mock()
+
+    return _dispatcher
+
+
+@patch.dict('flask.current_app.config', {'SLACK_HOOK': 'https://hook'})
+def test_send_slack_synchronously(dispatcher):
+    """Tests if the Slack message is posted with the pooled session"""
+    dispatcher.enviar('slack', 'Mensagem')
+
+    dispatcher._session.post.assert_called_once_with(
+        'https://hook', json={'text': 'Mensagem'}, timeout=10
+    )
+    assert dispatcher.estatisticas()['enviados'] == 1
+
+
+@patch.dict('flask.current_app.config', {'SLACK_HOOK': 'https://hook'})
+def test_retries_failed_delivery(dispatcher):
+    """Tests if the delivery is retried before being counted as failure"""
+    dispatcher._session.post.side_effect = IOError('timeout')
+    dispatcher.enviar('slack', 'Mensagem')
+
+    assert dispatcher._session.post.call_count == dispatcher.tentativas
+    assert dispatcher.estatisticas()['falhas'] == 1
+    assert dispatcher.estatisticas()['retentativas'] == \
+        dispatcher.tentativas - 1
+
+
+@patch('backend.notifications.mail')
+def test_emails_reuse_smtp_connection(mail, dispatcher, valid_msg):
+    """Tests if the queued emails are sent through one SMTP connection"""
+    for _ in range(3):
+        dispatcher._fila.put(('email', valid_msg))
+    dispatcher.drenar()
+
+    mail.connect.assert_called_once()
+    assert mail.connect.return_value.send.call_count == 3
+    mail.connect.return_value.__exit__.assert_called_once()
+
+
+def test_drops_when_queue_is_full(dispatcher):
+    """Tests if enviar does not block when the queue is full"""
+    dispatcher.workers = 1
+    dispatcher._pid = os.getpid()
+    dispatcher._fila.maxsize = 1
+    dispatcher.enviar('slack', 'Primeira')
+    dispatcher.enviar('slack', 'Segunda')
+
+    estatisticas = dispatcher.estatisticas()
+    assert estatisticas['fila'] == 1
+    assert estatisticas['descartados'] == 1
+
+
+def test_synchronous_keeps_request_session(client, usuario_salvo):
+    """Tests if sending inside a request does not detach its objects"""
+    token = create_access_token(identity=create_identity(usuario_salvo))
+    headers = {'Authorization': 'Bearer ' + token}
+
+    response = client.post('/api/v1/anuncio', headers=headers,
+                           data={'titulo': 'Uno', 'valor': 1000})
+    assert response.status_code == 200
+    assert list(response.get_json().values())[0]['imagens'] == []
+    response = client.post('/api/v1/contato', data={
+        'nome': 'Maria', 'contato': 'maria@clozer.com.br', 'texto': 'Oi'
+    })
+    assert response.status_code == 200
+    assert list(response.get_json().values())[0]['nome'] == 'Maria'
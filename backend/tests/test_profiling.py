@@ -0,0 +1,85 @@
+""" Module that tests the profiling of the requests """
+import pytest
+
+from backend.profiling import profiler
+
+
+@pytest.fixture
+def profiling(monkeypatch):
+    """ Enables the profiler, without the profiles of other tests """
+    monkeypatch.setattr(profiler, 'ativo', True)
+    profiler.limpar()
+    yield profiler
+    profiler.limpar()
+
+
+def test_profiling_desativado(client, criar_anuncio):
+    """Tests if the header is ignored while the profiling is disabled"""
+    response = client.get('/api/v1/anuncios', headers={'X-Profile': '1'})
+
+    assert 'X-Profile-Id' not in response.headers
+    assert profiler.perfis() == []
+
+
+def test_profiling_statements(client, criar_anuncio, profiling):
+    """Tests if the statements of the request are recorded"""
+    criar_anuncio('Uno')
+    client.get('/api/v1/anuncios')
+    assert profiling.perfis() == []
+
+    response = client.get('/api/v1/busca?query=uno',
+                          headers={'X-Profile': '1'})
+    perfil_id = int(response.headers['X-Profile-Id'])
+
+    perfil = client.get(
+        '/api/v1/admin/perfis/{}'.format(perfil_id)
+    ).get_json()
+    assert (perfil['metodo'], perfil['caminho'], perfil['status']) == \
+        ('GET', '/api/v1/busca?query=uno', 200)
+    assert perfil['queries'] == len(perfil['statements']) > 0
+    assert perfil['segundos'] >= perfil['queries_segundos']
+    assert perfil['cprofile'] is None
+    html = client.get('/api/v1/admin/perfis').get_data(as_text=True)
+    assert html.count('class="perfil"') == 1
+
+
+def test_profiling_repetidas(client, criar_anuncio, profiling, monkeypatch):
+    """Tests if the repeated statements are reported as N+1"""
+    anuncio_id = criar_anuncio('Uno').id
+    monkeypatch.setattr(profiling, 'n_mais_um', 1)
+    url = '/api/v1/anuncio/{}'.format(anuncio_id)
+    client.get(url, headers={'X-Profile': '1'})
+
+    monkeypatch.setattr(profiling, 'n_mais_um', 0)
+    client.get(url, headers={'X-Profile': '1'})
+
+    sem_repeticao, com_limite_zero = profiling.perfis()[::-1]
+    assert sem_repeticao['repetidas'] == []
+    assert sum(r['vezes'] for r in com_limite_zero['repetidas']) == \
+        com_limite_zero['queries']
+
+
+def test_profiling_cprofile(client, profiling):
+    """Tests if the header cprofile adds the cProfile stats"""
+    response = client.get('/api/v1/anuncios',
+                          headers={'X-Profile': 'cprofile'})
+
+    perfil = profiling.perfil(int(response.headers['X-Profile-Id']))
+    assert 'function calls' in perfil['cprofile']
+    assert client.get('/api/v1/admin/perfis/0').status_code == 404
+
+
+def test_profiling_max_statements(client, criar_anuncio, profiling,
+                                  monkeypatch):
+    """Tests if only the first statements are kept, all are counted"""
+    anuncio_id = criar_anuncio('Uno').id
+    monkeypatch.setattr(profiling, 'max_statements', 1)
+    monkeypatch.setattr(profiling, 'n_mais_um', 0)
+
+    response = client.get('/api/v1/anuncio/{}'.format(anuncio_id),
+                          headers={'X-Profile': '1'})
+
+    perfil = profiling.perfil(int(response.headers['X-Profile-Id']))
+    assert len(perfil['statements']) == 1
+    assert perfil['queries'] > 1
+    assert sum(r['vezes'] for r in perfil['repetidas']) == perfil['queries']
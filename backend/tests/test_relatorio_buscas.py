@@ -0,0 +1,102 @@
+""" Module that tests the report of the Buscas """
+from datetime import datetime, timedelta
+
+import pytest
+
+from backend.app import db
+from backend.models import Busca, BuscaDia, BuscaHora, BuscaTermo, Marcador
+from backend.tasks import atualizar_relatorio_buscas
+
+
+def _buscar(busca, resultados, buscado_em, salvo_em=None):
+    registro = Busca(0, busca, resultados)
+    registro.buscado_em = buscado_em
+    registro.salvo_em = salvo_em or buscado_em
+    db.session.add(registro)
+    db.session.commit()
+
+
+def test_atualizar_relatorio_buscas(db):
+    """Tests if the rollups count the new Buscas once"""
+    hora = datetime.now().replace(minute=0, second=0, microsecond=0)
+    hora -= timedelta(hours=2)
+    _buscar('Fiat Uno', 3, hora + timedelta(minutes=5))
+    _buscar('fiat uno ', 0, hora + timedelta(minutes=10))
+    _buscar('gol', 0, hora + timedelta(minutes=70))
+    _buscar('palio', None, hora - timedelta(days=1))
+
+    assert atualizar_relatorio_buscas(lote=2) == (4, True)
+
+    assert BuscaHora.get_first(hora=hora).quantidade == 2
+    assert BuscaHora.get_first(hora=hora).sem_resultado == 1
+    assert BuscaDia.get_first(dia=hora.date()).quantidade >= 2
+    termo = BuscaTermo.get_first(termo='fiat uno')
+    assert (termo.quantidade, termo.sem_resultado) == (2, 1)
+    assert termo.ultima_busca_em == hora + timedelta(minutes=10)
+
+    # Only the new Buscas are added
+    _buscar('gol', 0, hora)
+    _buscar('gol', 0, datetime.now())
+    assert atualizar_relatorio_buscas() == (1, True)
+    assert BuscaTermo.get_first(termo='gol').quantidade == 2
+    assert Marcador.get_valor('relatorio_buscas') == 5
+
+
+def test_atualizar_relatorio_buscas_waits_for_insert(db):
+    """Tests if retried Buscas wait for the time they were inserted"""
+    antes = datetime.now() - timedelta(hours=1)
+    _buscar('uno', 1, antes)
+    # Buffered an hour ago, inserted now after a failed flush
+    registro = Busca(0, 'gol', 1)
+    registro.buscado_em = antes
+    db.session.add(registro)
+    db.session.commit()
+
+    assert atualizar_relatorio_buscas() == (1, True)
+    assert Busca.get_first(busca='gol').salvo_em > antes
+    assert BuscaTermo.get_first(termo='gol') is None
+
+
+def test_relatorio_buscas_api(client):
+    """Tests the report served by the API and the admin"""
+    antes = datetime.now() - timedelta(hours=1)
+    for busca, resultados in [('uno', 2), ('uno', 0), ('gol', 1),
+                              ('tempra', 0)]:
+        _buscar(busca, resultados, antes)
+    client.get('/api/v1/admin/atualizar_relatorio_buscas')
+
+    relatorio = client.get('/api/v1/relatorio_buscas?limit=2').get_json()
+
+    assert [t['termo'] for t in relatorio['mais_buscados']] == ['uno', 'gol']
+    assert [(t['termo'], t['sem_resultado'])
+            for t in relatorio['sem_resultado']] == [('tempra', 1),
+                                                     ('uno', 1)]
+    assert sum(h['quantidade'] for h in relatorio['por_hora']) == 4
+    assert sum(d['quantidade'] for d in relatorio['por_dia']) == 4
+
+    html = client.get('/api/v1/admin/relatorio_buscas').get_data(
+        as_text=True
+    )
+    assert '<td>tempra</td>' in html
+
+
+def test_relatorio_buscas_reads_only_rollups(client, assert_num_queries):
+    """Tests if the report does not read the busca table"""
+    _buscar('uno', 1, datetime.now() - timedelta(hours=1))
+    atualizar_relatorio_buscas()
+
+    with assert_num_queries(4) as queries:
+        client.get('/api/v1/relatorio_buscas')
+
+    assert not any('FROM busca ' in q for q in queries)
+
+
+@pytest.mark.parametrize('params,status', [
+    ('limit=-1', 400), ('horas=0', 400), ('dias=-5', 400),
+    ('horas=99999999999&dias=99999999999&limit=99999999999', 200)
+])
+def test_relatorio_buscas_params(client, params, status):
+    """Tests if the params must be positive and are capped"""
+    response = client.get('/api/v1/relatorio_buscas?' + params)
+
+    assert response.status_code == status
@@ -0,0 +1,94 @@
+""" Module that tests the search suggestions """
+from backend.models import Busca
+from backend.sugestoes import IndiceSugestoes, normalizar, sugestoes
+from backend.tasks import reconstruir_facetas
+
+
+def _sugestoes(client, query):
+    url = '/api/v1/sugestoes?query={}'.format(query)
+    return client.get(url).get_json()['sugestoes']
+
+
+def test_normalizar():
+    """Tests if the accents, case and spaces are normalized"""
+    assert normalizar('  Citroën   C3 ') == 'citroen c3'
+    assert normalizar(None) == ''
+
+
+def test_indice_orders_by_weight():
+    """Tests the suggestions of short and long prefixes"""
+    indice = IndiceSugestoes(limite=3, max_varredura=1)
+    for termo, peso in [('fiat uno', 5), ('fiat palio', 7), ('fiesta', 2),
+                        ('ford ka', 9), ('fiat toro', 1)]:
+        indice.adicionar(termo, peso)
+
+    assert indice.sugerir('f') == ['ford ka', 'fiat palio', 'fiat uno']
+    assert indice.sugerir('fi') == ['fiat palio', 'fiat uno', 'fiesta']
+    assert indice.sugerir('fiat', 2) == ['fiat palio', 'fiat uno']
+    assert indice.sugerir('gol') == []
+
+    indice.adicionar('fiat toro', 10)
+    assert indice.sugerir('fi', 1) == ['fiat toro']
+
+
+def test_indice_carregar_matches_adicionar():
+    """Tests if the bulk load builds the same index"""
+    pesos = {'uno': 3, 'uno way': 1, 'up': 4, 'ultra': 4, '': 9}
+    incremental = IndiceSugestoes(limite=2, max_varredura=1)
+    for termo, peso in pesos.items():
+        incremental.adicionar(termo, peso)
+    carregado = IndiceSugestoes(limite=2, max_varredura=1)
+    carregado.carregar(pesos)
+
+    for prefixo in ['u', 'un', 'uno', 'up', 'x']:
+        assert carregado.sugerir(prefixo) == incremental.sugerir(prefixo)
+    assert len(carregado) == 4
+
+
+def test_indice_max_termos():
+    """Tests if new terms are ignored when the index is full"""
+    indice = IndiceSugestoes(max_termos=1)
+    indice.adicionar('uno')
+    indice.adicionar('up')
+
+    assert indice.sugerir('u') == ['uno']
+
+
+def test_sugestoes_from_buscas_and_catalogo(client, criar_anuncio):
+    """Tests if the suggestions come from the Buscas and the marcas"""
+    criar_anuncio('Palio', marca='Fiat', modelo='Palio')
+    reconstruir_facetas()
+    for busca in ['fiat uno', 'Fiat Uno', 'fiat uno', 'fusca', 'fusca']:
+        Busca.update_or_insert(Busca(0, busca))
+
+    assert _sugestoes(client, 'F') == ['fiat uno', 'fusca', 'fiat']
+    assert _sugestoes(client, 'pal') == ['palio']
+
+    # Indexed incrementally, even if searched once
+    Busca.update_or_insert(Busca(0, 'Palio Weekend'))
+    assert _sugestoes(client, 'pal') == ['palio', 'palio weekend']
+
+
+def test_sugestoes_do_not_query_the_database(client, monkeypatch,
+                                             assert_num_queries):
+    """Tests if the lookups are served from memory"""
+    for _ in range(2):
+        Busca.update_or_insert(Busca(0, 'gol'))
+    sugestoes.run_once()
+    monkeypatch.setattr(sugestoes, 'interval', 60)
+    monkeypatch.setattr(sugestoes, 'ensure_started', lambda: None)
+
+    with assert_num_queries(0):
+        assert _sugestoes(client, 'go') == ['gol']
+
+
+def test_sugestoes_limit(client):
+    """Tests if limit must be positive"""
+    for busca in ['fiat uno', 'fiat palio', 'fusca'] * 2:
+        Busca.update_or_insert(Busca(0, busca))
+    url = '/api/v1/sugestoes?query=f&limit='
+
+    assert client.get(url + '-1').status_code == 400
+    assert client.get(url + '0').status_code == 400
+    assert len(client.get(url + '1').get_json()['sugestoes']) == 1
+    assert len(client.get(url + '1000').get_json()['sugestoes']) == 3
@@ -0,0 +1,86 @@
+""" Module that tests the batch jobs """
+from backend.app import db
+from backend.models import Anuncio, Marcador, Usuario
+from backend.tasks import recalcular_busca, reconciliar_contadores
+
+
+def _limpar_busca(anuncio_ids):
+    db.session.query(Anuncio).filter(Anuncio.id.in_(anuncio_ids)).update(
+        {'query_busca': None, 'vetor_busca': None},
+        synchronize_session=False
+    )
+    db.session.commit()
+
+
+def test_recalcular_busca(criar_anuncio):
+    """Tests if query_busca and vetor_busca are recomputed in batches"""
+    ids = [criar_anuncio('Carro', marca='Fiat', modelo='Uno',
+                         ano=2010 + i).id for i in range(5)]
+    _limpar_busca(ids)
+    lotes = []
+
+    processados, total, terminou = recalcular_busca(
+        lote=2, progresso=lambda p, t: lotes.append(p)
+    )
+
+    assert (processados, total, terminou) == (5, 5, True)
+    assert lotes == [2, 4, 5]
+    anuncio = Anuncio.get_first(id=ids[0])
+    assert anuncio.query_busca == 'Fiat Uno 2010'
+    assert anuncio.vetor_busca is not None
+    assert Marcador.get_valor('recalcular_busca') == 0
+
+
+def test_recalcular_busca_ignora_vazios(criar_anuncio):
+    """Tests if empty fields do not end up as 'None' in query_busca"""
+    anuncio_id = criar_anuncio('Carro', marca='Fiat', ano=None).id
+
+    recalcular_busca()
+
+    assert Anuncio.get_first(id=anuncio_id).query_busca == 'Fiat'
+
+
+def test_recalcular_busca_retoma(criar_anuncio):
+    """Tests if an interrupted run resumes from the saved progress"""
+    ids = [criar_anuncio('Carro', marca='Fiat').id for _ in range(4)]
+    _limpar_busca(ids)
+    Marcador.salvar('recalcular_busca', ids[1])
+    db.session.commit()
+
+    processados, total, terminou = recalcular_busca(lote=10)
+
+    assert (processados, total, terminou) == (4, 4, True)
+    recalculados = [a.query_busca for a in
+                    Anuncio.query.order_by(Anuncio.id).all()]
+    assert recalculados == [None, None, 'Fiat 2015', 'Fiat 2015']
+
+    recalcular_busca(reiniciar=True)
+    assert Anuncio.query.filter(Anuncio.query_busca.is_(None)).count() == 0
+
+
+def test_recalcular_busca_tempo_maximo(criar_anuncio):
+    """Tests if the run stops after max_segundos, saving its progress"""
+    ids = [criar_anuncio('Carro', marca='Fiat').id for _ in range(3)]
+
+    processados, total, terminou = recalcular_busca(lote=1,
+                                                    max_segundos=-1)
+
+    assert (processados, total, terminou) == (1, 3, False)
+    assert Marcador.get_valor('recalcular_busca') == ids[0]
+    assert recalcular_busca(lote=1) == (3, 3, True)
+
+
+def test_reconciliar_contadores(usuario_salvo, criar_anuncio):
+    """Tests if the drifted counters of the Usuario are recounted"""
+    usuario_id = usuario_salvo.id
+    criar_anuncio('Uno', views=3)
+    criar_anuncio('Gol', aprovado=False, views=4)
+    db.session.query(Usuario).update({'qtd_anuncios': 7, 'total_views': 0})
+    db.session.commit()
+
+    assert reconciliar_contadores() == 1
+    usuario = Usuario.get_first(id=usuario_id)
+    assert [getattr(usuario, campo) for campo in Usuario.CONTADORES] == [
+        2, 1, 7
+    ]
+    assert reconciliar_contadores() == 0
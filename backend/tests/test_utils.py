@@ -1,9 +1,9 @@
 """ Module for utilitary function """
 import pytest
+from datetime import datetime
 from mock import patch, Mock, call
 
 from backend import utils
-from backend.config import Config as config
 from backend.models import Usuario
 
 
@@ -28,33 +28,27 @@ def test_get_current_user(get_jwt_identity, valid_usuario):
     assert current_user['facebook_id'] == int(valid_usuario.facebook_id)
 
 
-@patch('backend.utils.post')
-def test_send_to_slack(post):
-    """Tests if send_to_slack calls the post function """
+@patch('backend.utils.dispatcher')
+def test_send_to_slack(dispatcher):
+    """Tests if send_to_slack queues the message """
     msg = 'Message'
-    data = {'text': msg}
-    url = config.SLACK_HOOK
     utils.send_to_slack(msg)
 
-    post.assert_called_once_with(url, json=data)
+    dispatcher.enviar.assert_called_once_with('slack', msg)
 
 
-@patch('backend.utils.log')
-@patch('backend.utils.mail')
-def test_send_email_with_valid_message(mail, log, valid_msg):
+@patch('backend.utils.dispatcher')
+def test_send_email_with_valid_message(dispatcher, valid_msg):
     """Tests send_email with valid message """
     utils.send_email(valid_msg)
-    mail.send.assert_called_once_with(valid_msg)
-    log.assert_called_once_with(valid_msg.subject, valid_msg.recipients)
+    dispatcher.enviar.assert_called_once_with('email', valid_msg)
 
 
-@patch('backend.utils.log')
-@patch('backend.utils.mail')
-def test_send_email_with_empty_message(mail, log):
+@patch('backend.utils.dispatcher')
+def test_send_email_with_empty_message(dispatcher):
     """Tests send_email with empty message """
     utils.send_email({})
-    mail.send.assert_not_called()
-    log.assert_not_called()
+    dispatcher.enviar.assert_not_called()
 
 
 @patch('backend.utils.app')
@@ -62,3 +56,35 @@ def test_log(app):
     """Tests if test_log calls the info method """
     utils.log('Testing')
     app.logger.info.assert_called_once()
+
+
+def test_cursor_roundtrip():
+    """Tests if decode_cursor returns what was encoded"""
+    criado_em = datetime(2018, 12, 12, 11, 5, 14, 241292)
+    cursor = utils.encode_cursor(criado_em, 42)
+
+    assert utils.decode_cursor(cursor) == (criado_em, 42)
+
+
+def test_cursor_roundtrip_without_microseconds():
+    """Tests the cursor of a date without microseconds"""
+    criado_em = datetime(2018, 12, 12, 11, 5, 14)
+    cursor = utils.encode_cursor(criado_em, 7)
+
+    assert utils.decode_cursor(cursor) == (criado_em, 7)
+
+
+@pytest.mark.parametrize('cursor', ['', 'abc', 'bm9wZQ==', '!!!'])
+def test_decode_invalid_cursor(cursor):
+    """Tests if decode_cursor raises ValueError for invalid cursors"""
+    with pytest.raises(ValueError):
+        utils.decode_cursor(cursor)
+
+
+@pytest.mark.parametrize('valor,esperado', [
+    ('1', True), ('true', True), ('Sim', True), ('0', False),
+    ('false', False), ('', False)
+])
+def test_parse_bool(valor, esperado):
+    """Tests the boolean params"""
+    assert utils.parse_bool(valor) is esperado
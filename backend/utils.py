@@ -1,13 +1,21 @@
 """ Module for utilitary function """
+import hashlib
 import re
 
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+
 from flask import current_app as app
-from flask_jwt_extended import get_jwt_identity
+from flask_jwt_extended import (get_jwt_identity,
+                                verify_jwt_in_request_optional)
+from flask_jwt_extended.exceptions import JWTExtendedException
+from jwt import PyJWTError
 from flask_restful.reqparse import RequestParser
-from requests import post
 
-from backend.app import mail
-from backend.config import Config as config
+from backend.notifications import dispatcher
+
+
+CURSOR_FORMATO = '%Y-%m-%dT%H:%M:%S.%f'
 
 
 def create_identity(usuario):
@@ -37,28 +45,113 @@ def get_current_user():
     return {'id': usuario_id, 'facebook_id': facebook_id}
 
 
+def get_optional_user_id():
+    """
+    Gets the id of the current user on the endpoints that do not require
+    the login
+
+    Returns:
+        (int): the usuario_id, or 0 if the JWT is missing or invalid
+    """
+    try:
+        verify_jwt_in_request_optional()
+    except (JWTExtendedException, PyJWTError):
+        return 0
+    if get_jwt_identity() is None:
+        return 0
+    return get_current_user()['id']
+
+
 def send_to_slack(msg):
     """
-    Sends a notification to our slack channel
+    Queues a notification to our slack channel.
+    It does not block, the dispatcher sends it in background.
 
     Args:
         msg (str): message to be sent
     """
-    data = {'text': msg}
-    url = config.SLACK_HOOK
-    post(url, json=data)
+    dispatcher.enviar('slack', msg)
 
 
 def send_email(msg):
     """
-    Sends an email and logs it
+    Queues an email, which is logged when the dispatcher sends it.
+    It does not block, the dispatcher sends it in background.
 
     Args:
         msg (flask_mail.Message): message object to be sent
     """
     if msg and re.match(r"[^@]+@[^@]+\.[^@]+", msg.sender):
-        mail.send(msg)
-        log(msg.subject, msg.recipients)
+        dispatcher.enviar('email', msg)
+
+
+def encode_cursor(criado_em, id):
+    """
+    Creates the opaque cursor pointing to an Anuncio in the keyset pagination
+
+    Args:
+        criado_em (datetime): creation date of the last Anuncio in the page
+        id (int): id of the last Anuncio in the page
+
+    Returns:
+        (str): the cursor to be sent to the client
+    """
+    valor = '{}|{}'.format(criado_em.strftime(CURSOR_FORMATO), id)
+    return urlsafe_b64encode(valor.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """
+    Decodes a cursor created by encode_cursor
+
+    Args:
+        cursor (str): the cursor received from the client
+
+    Returns:
+        (tuple): Containing the criado_em and the id of the Anuncio
+
+    Raises:
+        (ValueError): If the cursor is invalid
+    """
+    try:
+        valor = urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        criado_em, id = valor.rsplit('|', 1)
+        return datetime.strptime(criado_em, CURSOR_FORMATO), int(id)
+    except (TypeError, UnicodeError, ValueError) as e:
+        raise ValueError('Cursor invalido: {}'.format(e))
+
+
+def gerar_etag(*partes):
+    """
+    Creates a strong ETag from the values that version a response, like
+    ids and atualizado_em columns, or from its body
+
+    Args:
+        partes (list): the values, str or bytes
+
+    Returns:
+        (str): the ETag, without quotes
+    """
+    md5 = hashlib.md5()
+    for parte in partes:
+        if not isinstance(parte, bytes):
+            parte = str(parte).encode('utf-8')
+        md5.update(parte)
+        md5.update(b'|')
+    return md5.hexdigest()
+
+
+def parse_bool(valor):
+    """
+    Reads a boolean GET/POST param
+
+    Args:
+        valor (str): the value received
+
+    Returns:
+        (bool): True for 1, true, sim or on, False otherwise
+    """
+    return str(valor).strip().lower() in ['1', 'true', 'sim', 'on']
 
 
 def log(*data):
@@ -83,18 +176,25 @@ def get_parser(arg_list):
     """
     parser = RequestParser()
     args_types = {
-        'int': ['valor', 'ano'],
+        'int': [
+            'valor', 'ano', 'limit', 'valor_min', 'valor_max', 'ano_min',
+            'ano_max', 'horas', 'dias'
+        ],
         'str': [
             'email', 'telefone', 'tipo', 'cidade', 'estado',
             'facebook_id', 'nome', 'contato', 'texto', 'titulo', 'descricao', 'marca', 'cor',
-            'query', 'limit', 'order_by'
-        ]
+            'query', 'order_by', 'cursor', 'modelo', 'cidade_veiculo',
+            'estado_veiculo', 'format'
+        ],
+        'bool': ['troca', 'leilao', 'facetas']
     }
     for argument in arg_list:
         if argument in args_types['int']:
             _type = int
         elif argument in args_types['str']:
             _type = str
+        elif argument in args_types['bool']:
+            _type = parse_bool
         parser.add_argument(argument, type=_type, required=False)
 
     return parser
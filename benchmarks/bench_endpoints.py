@@ -0,0 +1,393 @@
+"""
+Benchmark of the main paths of the API and the admin.
+
+Seeds the database with a synthetic marketplace: Usuarios, their Anuncios
+with two Imagens each and the Buscas of the visitors, then times through
+the Flask test client the /anuncios listing, the /busca search, the Anuncio
+detail with the flush of its views, the POST of an Anuncio uploading the
+fixture photos of benchmarks.bench_images and the tabs of the admin.
+The tables of the database are dropped and created again, so it must be
+a database of its own: the one of TestConfig by default.
+
+Each result is printed as a JSON line with the commit of the tree. Save a
+run with --saida and pass it to --comparar in a later run to get the
+variation of each path.
+
+Usage:
+    python -m benchmarks.bench_endpoints [--usuarios N] [--anuncios N]
+        [--buscas N] [--repeticoes N] [--uri URI] [--saida ARQUIVO]
+        [--comparar ARQUIVO]
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+
+from datetime import datetime, timedelta
+
+LOTE = 1000
+MODELOS = {
+    'Fiat': ['Uno', 'Palio', 'Argo', 'Toro', 'Strada', 'Mobi'],
+    'Volkswagen': ['Gol', 'Polo', 'Fox', 'Voyage', 'Saveiro', 'T-Cross'],
+    'Chevrolet': ['Onix', 'Prisma', 'Cruze', 'S10', 'Celta', 'Tracker'],
+    'Ford': ['Ka', 'Fiesta', 'Focus', 'EcoSport', 'Ranger'],
+    'Honda': ['Civic', 'Fit', 'City', 'HR-V'],
+    'Toyota': ['Corolla', 'Etios', 'Hilux', 'Yaris'],
+    'Renault': ['Sandero', 'Logan', 'Duster', 'Kwid'],
+    'Hyundai': ['HB20', 'Creta', 'Tucson'],
+}
+CORES = ['Prata', 'Preto', 'Branco', 'Vermelho', 'Cinza', 'Azul']
+CIDADES = [('Sao Paulo', 'SP'), ('Campinas', 'SP'), ('Santos', 'SP'),
+           ('Rio de Janeiro', 'RJ'), ('Niteroi', 'RJ'),
+           ('Belo Horizonte', 'MG'), ('Curitiba', 'PR'),
+           ('Porto Alegre', 'RS'), ('Salvador', 'BA'), ('Recife', 'PE')]
+BUSCAS = ['{marca} {modelo}', '{modelo}', '{modelo} {ano}',
+          '{modelo} automatico', '{marca}', '{modelo} completo']
+
+
+def popular(db, usuarios, anuncios, buscas, semente=42):
+    """
+    Inserts the synthetic dataset and computes what the app derives from
+    it: query_busca, the facets and the counters of the Usuarios
+
+    Args:
+        db (flask_sqlalchemy.SQLAlchemy): the database
+        usuarios (int): number of Usuarios
+        anuncios (int): number of Anuncios, 90% of them approved
+        buscas (int): number of Buscas
+        semente (int): seed of the generator
+    """
+    from backend.models import Anuncio, Busca, Imagem, Usuario
+    from backend.tasks import (
+        recalcular_busca, reconstruir_facetas, reconciliar_contadores
+    )
+    aleatorio = random.Random(semente)
+    agora = datetime.now()
+    for inicio in range(1, usuarios + 1, LOTE):
+        linhas = []
+        for i in range(inicio, min(inicio + LOTE, usuarios + 1)):
+            cidade, estado = aleatorio.choice(CIDADES)
+            linhas.append({
+                'id': i, 'facebook_id': str(1000000 + i),
+                'nome': 'Usuario {}'.format(i),
+                'tipo': 'Garagem' if i % 10 == 0 else 'Pessoa Fisica',
+                'cidade': cidade, 'estado': estado,
+                'telefone': '11999999999',
+                'email': 'usuario{}@clozer.com.br'.format(i),
+                'views': aleatorio.randint(0, 500),
+                'cadastrado_em': agora - timedelta(days=i % 365),
+                'atualizado_em': agora
+            })
+        db.session.execute(Usuario.__table__.insert().values(linhas))
+
+    for inicio in range(1, anuncios + 1, LOTE):
+        linhas, imagens = [], []
+        for i in range(inicio, min(inicio + LOTE, anuncios + 1)):
+            marca = aleatorio.choice(sorted(MODELOS))
+            modelo = aleatorio.choice(MODELOS[marca])
+            cidade, estado = aleatorio.choice(CIDADES)
+            usuario_id = aleatorio.randint(1, usuarios)
+            linhas.append({
+                'id': i, 'usuario_id': usuario_id,
+                'titulo': '{} {} completo'.format(marca, modelo),
+                'descricao': 'Carro revisado, unico dono',
+                'valor': aleatorio.randint(8, 150) * 1000,
+                'marca': marca, 'modelo': modelo,
+                'ano': aleatorio.randint(2000, 2024),
+                'cor': aleatorio.choice(CORES),
+                'aprovado': aleatorio.random() < 0.9,
+                'views': aleatorio.randint(0, 2000),
+                'troca': aleatorio.random() < 0.3, 'leilao': False,
+                'cidade_veiculo': cidade, 'estado_veiculo': estado,
+                'criado_em': agora - timedelta(minutes=i * 7),
+                'atualizado_em': agora
+            })
+            imagens += [{
+                'id': 2 * i + j - 1, 'anuncio_id': i, 'status': 'pronta',
+                'img_filename': 'images/{}/{}/imagem{}.jpg'.format(
+                    usuario_id, i, j
+                )
+            } for j in range(2)]
+        db.session.execute(Anuncio.__table__.insert().values(linhas))
+        db.session.execute(Imagem.__table__.insert().values(imagens))
+
+    for inicio in range(0, buscas, LOTE):
+        linhas = []
+        for i in range(inicio, min(inicio + LOTE, buscas)):
+            marca = aleatorio.choice(sorted(MODELOS))
+            linhas.append({
+                'usuario': aleatorio.choice([0, 0, 0, i % usuarios + 1]),
+                'busca': aleatorio.choice(BUSCAS).format(
+                    marca=marca, modelo=aleatorio.choice(MODELOS[marca]),
+                    ano=aleatorio.randint(2000, 2024)
+                ).lower(),
+                'buscado_em': agora - timedelta(seconds=i * 30),
+                'resultados': aleatorio.randint(0, 50)
+            })
+        db.session.execute(Busca.__table__.insert().values(linhas))
+
+    # The ids were given explicitly, the next inserts follow them
+    for tabela in ['usuario', 'anuncio', 'imagem']:
+        db.session.execute(
+            "SELECT setval(pg_get_serial_sequence('{0}', 'id'), "
+            "(SELECT coalesce(max(id), 0) + 1 FROM {0}), false)".format(tabela)
+        )
+    db.session.commit()
+    recalcular_busca(lote=5000, reiniciar=True)
+    reconstruir_facetas()
+    reconciliar_contadores()
+    db.session.execute('ANALYZE')
+    db.session.commit()
+
+
+def medir(app, db, requisicao, repeticoes, preparar=None):
+    """
+    Runs the request repeticoes times after one warm up run
+
+    Args:
+        app (flask.Flask): the app
+        db (flask_sqlalchemy.SQLAlchemy): the database
+        requisicao (function): receives the test client and the number of
+                               the run, returns the response
+        repeticoes (int): runs measured
+        preparar (function): called before each run, not measured
+
+    Returns:
+        (dict): Containing the median and p95 in milliseconds and the
+                median of the queries executed
+    """
+    from sqlalchemy import event
+    queries = []
+
+    def contar(*args):
+        queries[-1] += 1
+
+    cliente = app.test_client()
+    tempos, contagens = [], []
+    event.listen(db.engine, 'before_cursor_execute', contar)
+    try:
+        for rodada in range(repeticoes + 1):
+            if preparar:
+                preparar()
+            db.session.remove()
+            queries.append(0)
+            inicio = time.perf_counter()
+            response = requisicao(cliente, rodada)
+            response.get_data()
+            duracao = time.perf_counter() - inicio
+            if response.status_code >= 400:
+                raise RuntimeError('{} {}'.format(response.status_code,
+                                                  response.get_data()))
+            if rodada:
+                tempos.append(duracao * 1000)
+                contagens.append(queries[-1])
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', contar)
+    tempos.sort()
+    return {
+        'mediana_ms': _mediana(tempos),
+        'p95_ms': tempos[min(int(len(tempos) * 0.95), len(tempos) - 1)],
+        'queries': _mediana(contagens)
+    }
+
+
+def caminhos(app, db, anuncios, fixtures):
+    """
+    The paths measured, each one a function of the test client and the
+    number of the run
+
+    Args:
+        app (flask.Flask): the app
+        db (flask_sqlalchemy.SQLAlchemy): the database
+        anuncios (int): number of Anuncios seeded
+        fixtures (dict): fixture photos mapped to their paths
+
+    Returns:
+        (list): tuples of name, request and the function run before it
+    """
+    from flask_jwt_extended import create_access_token
+    from werkzeug.datastructures import MultiDict
+
+    from backend.cache import anuncios_cache
+    from backend.counters import view_counter
+    from backend.models import Usuario
+    from backend.utils import create_identity
+    aleatorio = random.Random(7)
+    ids = [aleatorio.randint(1, anuncios) for _ in range(1000)]
+    buscas = ['fiat uno', 'gol', 'corolla 2018', 'onix automatico', 'civic']
+    with app.test_request_context():
+        usuario = db.session.query(Usuario).filter_by(id=1).one()
+        token = create_access_token(identity=create_identity(usuario))
+    autorizacao = {'Authorization': 'Bearer ' + token}
+
+    def anuncios_pagina(cliente, rodada):
+        return cliente.get('/api/v1/anuncios?limit=20')
+
+    def busca(cliente, rodada):
+        return cliente.get('/api/v1/busca?query={}'.format(
+            buscas[rodada % len(buscas)]
+        ))
+
+    def busca_filtros(cliente, rodada):
+        return cliente.get('/api/v1/busca?query=fiat&estado_veiculo=SP'
+                           '&valor_max=60000&facetas=1')
+
+    def detalhe(cliente, rodada):
+        return cliente.get('/api/v1/anuncio/{}'.format(ids[rodada]))
+
+    def detalhe_views(cliente, rodada):
+        # The view saved at once, as with VIEWS_WRITE_BEHIND False
+        response = cliente.get('/api/v1/anuncio/{}'.format(ids[rodada]))
+        view_counter.run_once()
+        return response
+
+    def upload(cliente, rodada):
+        arquivos = MultiDict([
+            ('imagens', (open(caminho, 'rb'), os.path.basename(caminho)))
+            for caminho in sorted(fixtures.values())
+        ])
+        arquivos.update({'titulo': 'Uno bench', 'valor': '20000',
+                         'marca': 'Fiat', 'modelo': 'Uno', 'ano': '2015'})
+        return cliente.post('/api/v1/anuncio', headers=autorizacao,
+                            data=arquivos, content_type='multipart/form-data')
+
+    def admin(aba):
+        return lambda cliente, rodada: cliente.get(
+            '/api/v1/admin?aba={}'.format(aba)
+        )
+
+    return [
+        ('anuncios_frio', anuncios_pagina, anuncios_cache.clear),
+        ('anuncios_cache', anuncios_pagina, None),
+        ('busca', busca, None),
+        ('busca_filtros_facetas', busca_filtros, None),
+        ('anuncio_detalhe', detalhe, view_counter.run_once),
+        ('anuncio_detalhe_views', detalhe_views, None),
+        ('upload_imagens', upload, None),
+    ] + [('admin_{}'.format(aba), admin(aba), None)
+         for aba in ['anuncios', 'usuarios', 'buscas', 'contatos']]
+
+
+def executar(usuarios=1000, anuncios=20000, buscas=50000, repeticoes=20,
+             uri=None):
+    """
+    Runs the benchmark
+
+    Args:
+        usuarios (int): number of Usuarios seeded
+        anuncios (int): number of Anuncios seeded
+        buscas (int): number of Buscas seeded
+        repeticoes (int): runs of each path
+        uri (str): SQLALCHEMY_DATABASE_URI, TestConfig's by default
+
+    Returns:
+        (list): one dict per path with the median and p95 in milliseconds
+    """
+    from benchmarks.bench_images import criar_fixtures
+    from backend.app import create_app, db
+    from backend.buscas import busca_logger
+    from backend.config import Config, TestConfig
+    from backend.counters import view_counter
+    imagens = tempfile.mkdtemp()
+    # api.py and images.py read the production Config
+    image_dir_original = Config.IMAGE_DIR
+    Config.IMAGE_DIR = imagens
+    configuracao = type('BenchConfig', (TestConfig,), {
+        'SQLALCHEMY_DATABASE_URI': uri or TestConfig.SQLALCHEMY_DATABASE_URI,
+        'IMAGE_DIR': imagens, 'DEBUG': False
+    })
+    app = create_app(configuracao)
+    fixtures_dir = os.path.join(tempfile.gettempdir(), 'clozer-bench-images')
+    if not os.path.exists(fixtures_dir):
+        os.makedirs(fixtures_dir)
+    fixtures = criar_fixtures(fixtures_dir)
+    # One phone photo per upload, as most of the Anuncios have
+    fixtures = {'12mp': fixtures['12mp']}
+    commit = _commit()
+    resultados = []
+    try:
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            inicio = time.time()
+            popular(db, usuarios, anuncios, buscas)
+            resultados.append({
+                'benchmark': 'endpoints_popular', 'commit': commit,
+                'usuarios': usuarios, 'anuncios': anuncios,
+                'buscas': buscas, 'segundos': time.time() - inicio
+            })
+            for nome, requisicao, preparar in caminhos(app, db, anuncios,
+                                                       fixtures):
+                resultado = {'benchmark': 'endpoints', 'caminho': nome,
+                             'commit': commit, 'anuncios': anuncios}
+                resultado.update(medir(app, db, requisicao, repeticoes,
+                                       preparar))
+                resultados.append(resultado)
+            # What the workers keep in memory is saved before the drop
+            busca_logger.run_once()
+            view_counter.run_once()
+            db.session.remove()
+            db.drop_all()
+    finally:
+        Config.IMAGE_DIR = image_dir_original
+        shutil.rmtree(imagens)
+    return resultados
+
+
+def comparar(resultados, anteriores):
+    """
+    Adds to each result the median of the same path in a previous run
+
+    Args:
+        resultados (list): results of this run
+        anteriores (list): results of the previous run
+    """
+    medianas = {r['caminho']: r['mediana_ms'] for r in anteriores
+                if 'caminho' in r}
+    for resultado in resultados:
+        anterior = medianas.get(resultado.get('caminho'))
+        if anterior:
+            resultado['anterior_mediana_ms'] = anterior
+            resultado['variacao'] = resultado['mediana_ms'] / anterior - 1
+
+
+def _commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _mediana(valores):
+    valores = sorted(valores)
+    return valores[len(valores) // 2]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--usuarios', type=int, default=1000)
+    parser.add_argument('--anuncios', type=int, default=20000)
+    parser.add_argument('--buscas', type=int, default=50000)
+    parser.add_argument('--repeticoes', type=int, default=20)
+    parser.add_argument('--uri', help='database to seed, its tables are '
+                                      'dropped')
+    parser.add_argument('--saida', help='file to save the results to')
+    parser.add_argument('--comparar', help='results saved by a previous run')
+    args = parser.parse_args()
+    resultados = executar(args.usuarios, args.anuncios, args.buscas,
+                          args.repeticoes, args.uri)
+    if args.comparar:
+        with open(args.comparar) as arquivo:
+            comparar(resultados, json.load(arquivo))
+    if args.saida:
+        with open(args.saida, 'w') as arquivo:
+            json.dump(resultados, arquivo, indent=2)
+    for resultado in resultados:
+        print(json.dumps(resultado))
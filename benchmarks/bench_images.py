@@ -0,0 +1,170 @@
+"""
+Benchmark of the image upload decoding.
+
+Compares the previous path, which read the whole upload into a BytesIO and
+decoded the full resolution image, with backend.images.processar_imagem,
+which decodes JPEGs in draft mode. Each run happens in a fresh process so
+its peak RSS can be measured.
+
+Usage:
+    python -m benchmarks.bench_images [--fixtures DIR] [--repeticoes N]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import tempfile
+import time
+
+from io import BytesIO
+
+from PIL import Image
+
+# Megapixels of the fixture photos, as produced by phone cameras
+TAMANHOS = {'12mp': (4000, 3000), '24mp': (6000, 4000), '48mp': (8000, 6000)}
+LARGURA = 1024
+MAX_PIXELS = 64000000
+
+
+def criar_fixtures(diretorio):
+    """
+    Creates the JPEG fixtures that do not exist yet
+
+    Args:
+        diretorio (str): directory of the fixtures
+
+    Returns:
+        (dict): fixture names mapped to their paths
+    """
+    fixtures = {}
+    for nome, tamanho in sorted(TAMANHOS.items()):
+        caminho = os.path.join(diretorio, '{}.jpg'.format(nome))
+        if not os.path.exists(caminho):
+            # Noise keeps the JPEG as hard to decode as a real photo
+            ruido = Image.effect_noise(tamanho, 64).convert('RGB')
+            ruido.save(caminho, 'JPEG', quality=90)
+        fixtures[nome] = caminho
+    return fixtures
+
+
+def caminho_anterior(origem, destino):
+    """
+    The decoding done by upload_images before the draft mode
+    """
+    with open(origem, 'rb') as file:
+        img = Image.open(BytesIO(file.read()))
+        wpercent = (LARGURA / float(img.size[0]))
+        height = int((float(img.size[1]) * float(wpercent)))
+        img = img.resize((LARGURA, height), Image.LANCZOS)
+        img.convert('RGB').save(destino, 'JPEG', quality=90)
+
+
+def caminho_atual(origem, destino):
+    """
+    The decoding done by backend.images.processar_imagem
+    """
+    from backend.images import processar_imagem
+    # processar_imagem removes the raw upload, as upload_images does
+    copia = destino + '.upload'
+    shutil.copyfile(origem, copia)
+    processar_imagem(copia, destino, LARGURA, MAX_PIXELS)
+
+
+def pico_rss_kb():
+    """
+    Returns:
+        (int): the peak RSS of this process in KB
+    """
+    # ru_maxrss survives exec on Linux, so the spawned process would
+    # report the peak of its parent. VmHWM belongs to this process only
+    try:
+        with open('/proc/self/status') as status:
+            for linha in status:
+                if linha.startswith('VmHWM:'):
+                    return int(linha.split()[1])
+    except IOError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _medir(caminho, origem, destino, fila):
+    funcao = {'anterior': caminho_anterior, 'atual': caminho_atual}[caminho]
+    if caminho == 'atual':
+        # Importing the backend is not part of the measure
+        import backend.images  # noqa
+    base = pico_rss_kb()
+    inicio = time.time()
+    funcao(origem, destino)
+    duracao = time.time() - inicio
+    fila.put({'segundos': duracao,
+              'pico_rss_mb': (pico_rss_kb() - base) / 1024.0})
+
+
+def medir(caminho, origem, destino):
+    """
+    Runs one decoding in a new process
+
+    Returns:
+        (dict): Containing the seconds and the peak RSS growth in MB
+    """
+    contexto = multiprocessing.get_context('spawn')
+    fila = contexto.Queue()
+    processo = contexto.Process(target=_medir,
+                                args=(caminho, origem, destino, fila))
+    processo.start()
+    resultado = fila.get()
+    processo.join()
+    return resultado
+
+
+def executar(fixtures_dir=None, repeticoes=3):
+    """
+    Runs the benchmark
+
+    Args:
+        fixtures_dir (str): directory to keep the fixtures between runs
+        repeticoes (int): runs of each path per fixture
+
+    Returns:
+        (list): one dict per fixture and path with the medians
+    """
+    fixtures_dir = fixtures_dir or os.path.join(tempfile.gettempdir(),
+                                                'clozer-bench-images')
+    if not os.path.exists(fixtures_dir):
+        os.makedirs(fixtures_dir)
+    fixtures = criar_fixtures(fixtures_dir)
+    saida = tempfile.mkdtemp()
+    resultados = []
+    try:
+        for nome, origem in sorted(fixtures.items()):
+            for caminho in ('anterior', 'atual'):
+                destino = os.path.join(saida, '{}-{}.jpg'.format(nome,
+                                                                 caminho))
+                medidas = [medir(caminho, origem, destino)
+                           for _ in range(repeticoes)]
+                resultados.append({
+                    'benchmark': 'decode_imagem', 'fixture': nome,
+                    'caminho': caminho,
+                    'segundos': _mediana([m['segundos'] for m in medidas]),
+                    'pico_rss_mb': _mediana([m['pico_rss_mb']
+                                             for m in medidas])
+                })
+    finally:
+        shutil.rmtree(saida)
+    return resultados
+
+
+def _mediana(valores):
+    valores = sorted(valores)
+    return valores[len(valores) // 2]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--fixtures', help='directory of the fixture photos')
+    parser.add_argument('--repeticoes', type=int, default=3)
+    args = parser.parse_args()
+    for resultado in executar(args.fixtures, args.repeticoes):
+        print(json.dumps(resultado))
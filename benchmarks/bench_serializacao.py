@@ -0,0 +1,141 @@
+"""
+Benchmark of the serialization of the Anuncio listings.
+
+Compares the ORM path, which loads Anuncio objects with their imagens and
+usuario and calls to_json on each, with the projection used by Anuncio.get,
+which reads plain rows with the imagens aggregated in SQL. Both outputs are
+checked to be equal as JSON, byte for byte.
+The rows are created in the database of TestConfig inside a transaction
+that is rolled back at the end.
+
+Usage:
+    python -m benchmarks.bench_serializacao [--linhas N ...] [--repeticoes N]
+"""
+import argparse
+import json
+import time
+
+from datetime import datetime, timedelta
+
+LOTE = 1000
+USUARIOS = 100
+
+
+def popular(db, quantidade):
+    """
+    Inserts the approved Anuncios, two Imagens each, and their Usuarios
+
+    Args:
+        db (flask_sqlalchemy.SQLAlchemy): the database
+        quantidade (int): number of Anuncios
+    """
+    from backend.models import Anuncio, Imagem, Usuario
+    agora = datetime.now()
+    usuarios = [{
+        'id': i, 'facebook_id': str(1000000 + i),
+        'nome': 'Garagem {}'.format(i), 'tipo': 'Garagem',
+        'cidade': 'Sao Paulo', 'estado': 'SP', 'telefone': '11999999999',
+        'email': 'garagem{}@clozer.com.br'.format(i), 'views': i,
+        'cadastrado_em': agora, 'atualizado_em': agora
+    } for i in range(1, USUARIOS + 1)]
+    db.session.execute(Usuario.__table__.insert().values(usuarios))
+
+    for inicio in range(1, quantidade + 1, LOTE):
+        ids = range(inicio, min(inicio + LOTE, quantidade + 1))
+        anuncios = [{
+            'id': i, 'usuario_id': i % USUARIOS + 1,
+            'titulo': 'Uno {} completo'.format(i),
+            'descricao': 'Carro revisado, unico dono', 'valor': 20000 + i,
+            'marca': 'Fiat', 'modelo': 'Uno', 'ano': 2000 + i % 20,
+            'cor': 'Prata', 'aprovado': True, 'views': i % 500,
+            'troca': i % 2 == 0, 'leilao': False,
+            'cidade_veiculo': 'Campinas', 'estado_veiculo': 'SP',
+            'criado_em': agora - timedelta(minutes=i), 'atualizado_em': agora
+        } for i in ids]
+        imagens = [{
+            'id': 2 * i + j, 'anuncio_id': i, 'status': 'pronta',
+            'img_filename': 'images/{}/{}/imagem{}.jpg'.format(
+                i % USUARIOS + 1, i, j
+            )
+        } for i in ids for j in range(2)]
+        db.session.execute(Anuncio.__table__.insert().values(anuncios))
+        db.session.execute(Imagem.__table__.insert().values(imagens))
+
+
+def caminho_orm(db, limite):
+    """
+    The listing as done before the projection
+    """
+    from backend.models import Anuncio
+    anuncios = Anuncio.query_completa().filter(Anuncio.aprovado).order_by(
+        Anuncio.criado_em.desc(), Anuncio.id.desc()
+    ).limit(limite).all()
+    return json.dumps([anuncio.to_json() for anuncio in anuncios])
+
+
+def caminho_projecao(db, limite):
+    """
+    The listing of Anuncio.get
+    """
+    from backend.models import Anuncio
+    anuncios, _ = Anuncio.get(None, limite)
+    return json.dumps(anuncios)
+
+
+def medir(db, caminho, limite, repeticoes):
+    """
+    Runs the listing repeticoes times with an empty session
+
+    Returns:
+        (tuple): Containing the median of the seconds and the JSON
+    """
+    tempos = []
+    for _ in range(repeticoes):
+        db.session.expunge_all()
+        inicio = time.perf_counter()
+        corpo = caminho(db, limite)
+        tempos.append(time.perf_counter() - inicio)
+    return sorted(tempos)[len(tempos) // 2], corpo
+
+
+def executar(linhas=(1000, 10000, 100000), repeticoes=3):
+    """
+    Runs the benchmark
+
+    Args:
+        linhas (list): numbers of Anuncios listed
+        repeticoes (int): runs of each measure, the median is reported
+
+    Returns:
+        (list): one dict per number of rows with the seconds of each path
+    """
+    from backend.app import create_app, db
+    from backend.config import TestConfig
+    app = create_app(TestConfig)
+    resultados = []
+    with app.app_context():
+        db.create_all()
+        try:
+            popular(db, max(linhas))
+            for limite in linhas:
+                orm, corpo_orm = medir(db, caminho_orm, limite, repeticoes)
+                projecao, corpo = medir(db, caminho_projecao, limite,
+                                        repeticoes)
+                resultados.append({
+                    'benchmark': 'serializacao_anuncios', 'linhas': limite,
+                    'orm_segundos': orm, 'projecao_segundos': projecao,
+                    'aceleracao': orm / projecao, 'iguais': corpo == corpo_orm
+                })
+        finally:
+            db.session.rollback()
+    return resultados
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--linhas', type=int, nargs='+',
+                        default=[1000, 10000, 100000])
+    parser.add_argument('--repeticoes', type=int, default=3)
+    args = parser.parse_args()
+    for resultado in executar(args.linhas, args.repeticoes):
+        print(json.dumps(resultado))
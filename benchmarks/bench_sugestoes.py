@@ -0,0 +1,89 @@
+"""
+Benchmark of the search suggestions lookups.
+
+Loads a backend.sugestoes.IndiceSugestoes with synthetic terms shaped like
+the searches of the site (marca, modelo, year) and measures the lookups of
+prefixes of every length, as typed by a user. No database is needed.
+
+Usage:
+    python -m benchmarks.bench_sugestoes [--termos N] [--consultas N]
+"""
+import argparse
+import json
+import random
+import time
+
+MARCAS = ['fiat', 'volkswagen', 'chevrolet', 'ford', 'honda', 'toyota',
+          'renault', 'hyundai', 'jeep', 'nissan', 'peugeot', 'citroen']
+PALAVRAS = ['uno', 'palio', 'gol', 'onix', 'ka', 'civic', 'corolla', 'sandero',
+            'hb20', 'renegade', 'kicks', '208', 'c3', 'automatico', 'flex',
+            'completo', 'turbo', 'sedan', 'hatch', 'cabine', 'dupla']
+
+
+def gerar_pesos(quantidade, semente=42):
+    """
+    Creates the synthetic terms with Zipf-like weights
+
+    Args:
+        quantidade (int): number of distinct terms
+        semente (int): seed of the generator
+
+    Returns:
+        (dict): terms mapped to their weights
+    """
+    aleatorio = random.Random(semente)
+    pesos = {}
+    while len(pesos) < quantidade:
+        partes = [aleatorio.choice(MARCAS)]
+        partes += aleatorio.sample(PALAVRAS, aleatorio.randint(1, 3))
+        if aleatorio.random() < 0.5:
+            partes.append(str(aleatorio.randint(1995, 2024)))
+        pesos[' '.join(partes)] = int(1000 / (len(pesos) + 1)) + 1
+    return pesos
+
+
+def executar(termos=50000, consultas=20000):
+    """
+    Runs the benchmark
+
+    Args:
+        termos (int): number of terms in the index
+        consultas (int): lookups per prefix length
+
+    Returns:
+        (list): one dict with the load time and one per prefix length
+                with the mean and p99 of the lookups in microseconds
+    """
+    from backend.sugestoes import IndiceSugestoes
+    pesos = gerar_pesos(termos)
+    indice = IndiceSugestoes(max_termos=termos)
+    inicio = time.time()
+    indice.carregar(pesos)
+    resultados = [{'benchmark': 'sugestoes_carregar', 'termos': termos,
+                   'segundos': time.time() - inicio}]
+
+    aleatorio = random.Random(7)
+    lista = list(pesos)
+    for tamanho in range(1, 9):
+        medidas = []
+        for _ in range(consultas):
+            prefixo = aleatorio.choice(lista)[:tamanho]
+            inicio = time.perf_counter()
+            indice.sugerir(prefixo)
+            medidas.append((time.perf_counter() - inicio) * 1e6)
+        medidas.sort()
+        resultados.append({
+            'benchmark': 'sugestoes_sugerir', 'prefixo': tamanho,
+            'media_us': sum(medidas) / len(medidas),
+            'p99_us': medidas[int(len(medidas) * 0.99)]
+        })
+    return resultados
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--termos', type=int, default=50000)
+    parser.add_argument('--consultas', type=int, default=20000)
+    args = parser.parse_args()
+    for resultado in executar(args.termos, args.consultas):
+        print(json.dumps(resultado))